@@ -1,48 +1,88 @@
 import streamlit as st
 import requests
+import asyncio
+import bisect
+import hashlib
+import io
 import json
+import math
+import numpy as np
+import os
+import queue
 import pandas as pd
-import plotly.express as px
+import pyarrow as pa
 import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # =============================================================================
 # PAGE CONFIG
 # =============================================================================
 
-st.set_page_config(
-    page_title="AI Data Assistant",
-    page_icon="✨",
-    layout="wide",
-    initial_sidebar_state="collapsed"
-)
+PAGE_CONFIG = {
+    "page_title": "AI Data Assistant",
+    "page_icon": "✨",
+    "layout": "wide",
+    "initial_sidebar_state": "collapsed"
+}
 
 # =============================================================================
 # SESSION STATE
 # =============================================================================
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+def init_session_state():
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+
+    if "selected_dataset" not in st.session_state:
+        st.session_state.selected_dataset = None
+
+    if "dataset_summary" not in st.session_state:
+        st.session_state.dataset_summary = None
+
+    if "pending_question" not in st.session_state:
+        st.session_state.pending_question = None
+
+    if "page" not in st.session_state:
+        st.session_state.page = "main"
+
+    if "ai_provider" not in st.session_state:
+        st.session_state.ai_provider = "groq"
 
-if "selected_dataset" not in st.session_state:
-    st.session_state.selected_dataset = None
+    if "stream_responses" not in st.session_state:
+        st.session_state.stream_responses = True
 
-if "dataset_summary" not in st.session_state:
-    st.session_state.dataset_summary = None
+    if "response_timings" not in st.session_state:
+        st.session_state.response_timings = []
 
-if "pending_question" not in st.session_state:
-    st.session_state.pending_question = None
+    if "hedge_delay" not in st.session_state:
+        st.session_state.hedge_delay = "Off"
 
-if "page" not in st.session_state:
-    st.session_state.page = "main"
+    if "session_key" not in st.session_state:
+        st.session_state.session_key = uuid.uuid4().hex
 
-if "ai_provider" not in st.session_state:
-    st.session_state.ai_provider = "groq"
+    if "active_job" not in st.session_state:
+        st.session_state.active_job = None
+        st.session_state.active_job_since = None
+
+    if "conversation_memory" not in st.session_state:
+        st.session_state.conversation_memory = None
 
 # =============================================================================
 # CUSTOM CSS
 # =============================================================================
 
-st.markdown("""
+APP_CSS = """
 <style>
     @import url('https://fonts.googleapis.com/css2?family=DM+Sans:wght@400;500;600;700&display=swap');
     
@@ -212,99 +252,2647 @@ st.markdown("""
         background: linear-gradient(135deg, #f0f4ff 0%, #e8ecff 100%);
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+CSS_SPACE_PATTERN = re.compile(r"\s*([{};:,>])\s*|\s+")
+
+@st.cache_resource
+def get_app_css():
+    # Whitespace collapsed once per process; the stylesheet is resent on every rerun
+    return CSS_SPACE_PATTERN.sub(lambda m: m.group(1) or " ", APP_CSS).strip()
+
+def inject_css():
+    # Emitted on every run: Streamlit drops elements a rerun does not send again
+    st.markdown(get_app_css(), unsafe_allow_html=True)
+
+# =============================================================================
+# TELEMETRY
+# =============================================================================
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+METRICS_SAMPLE_WINDOW = 2048
+METRICS_TEXTFILE_INTERVAL = 15
+
+METRIC_HELP = {
+    "llm_requests_total": "Provider chat completion requests by status code",
+    "llm_request_latency_ms": "Provider request latency, request start to last byte",
+    "llm_time_to_first_token_ms": "Streaming requests: request start to first content token",
+    "llm_tokens_total": "Tokens reported in provider usage blocks",
+    "llm_usage_reports_total": "Usage blocks received, by whether prefix-cache tokens were reported",
+    "hedge_races_total": "Interactive requests sent through the hedging race",
+    "hedge_wins_total": "Hedging races won, by provider",
+    "sheet_fetches_total": "Google Sheet tab fetches by outcome",
+    "sheet_fetch_latency_ms": "Google Sheet tab fetch latency",
+    "render_latency_ms": "Streamlit script run time by page",
+    "query_runs_total": "Local query-mode runs by engine and outcome",
+    "query_latency_ms": "Local query-mode execution time by engine",
+    "dataset_ingests_total": "Dataset tables (re-)ingested from their data_url, by outcome",
+    "llm_jobs_total": "Background LLM jobs by provider and outcome",
+    "llm_job_queue_wait_ms": "Background LLM jobs: submit to worker pickup",
+    "llm_job_queue_depth": "Background LLM jobs waiting for a worker",
+    "llm_jobs_running": "Background LLM jobs being served",
+    "llm_single_flight_total": "Keyed LLM submissions that started an upstream call (leader), joined one in this process (joined) or read another replica's answer (replica)",
+    "rate_limit_wait_ms": "Time requests waited in the provider rate limiter",
+    "rate_limit_shed_total": "Requests refused because the rate-limit wait would be too long",
+    "rate_limit_429_total": "429 responses received despite the limiter",
+    "rate_limit_queue_depth": "Requests waiting in the provider rate limiter",
+    "rate_limit_available": "Requests or tokens currently available in the limiter's buckets",
+    "conversation_context_tokens": "Tokens of conversation summary and recent turns sent with a question",
+    "cache_lookups_total": "Tiered cache lookups by the tier that answered (l1, l2) or miss",
+    "cache_loads_total": "Tiered cache misses that went upstream",
+    "cache_coalesced_total": "Tiered cache misses served by another caller's in-flight load",
+    "cube_answers_total": "Questions answered from the aggregate cube, not matching a cube slice, or deferred while a stale cube rebuilds",
+    "cube_answer_latency_ms": "Time to match a question and answer it from the aggregate cube",
+    "intent_routes_total": "Chat questions by the path that answered them (dashboard, cached, aggregate, llm)",
+    "intent_classify_ms": "Intent classification time per question"
+}
+
+class Histogram:
+    """Cumulative buckets for export plus a window of recent samples for live quantiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.samples = deque(maxlen=METRICS_SAMPLE_WINDOW)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.samples.append(value)
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Metrics:
+    """Process-wide counters and histograms, keyed by name and label set"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter_values(self, name):
+        """{labels dict as tuple: value} for every series of a counter"""
+        with self._lock:
+            return {labels: value for (metric, labels), value in self.counters.items() if metric == name}
+
+    def total(self, name, **labels):
+        wanted = set((k, str(v)) for k, v in labels.items())
+        return sum(value for series, value in self.counter_values(name).items() if wanted <= set(series))
+
+    def quantiles(self, name, qs=(0.5, 0.95, 0.99), **labels):
+        with self._lock:
+            histogram = self.histograms.get(self._key(name, labels))
+            if histogram is None:
+                return [None] * len(qs)
+            return [histogram.quantile(q) for q in qs]
+
+    def histogram_labels(self, name):
+        with self._lock:
+            return [dict(labels) for metric, labels in self.histograms if metric == name]
+
+    def to_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        def series(name, labels, extra=()):
+            parts = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+            return f"{name}{{{','.join(parts)}}}" if parts else name
+
+        lines = []
+        seen = set()
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            for (name, labels), value in counters:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{series(name, labels)} {value}")
+            for (name, labels), histogram in histograms:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{series(name + '_bucket', labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram.sum:.3f}")
+                lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        for collect in self.collectors:
+            # (name, type, value) or (name, type, value, labels dict)
+            for name, metric_type, value, *labels in collect():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                lines.append(f"{series(name, tuple(labels[0].items()) if labels else ())} {value}")
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_metrics():
+    metrics = Metrics()
+    metrics.collectors.append(response_cache_metrics)
+    metrics.collectors.append(llm_job_metrics)
+    metrics.collectors.append(rate_limit_metrics)
+    metrics.collectors.append(cache_tier_metrics)
+    return metrics
+
+def elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = get_metrics().to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def write_metrics_textfile(path):
+    while True:
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(get_metrics().to_prometheus())
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+        time.sleep(METRICS_TEXTFILE_INTERVAL)
+
+@st.cache_resource
+def start_metrics_exporters():
+    """METRICS_PORT serves /metrics for Prometheus; METRICS_TEXTFILE is rewritten every
+    15 s for node_exporter's textfile collector. Both are off unless configured."""
+    port = get_secret("METRICS_PORT")
+    if port:
+        server = ThreadingHTTPServer((get_secret("METRICS_HOST", "127.0.0.1"), int(port)), MetricsRequestHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    path = get_secret("METRICS_TEXTFILE")
+    if path:
+        threading.Thread(target=write_metrics_textfile, args=(path,), name="metrics-textfile", daemon=True).start()
+    return True
 
 # =============================================================================
 # GOOGLE SHEETS FUNCTIONS
 # =============================================================================
 
-@st.cache_data(ttl=300)
+SHEET_REFRESH_INTERVAL = 300
+SHEET_FETCH_TIMEOUT = 20
+SHEET_CACHE_DIR = ".cache/sheets"
+SHEET_SHARED_CACHE_PATH = os.path.join(".cache", "shared-sheets.sqlite")
+SHEET_SHARED_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class SheetSnapshot:
+    """One immutable parse of a sheet tab; replaced wholesale, never mutated"""
+    __slots__ = ("frame", "version", "etag", "changed_at")
+
+    def __init__(self, frame, version, etag, changed_at):
+        self.frame = frame
+        self.version = version
+        self.etag = etag
+        self.changed_at = changed_at
+
+class SheetDiskCache:
+    """Arrow IPC copies of a sheet's tabs, shared by every worker process on the host.
+
+    Each tab is stored as <tab>.<content hash>.arrow next to a small <tab>.json
+    manifest (version, ETag, fetch and change times). A file is written once per
+    content change and opened memory-mapped with Arrow-backed columns, so workers
+    share one page-cached copy and skip both the download and the CSV parse."""
+
+    def __init__(self, directory, sheet_id):
+        self.directory = os.path.join(directory, re.sub(r'[^\w\-]', '_', sheet_id))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, tab_name, suffix):
+        return os.path.join(self.directory, re.sub(r'[^\w\-]', '_', tab_name) + suffix)
+
+    def manifest(self, tab_name):
+        try:
+            with open(self.path(tab_name, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, tab_name, manifest):
+        path = self.path(tab_name, ".json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def touch(self, tab_name, fetched_at):
+        """Record a fetch that found no change, so other workers skip theirs"""
+        manifest = self.manifest(tab_name)
+        if manifest:
+            manifest["fetched_at"] = fetched_at
+            self.write_manifest(tab_name, manifest)
+
+    def load(self, tab_name, manifest):
+        try:
+            source = pa.memory_map(self.path(tab_name, f".{manifest['version']}.arrow"))
+            table = pa.ipc.open_file(source).read_all()
+        except (OSError, KeyError, pa.ArrowInvalid):
+            return None
+        frame = table.to_pandas(types_mapper=pd.ArrowDtype)
+        return SheetSnapshot(frame, manifest["version"], manifest.get("etag"), manifest["changed_at"])
+
+    def store(self, tab_name, frame, version, etag, fetched_at):
+        path = self.path(tab_name, f".{version}.arrow")
+        if not os.path.exists(path):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, path)
+        manifest = {"version": version, "etag": etag, "fetched_at": fetched_at, "changed_at": fetched_at}
+        self.write_manifest(tab_name, manifest)
+        prefix = os.path.basename(self.path(tab_name, "."))
+        for name in os.listdir(self.directory):
+            # Workers still mapping an old version keep it alive until they swap
+            if name.startswith(prefix) and name.endswith(".arrow") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        return manifest
+
+class SheetSync:
+    """Stale-while-revalidate copy of a Google Sheet's tabs.
+
+    The first read of a tab fetches it inline; after that a daemon thread re-fetches
+    every `interval` seconds and readers always get the current snapshot without
+    touching the network. A tab is only re-parsed when its ETag or content hash
+    changes, and the new snapshot is swapped in with a single reference assignment.
+
+    With a SheetDiskCache, a cold start reads the tabs from disk, and a refresh is
+    skipped (or served from disk) when another worker fetched the tab within the
+    interval. With a shared TieredCache, replicas on other hosts reuse a download
+    made within the interval, and concurrent refreshes of a tab download it once."""
+
+    def __init__(self, sheet_id, interval=SHEET_REFRESH_INTERVAL, disk=None, shared=None):
+        self.sheet_id = sheet_id
+        self.interval = interval
+        self.disk = disk
+        self.shared = shared
+        self._snapshots = {}
+        self._fetched_at = {}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheet-sync")
+        threading.Thread(target=self._poll, name="sheet-sync-poller", daemon=True).start()
+
+    def url(self, tab_name):
+        return f"https://docs.google.com/spreadsheets/d/{self.sheet_id}/gviz/tq?tqx=out:csv&sheet={tab_name}"
+
+    def get(self, tab_name):
+        snapshot = self._snapshots.get(tab_name)
+        if snapshot is None and self.disk:
+            snapshot = self.load_from_disk(tab_name)
+        if snapshot is None:
+            return self.refresh(tab_name)
+        if time.time() - self._fetched_at.get(tab_name, 0) > self.interval:
+            self.refresh_in_background(tab_name)
+        return snapshot
+
+    def load_from_disk(self, tab_name):
+        """Swap in the on-disk copy of a tab; its age decides when the next fetch is due"""
+        manifest = self.disk.manifest(tab_name)
+        snapshot = self.disk.load(tab_name, manifest) if manifest else None
+        if snapshot is not None:
+            self._snapshots[tab_name] = snapshot
+            self._fetched_at[tab_name] = manifest["fetched_at"]
+            get_metrics().inc("sheet_fetches_total", tab=tab_name, outcome="disk")
+        return snapshot
+
+    def refresh_in_background(self, tab_name, force=False):
+        with self._lock:
+            if tab_name in self._refreshing:
+                return
+            self._refreshing.add(tab_name)
+        self._executor.submit(self.refresh, tab_name, force)
+
+    def refresh(self, tab_name, force=False):
+        current = self._snapshots.get(tab_name)
+        manifest = self.disk.manifest(tab_name) if self.disk else None
+        if not force and manifest and time.time() - manifest["fetched_at"] < self.interval:
+            # Another worker checked the sheet recently; use its copy instead of the network
+            with self._lock:
+                self._refreshing.discard(tab_name)
+            if current and current.version == manifest["version"]:
+                self._fetched_at[tab_name] = manifest["fetched_at"]
+                return current
+            return self.load_from_disk(tab_name) or current
+        start = time.perf_counter()
+        outcome = "error"
+        fetched_at = time.time()
+        from_shared = False
+        try:
+            if self.shared is not None:
+                content, etag, fetched_at, downloaded = self.fetch_shared(tab_name, force)
+                from_shared = not downloaded
+            else:
+                headers = {"If-None-Match": current.etag} if current and current.etag else {}
+                response = get_http_session().get(self.url(tab_name), headers=headers, timeout=SHEET_FETCH_TIMEOUT)
+                if response.status_code == 304:
+                    outcome = "not_modified"
+                    if self.disk:
+                        self.disk.touch(tab_name, fetched_at)
+                    return current
+                response.raise_for_status()
+                content, etag = response.content, response.headers.get("ETag")
+            version = hashlib.sha1(content).hexdigest()[:12]
+            if current and current.version == version:
+                outcome = "shared" if from_shared else "unchanged"
+                if self.disk:
+                    self.disk.touch(tab_name, fetched_at)
+                return current
+            frame = pd.read_csv(io.BytesIO(content))
+            snapshot = SheetSnapshot(frame, version, etag, time.time())
+            if self.disk:
+                try:
+                    manifest = self.disk.store(tab_name, frame, version, snapshot.etag, snapshot.changed_at)
+                    snapshot = self.disk.load(tab_name, manifest) or snapshot
+                except (OSError, pa.ArrowException):
+                    pass
+            self._snapshots[tab_name] = snapshot
+            outcome = "shared" if from_shared else "changed"
+            return snapshot
+        except Exception:
+            return current
+        finally:
+            metrics = get_metrics()
+            metrics.inc("sheet_fetches_total", tab=tab_name, outcome=outcome)
+            metrics.observe("sheet_fetch_latency_ms", elapsed_ms(start), tab=tab_name)
+            # A shared download's age, not ours, decides when the next check is due
+            self._fetched_at[tab_name] = fetched_at
+            with self._lock:
+                self._refreshing.discard(tab_name)
+
+    def fetch_shared(self, tab_name, force=False):
+        """(CSV bytes, ETag, fetch time, downloaded here) through the shared cache.
+        Downloads are unconditional so the cached entry always carries the content."""
+        downloaded = []
+
+        def download():
+            response = get_http_session().get(self.url(tab_name), timeout=SHEET_FETCH_TIMEOUT)
+            response.raise_for_status()
+            downloaded.append(True)
+            return json.dumps({
+                "csv": response.content.decode("utf-8"),
+                "etag": response.headers.get("ETag"),
+                "fetched_at": time.time()
+            })
+
+        key = f"sheet|{self.sheet_id}|{tab_name}"
+        if force:
+            entry = download()
+            self.shared.set(key, entry, self.interval)
+        else:
+            entry = self.shared.get_or_load(key, download, self.interval)
+        entry = json.loads(entry)
+        return entry["csv"].encode("utf-8"), entry["etag"], entry["fetched_at"], bool(downloaded)
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            for tab_name in list(self._snapshots):
+                self.refresh_in_background(tab_name)
+
+    def status(self):
+        now = time.time()
+        return [
+            {
+                "tab": tab_name,
+                "version": snapshot.version,
+                "rows": len(snapshot.frame),
+                "checked": f"{now - self._fetched_at.get(tab_name, now):.0f}s ago",
+                "changed": f"{now - snapshot.changed_at:.0f}s ago"
+            }
+            for tab_name, snapshot in self._snapshots.items()
+        ]
+
+@st.cache_resource
+def get_sheet_cache():
+    """Shared tier for sheet downloads; SHEET_SHARED_CACHE=sqlite|redis (default off)"""
+    backend_name = str(get_secret("SHEET_SHARED_CACHE", "off")).lower()
+    if backend_name not in ("sqlite", "redis"):
+        return None
+    return create_cache_backend(
+        backend_name,
+        get_secret("SHEET_SHARED_CACHE_PATH", SHEET_SHARED_CACHE_PATH),
+        "sheet:",
+        int(get_secret("SHEET_SHARED_CACHE_MAX_BYTES", SHEET_SHARED_CACHE_MAX_BYTES))
+    )
+
+@st.cache_resource
+def get_sheet_sync(sheet_id):
+    directory = get_secret("SHEET_CACHE_DIR", SHEET_CACHE_DIR)
+    disk = None
+    if directory and str(directory).lower() not in ("0", "off", "false"):
+        try:
+            disk = SheetDiskCache(directory, sheet_id)
+        except OSError:
+            pass
+    return SheetSync(sheet_id, disk=disk, shared=get_sheet_cache())
+
 def load_google_sheet_data(sheet_id, tab_name):
-    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={tab_name}"
+    snapshot = get_sheet_sync(sheet_id).get(tab_name)
+    return snapshot.frame if snapshot else None
+
+# =============================================================================
+# DATASET INDEX
+# =============================================================================
+
+SHEET_TABS = ("Datasets", "Stats", "Dashboards")
+
+class StatRecord:
+    """Read-only stat row. Supports the dict-style .get()/[] access the prompt code uses."""
+    __slots__ = ("dataset_id", "stat_category", "stat_name", "stat_value")
+
+    def __init__(self, dataset_id, stat_category, stat_name, stat_value):
+        object.__setattr__(self, "dataset_id", dataset_id)
+        object.__setattr__(self, "stat_category", stat_category)
+        object.__setattr__(self, "stat_name", stat_name)
+        object.__setattr__(self, "stat_value", stat_value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StatRecord is immutable")
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __repr__(self):
+        return f"StatRecord({self.dataset_id!r}, {self.stat_category!r}, {self.stat_name!r}, {self.stat_value!r})"
+
+class DatasetStats(tuple):
+    """Stat records for one dataset, contiguous by category, with a content version"""
+
+    def __new__(cls, records=(), version="", categories=None):
+        stats = super().__new__(cls, records)
+        stats.version = version
+        stats.categories = categories or {}
+        return stats
+
+EMPTY_STATS = DatasetStats()
+
+class DatasetHighlights:
+    """Sidebar stat tiles, as (icon, value, label), and key facts for one dataset"""
+    __slots__ = ("tiles", "facts")
+
+    def __init__(self, tiles=(), facts=()):
+        self.tiles = tiles
+        self.facts = facts
+
+EMPTY_HIGHLIGHTS = DatasetHighlights()
+
+class DatasetIndex:
+    """Everything the request path needs from the sheet, built once per sheet version"""
+    __slots__ = ("version", "datasets", "stats", "dashboards", "highlights")
+
+    def __init__(self, version, datasets, stats, dashboards, highlights):
+        self.version = version
+        self.datasets = datasets
+        self.stats = stats
+        self.dashboards = dashboards
+        self.highlights = highlights
+
+EMPTY_INDEX = DatasetIndex(None, (), {}, {}, {})
+
+def is_missing(value):
     try:
-        return pd.read_csv(url)
-    except:
-        return None
+        return value is None or bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
 
-def get_datasets():
+def frame_records(frame):
+    """Rows as read-only mappings, with empty cells dropped so .get() defaults apply"""
+    if frame is None:
+        return ()
+    return tuple(
+        MappingProxyType({k: v for k, v in row.items() if not is_missing(v)})
+        for row in frame.to_dict('records')
+    )
+
+def group_by_dataset(records):
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record.get('dataset_id'), []).append(record)
+    return grouped
+
+def build_stats_index(rows):
+    stats = {}
+    for dataset_id, dataset_rows in group_by_dataset(rows).items():
+        categories = {}
+        for row in dataset_rows:
+            record = StatRecord(dataset_id, row.get('stat_category'), row.get('stat_name'), row.get('stat_value'))
+            categories.setdefault(record.get('stat_category', 'general'), []).append(record)
+        categories = {category: tuple(records) for category, records in categories.items()}
+        records = tuple(record for group in categories.values() for record in group)
+        payload = json.dumps([[r.stat_category, r.stat_name, r.stat_value] for r in records], default=str)
+        version = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+        stats[dataset_id] = DatasetStats(records, version, MappingProxyType(categories))
+    return MappingProxyType(stats)
+
+# Stats tab rows that can fill a tile: stat_name pattern -> tile, for sheets
+# without the structured Datasets columns
+KEY_STAT_NAME_PATTERNS = (
+    ("total", re.compile(r"^(?:total|number of)\s+(\w+)", re.IGNORECASE)),
+    ("avg_price", re.compile(r"^(?:average|avg\.?|mean)\s+price$", re.IGNORECASE)),
+    ("max_price", re.compile(r"^(?:max(?:imum)?|highest)\s+price$", re.IGNORECASE)),
+)
+
+def format_stat_value(value, money=False):
+    if isinstance(value, (int, float)):
+        # Sheet numbers arrive as floats; keep cents only where they matter
+        value = f"{value:,.0f}" if value == int(value) or abs(value) >= 1000 else f"{value:,.2f}"
+    value = str(value).strip()
+    return f"${value}" if money and not value.startswith("$") else value
+
+def build_highlights(dataset, stats):
+    """Tiles and facts from, in order of preference: the Datasets tab's total_records,
+    record_label, avg_price, max_price and key_facts columns; Stats tab rows with
+    matching names; the dataset summary. Tiles with no source are left out."""
+    summary = str(dataset.get('summary', ''))
+    found = {}
+    for key, pattern in KEY_STAT_NAME_PATTERNS:
+        for record in stats:
+            match = pattern.match(str(record.get('stat_name', '')).strip())
+            if match and record.get('stat_value') is not None:
+                found[key] = format_stat_value(record.get('stat_value'), money=key != "total")
+                if key == "total":
+                    found["total_label"] = match.group(1).title()
+                break
+    parsed = None
+    for key, column in (("total", "total_records"), ("avg_price", "avg_price"), ("max_price", "max_price")):
+        if dataset.get(column) is not None:
+            found[key] = format_stat_value(dataset.get(column), money=key != "total")
+        elif key not in found:
+            if parsed is None:
+                parsed = extract_key_stats(summary)
+            if key in parsed:
+                found[key] = parsed[key]
+                if key == "total":
+                    found["total_label"] = parsed["total_label"]
+    if dataset.get('record_label') is not None:
+        found["total_label"] = str(dataset.get('record_label'))
+
+    tiles = tuple(
+        (icon, found[key], label)
+        for key, icon, label in (
+            ("total", "📊", found.get("total_label", "Records")),
+            ("avg_price", "💰", "Average Price"),
+            ("max_price", "📈", "Maximum Price")
+        )
+        if key in found
+    )
+    if dataset.get('key_facts') is not None:
+        facts = tuple(
+            format_plain_text(fact.strip()).rstrip('.')
+            for fact in re.split(r"\s*(?:\n|\|)\s*", str(dataset.get('key_facts'))) if fact.strip()
+        )
+    else:
+        facts = tuple(parse_summary_to_facts(summary))
+    return DatasetHighlights(tiles, facts)
+
+@st.cache_resource(max_entries=4)
+def build_dataset_index(sheet_id, versions, _snapshots):
+    frames = {tab: snapshot.frame if snapshot else None for tab, snapshot in _snapshots.items()}
+    dashboards = group_by_dataset(frame_records(frames["Dashboards"]))
+    datasets = frame_records(frames["Datasets"])
+    stats = build_stats_index(frame_records(frames["Stats"]))
+    return DatasetIndex(
+        versions,
+        datasets,
+        stats,
+        MappingProxyType({k: tuple(v) for k, v in dashboards.items()}),
+        MappingProxyType({
+            ds.get('dataset_id'): build_highlights(ds, stats.get(ds.get('dataset_id'), EMPTY_STATS))
+            for ds in datasets
+        })
+    )
+
+def get_dataset_index():
     try:
-        sheet_id = st.secrets["GOOGLE_SHEET_ID"]
-        df = load_google_sheet_data(sheet_id, "Datasets")
-        if df is not None:
-            return df.to_dict('records')
-    except:
-        pass
-    return []
+        sheet_id = get_secret("GOOGLE_SHEET_ID")
+        if not sheet_id:
+            return EMPTY_INDEX
+        sync = get_sheet_sync(sheet_id)
+        snapshots = {tab: sync.get(tab) for tab in SHEET_TABS}
+        versions = tuple(snapshot.version if snapshot else None for snapshot in snapshots.values())
+        return build_dataset_index(sheet_id, versions, snapshots)
+    except Exception:
+        return EMPTY_INDEX
+
+def get_datasets():
+    return get_dataset_index().datasets
 
 def get_stats(dataset_id):
-    try:
-        sheet_id = st.secrets["GOOGLE_SHEET_ID"]
-        df = load_google_sheet_data(sheet_id, "Stats")
-        if df is not None:
-            return df[df['dataset_id'] == dataset_id].to_dict('records')
-    except:
-        pass
-    return []
+    return get_dataset_index().stats.get(dataset_id, EMPTY_STATS)
 
 def get_dashboards(dataset_id):
+    return get_dataset_index().dashboards.get(dataset_id, ())
+
+def get_highlights(dataset_id):
+    return get_dataset_index().highlights.get(dataset_id, EMPTY_HIGHLIGHTS)
+
+# =============================================================================
+# STATS RETRIEVAL
+# =============================================================================
+
+RETRIEVAL_TOP_K = 25
+RETRIEVAL_TOKEN_BUDGET = 1200
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from how i in is it me of on or show the "
+    "to vs was were what which who why with".split()
+)
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    """Local token estimate: words, numbers and punctuation marks count as one token each"""
+    return len(TOKEN_PATTERN.findall(text))
+
+def tokenize_for_search(text):
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", str(text).lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+class StatsRetriever:
+    """BM25 over stat_category/stat_name/stat_value for one dataset's stats"""
+
+    def __init__(self, stats, k1=1.5, b=0.75):
+        self.stats = stats
+        self.k1 = k1
+        self.b = b
+        self.docs = []
+        self.lines = []
+        document_frequency = {}
+        for stat in stats:
+            terms = tokenize_for_search(f"{stat.get('stat_category', '')} {stat.get('stat_name', '')} {stat.get('stat_value', '')}")
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term in counts:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+            self.docs.append((counts, len(terms)))
+            self.lines.append(count_tokens(f"- {stat.get('stat_name', 'N/A')}: {stat.get('stat_value', 'N/A')}"))
+        total = len(self.docs)
+        self.avg_length = sum(length for _, length in self.docs) / total if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def score(self, question):
+        terms = set(tokenize_for_search(question))
+        scores = []
+        for counts, length in self.docs:
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, question, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+        """Best-matching stats within top_k and token_budget, kept in their original (category) order"""
+        scores = self.score(question)
+        ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+        if not any(scores):
+            ranked = list(range(len(scores)))
+        chosen = []
+        used = 0
+        for i in ranked[:top_k]:
+            if used + self.lines[i] > token_budget:
+                continue
+            chosen.append(i)
+            used += self.lines[i]
+        return tuple(self.stats[i] for i in sorted(chosen))
+
+@st.cache_resource(max_entries=64)
+def get_stats_retriever(dataset_key, version, _stats):
+    return StatsRetriever(_stats)
+
+@st.cache_resource
+def get_retrieval_settings():
+    # Process-wide so background jobs see the same knobs as the admin page
+    return {
+        "enabled": str(get_secret("STATS_RETRIEVAL", "on")).lower() not in ("0", "off", "false"),
+        "top_k": int(get_secret("STATS_RETRIEVAL_TOP_K", RETRIEVAL_TOP_K)),
+        "token_budget": int(get_secret("STATS_RETRIEVAL_TOKEN_BUDGET", RETRIEVAL_TOKEN_BUDGET))
+    }
+
+def select_prompt_stats(question, stats):
+    settings = get_retrieval_settings()
+    if not settings["enabled"] or not stats:
+        return stats
+    version = getattr(stats, "version", None)
+    if version:
+        retriever = get_stats_retriever(stats[0].get('dataset_id'), version, stats)
+    else:
+        retriever = StatsRetriever(stats)
+    if len(stats) <= settings["top_k"] and sum(retriever.lines) <= settings["token_budget"]:
+        return stats
+    return retriever.select(question, settings["top_k"], settings["token_budget"])
+
+# =============================================================================
+# CONVERSATION MEMORY
+# =============================================================================
+
+MEMORY_TURN_BUDGET = 1200
+MEMORY_SUMMARY_BUDGET = 300
+MEMORY_MESSAGE_MAX_TOKENS = 300
+MEMORY_DIGEST_TOKENS = 30
+MEMORY_TOPIC_LIMIT = 20
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?])\s')
+
+@st.cache_resource
+def get_memory_settings():
+    return {
+        "enabled": str(get_secret("CONVERSATION_MEMORY", "on")).lower() not in ("0", "off", "false"),
+        "turn_budget": int(get_secret("MEMORY_TURN_BUDGET", MEMORY_TURN_BUDGET)),
+        "summary_budget": int(get_secret("MEMORY_SUMMARY_BUDGET", MEMORY_SUMMARY_BUDGET))
+    }
+
+def truncate_tokens(text, limit):
+    """text cut after `limit` tokens as counted by count_tokens"""
+    for i, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if i == limit:
+            return text[:match.start()].rstrip() + " …"
+    return text
+
+def memory_entry(msg):
+    """(text, tokens) of a message as replayed to the model: answers lose their
+    chart JSON, embeds and follow-ups. Cached on the message like "rendered"."""
+    entry = msg.get("memory")
+    if entry is None:
+        text = msg["content"] if msg["role"] == "user" else parse_response(msg["content"]).body
+        text = truncate_tokens(text, MEMORY_MESSAGE_MAX_TOKENS)
+        entry = msg["memory"] = (text, count_tokens(text))
+    return entry
+
+class ConversationMemory:
+    """Recent turns within a token budget plus a rolling summary of older ones.
+
+    A turn is digested into one summary line when it leaves the recent window, and
+    only then, so each call does work proportional to the window, not the whole
+    conversation. When the digests outgrow their budget the oldest are reduced to
+    the keywords of their questions."""
+    __slots__ = ("folded", "digests", "topics", "tokens")
+
+    def __init__(self):
+        self.folded = 0
+        self.digests = deque()
+        self.topics = {}
+        self.tokens = 0
+
+    def context(self, messages, turn_budget=MEMORY_TURN_BUDGET, summary_budget=MEMORY_SUMMARY_BUDGET):
+        """(summary or None, recent messages) for the turns before the current question"""
+        start = len(messages)
+        used = 0
+        for i in range(len(messages) - 1, self.folded - 1, -1):
+            tokens = memory_entry(messages[i])[1]
+            if used + tokens > turn_budget:
+                break
+            used += tokens
+            start = i
+        # Replay whole turns: the window starts on a user message
+        while start < len(messages) and messages[start]["role"] != "user":
+            start += 1
+        if start > self.folded:
+            self._fold(messages[self.folded:start], summary_budget)
+            self.folded = start
+        recent = [{"role": m["role"], "content": memory_entry(m)[0]} for m in messages[start:]]
+        return self.summary(), recent
+
+    def _fold(self, messages, summary_budget):
+        question = None
+        for msg in messages:
+            text = memory_entry(msg)[0]
+            if msg["role"] == "user":
+                question = text
+                continue
+            answer = SENTENCE_END_PATTERN.split(text, 1)[0]
+            line = f"- Q: {truncate_tokens(question or '', MEMORY_DIGEST_TOKENS)} A: {truncate_tokens(answer, MEMORY_DIGEST_TOKENS)}"
+            tokens = count_tokens(line)
+            self.digests.append((question or "", line, tokens))
+            self.tokens += tokens
+        while self.tokens > summary_budget and len(self.digests) > 1:
+            question, _, tokens = self.digests.popleft()
+            self.tokens -= tokens
+            for word in tokenize_for_search(question):
+                self.topics[word] = self.topics.get(word, 0) + 1
+
+    def summary(self):
+        lines = []
+        if self.topics:
+            top = sorted(self.topics, key=lambda word: -self.topics[word])[:MEMORY_TOPIC_LIMIT]
+            lines.append(f"Earlier topics: {', '.join(top)}")
+        lines.extend(line for _, line, _ in self.digests)
+        return "\n".join(lines) or None
+
+def get_conversation_context():
+    """Memory for the question just appended to st.session_state.messages, or None"""
+    settings = get_memory_settings()
+    messages = st.session_state.messages[:-1]
+    if not settings["enabled"] or not messages:
+        return None
+    if st.session_state.conversation_memory is None:
+        st.session_state.conversation_memory = ConversationMemory()
+    summary, recent = st.session_state.conversation_memory.context(
+        messages, settings["turn_budget"], settings["summary_budget"]
+    )
+    tokens = sum(count_tokens(m["content"]) for m in recent) + (count_tokens(summary) if summary else 0)
+    get_metrics().observe("conversation_context_tokens", tokens)
+    return summary, recent
+
+# =============================================================================
+# LOCAL QUERY ENGINE
+# =============================================================================
+
+DATA_DIR = "data"
+QUERY_OPERATORS = ("==", "!=", ">", ">=", "<", "<=", "in", "not in", "between", "contains")
+QUERY_AGGREGATES = ("count", "sum", "mean", "median", "min", "max", "nunique", "p25", "p75", "p90")
+QUERY_PERCENTILES = {"p25": 0.25, "p75": 0.75, "p90": 0.9}
+QUERY_MAX_GROUP_BY = 2
+QUERY_MAX_METRICS = 4
+QUERY_MAX_FILTERS = 8
+QUERY_MAX_ROWS = 500
+QUERY_SCHEMA_MAX_VALUES = 30
+QUERY_TIME_COLUMNS = ("year", "month", "date")
+QUERY_ENGINES = ("auto", "numpy", "duckdb", "pandas")
+QUERY_BLOCK_PATTERN = re.compile(r'```query\s*(.*?)\s*```', re.DOTALL)
+DATASET_ID_PATTERN = re.compile(r'[\w\-]+')
+DATASET_SOURCE_KEY = b"dataset_source"
+SOURCE_CHECK_INTERVAL = 300
+# Sources without ETag/Last-Modified can only be compared by downloading them
+SOURCE_HASH_CHECK_INTERVAL = 6 * 60 * 60
+SOURCE_CHECK_TIMEOUT = 30
+
+class QueryError(ValueError):
+    """A query block that does not fit the spec or the table"""
+
+class DatasetTable:
+    """One dataset's full table as loaded from its Parquet file, plus the schema
+    the model is shown. Text columns are categoricals, so filters and group-bys
+    work on integer codes. Per-column codes, float values and sort orders are
+    derived on first use and reused by every later query."""
+    __slots__ = ("dataset_id", "path", "version", "frame", "schema", "_text_values", "_codes", "_values", "_orders")
+
+    def __init__(self, dataset_id, path, version, frame):
+        self.dataset_id = dataset_id
+        self.path = path
+        self.version = version
+        self.frame = frame
+        self.schema = describe_columns(frame)
+        self._text_values = {}
+        self._codes = {}
+        self._values = {}
+        self._orders = {}
+
+    def group_codes(self, column):
+        """(int32 codes with -1 for missing, labels) for grouping by a column"""
+        cached = self._codes.get(column)
+        if cached is None:
+            series = self.frame[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                cached = (series.cat.codes.to_numpy().astype(np.int32), series.cat.categories)
+            else:
+                codes, labels = pd.factorize(series, sort=True)
+                cached = (codes.astype(np.int32), labels)
+            self._codes[column] = cached
+        return cached
+
+    def numeric_values(self, column):
+        values = self._values.get(column)
+        if values is None:
+            values = self.frame[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            self._values[column] = values
+        return values
+
+    def value_order(self, column):
+        """Row positions sorted by a numeric column, missing values last"""
+        order = self._orders.get(column)
+        if order is None:
+            order = np.argsort(self.numeric_values(column), kind="stable")
+            self._orders[column] = order
+        return order
+
+    def resolve_text(self, column, value):
+        """Map a model-written value onto the column's actual spelling (case-insensitive)"""
+        lookup = self._text_values.get(column)
+        if lookup is None:
+            series = self.frame[column]
+            values = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series.dropna().unique()
+            lookup = {str(v).strip().lower(): v for v in values}
+            self._text_values[column] = lookup
+        return lookup.get(str(value).strip().lower(), value)
+
+def describe_columns(frame):
+    schema = {}
+    for column in frame.columns:
+        series = frame[column]
+        if pd.api.types.is_bool_dtype(series):
+            schema[column] = {"type": "text", "values": ["False", "True"]}
+        elif pd.api.types.is_numeric_dtype(series):
+            schema[column] = {"type": "number", "min": series.min(), "max": series.max()}
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            schema[column] = {"type": "date", "min": series.min(), "max": series.max()}
+        else:
+            values = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series.dropna().unique()
+            schema[column] = {"type": "text", "count": len(values), "values": sorted(map(str, values))[:QUERY_SCHEMA_MAX_VALUES]}
+    return schema
+
+def format_schema_for_prompt(schema):
+    lines = []
+    for column, info in schema.items():
+        if info["type"] == "text":
+            sample = ", ".join(info["values"])
+            more = f" ({info['count']} values)" if info["count"] > len(info["values"]) else ""
+            lines.append(f"- {column} (text): {sample}{more}")
+        else:
+            lines.append(f"- {column} ({info['type']}): {info['min']} to {info['max']}")
+    return "\n".join(lines)
+
+def is_text_column(series):
+    # object in pandas 2, the str dtype in pandas 3
+    return not isinstance(series.dtype, pd.CategoricalDtype) and (
+        series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+    )
+
+def prepare_table(frame):
+    """Snake-case columns, add a year column from a date/month column and store
+    repeated text as categoricals"""
+    frame = frame.rename(columns=lambda c: re.sub(r'\W+', '_', str(c).strip()).strip('_').lower())
+    if "year" not in frame.columns:
+        for column in frame.columns:
+            if is_text_column(frame[column]) and ("date" in column or "month" in column):
+                parsed = pd.to_datetime(frame[column], errors="coerce")
+                if parsed.notna().mean() > 0.9:
+                    frame["year"] = parsed.dt.year.astype("Int16")
+                    break
+    for column in frame.columns:
+        if is_text_column(frame[column]) and frame[column].nunique() <= len(frame) // 2:
+            frame[column] = frame[column].astype("category")
+    return frame
+
+def dataset_table_path(dataset_id):
+    if not DATASET_ID_PATTERN.fullmatch(str(dataset_id)):
+        raise QueryError(f"Invalid dataset id: {dataset_id!r}")
+    return os.path.join(get_secret("DATA_DIR", DATA_DIR), f"{dataset_id}.parquet")
+
+def ingest_dataset(dataset_id, source, version=None, content=None):
+    """Convert a CSV/Parquet file or URL into the dataset's Parquet table. The source
+    and its version are kept in the file's metadata; `content` is the source's bytes
+    when they have already been downloaded."""
+    import pyarrow.parquet as pq
+    data = io.BytesIO(content) if content is not None else source
+    if str(source).lower().split('?')[0].endswith(".parquet"):
+        frame = pd.read_parquet(data)
+    else:
+        frame = pd.read_csv(data, low_memory=False)
+    path = dataset_table_path(dataset_id)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    arrow = pa.Table.from_pandas(prepare_table(frame), preserve_index=False)
+    origin = json.dumps({"source": str(source), "version": version})
+    pq.write_table(arrow.replace_schema_metadata({**(arrow.schema.metadata or {}), DATASET_SOURCE_KEY: origin}), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def ingested_source(path):
+    """{"source", "version"} the table at path was ingested from; empty for tables
+    written before this was recorded"""
+    import pyarrow.parquet as pq
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata[DATASET_SOURCE_KEY]) if DATASET_SOURCE_KEY in metadata else {}
+
+def fetch_source_version(source):
+    """(version, content) identifying a data_url's current content: mtime and size
+    for a local file, the ETag or Last-Modified header for a URL, else a hash of the
+    download, which is returned as content so ingesting it needs no second fetch"""
+    if not re.match(r'https?://', str(source), re.IGNORECASE):
+        info = os.stat(source)
+        return f"{info.st_mtime_ns}:{info.st_size}", None
+    session = get_http_session()
+    response = session.head(source, allow_redirects=True, timeout=SOURCE_CHECK_TIMEOUT)
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    if response.ok and validator:
+        return validator, None
+    response = session.get(source, timeout=SOURCE_CHECK_TIMEOUT)
+    response.raise_for_status()
+    return hashlib.sha1(response.content).hexdigest(), response.content
+
+class DatasetIngester:
+    """Keeps each dataset's Parquet table in step with its Datasets tab data_url.
+
+    Like SheetSync, requests never wait on the network: they read the table as
+    last ingested and queue a check on a single background worker. A check
+    (re-)ingests when the table is missing, came from another data_url, or the
+    source's version has changed; it runs at most every `interval` seconds per
+    table (SOURCE_HASH_CHECK_INTERVAL for sources that must be downloaded to be
+    compared). A failed refresh keeps serving the old table."""
+
+    def __init__(self, interval=SOURCE_CHECK_INTERVAL):
+        self.interval = interval
+        self._checked = {}  # table path -> (data_url, monotonic check time, interval)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dataset-ingest")
+
+    def due(self, path, source):
+        last = self._checked.get(path)
+        return (not os.path.exists(path) or last is None or last[0] != source
+                or time.monotonic() - last[1] > last[2])
+
+    def refresh_in_background(self, dataset_id, path, source):
+        with self._lock:
+            if path in self._refreshing or not self.due(path, source):
+                return
+            self._refreshing.add(path)
+        self._executor.submit(self._refresh_quietly, dataset_id, path, source)
+
+    def rebuild_cube_in_background(self, dataset_id):
+        """Queue an incremental build_dataset_cube for a cube older than its table"""
+        key = ("cube", dataset_id)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._rebuild_cube_quietly, dataset_id, key)
+
+    def _rebuild_cube_quietly(self, dataset_id, key):
+        try:
+            build_dataset_cube(dataset_id)
+        except Exception:
+            pass  # answer_from_cube keeps deferring to the model and retries
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_quietly(self, dataset_id, path, source):
+        try:
+            self.refresh(dataset_id, path, source)
+        except Exception:
+            pass  # counted in dataset_ingests_total; the next check retries
+        finally:
+            with self._lock:
+                self._refreshing.discard(path)
+
+    def refresh(self, dataset_id, path, source):
+        """Check source now and ingest it if needed, on the calling thread"""
+        if not self.due(path, source):
+            return
+        self._checked[path] = (source, time.monotonic(), self.interval)
+        try:
+            version, content = fetch_source_version(source)
+            if content is not None:
+                self._checked[path] = (source, time.monotonic(), max(self.interval, SOURCE_HASH_CHECK_INTERVAL))
+            if os.path.exists(path):
+                ingested = ingested_source(path)
+                if ingested.get("source") == source and ingested.get("version") == version:
+                    return
+            ingest_dataset(dataset_id, source, version, content)
+            get_metrics().inc("dataset_ingests_total", dataset=dataset_id, outcome="ok")
+        except Exception:
+            get_metrics().inc("dataset_ingests_total", dataset=dataset_id, outcome="failed")
+            if not os.path.exists(path):
+                raise
+
+@st.cache_resource
+def get_dataset_ingester():
+    return DatasetIngester(float(get_secret("SOURCE_CHECK_INTERVAL", SOURCE_CHECK_INTERVAL)))
+
+@st.cache_resource(max_entries=8)
+def load_dataset_table(dataset_id, path, version):
+    return DatasetTable(dataset_id, path, version, pd.read_parquet(path))
+
+def sync_dataset_source(dataset_id, wait=False):
+    """Path of the dataset's table after queueing (or, with wait, running) a check
+    of its data_url"""
+    path = dataset_table_path(dataset_id)
+    dataset = next((d for d in get_datasets() if d['dataset_id'] == dataset_id), None)
+    source = dataset.get('data_url') if dataset else None
+    if source:
+        ingester = get_dataset_ingester()
+        if wait:
+            ingester.refresh(dataset_id, path, source)
+        else:
+            ingester.refresh_in_background(dataset_id, path, source)
+    return path
+
+def get_dataset_table(dataset_id, wait=False):
+    """The dataset's table as last ingested from its data_url, or None when it has
+    none (yet). The source is checked in the background; scripts that need the
+    current data pass wait=True to check and ingest inline."""
+    path = sync_dataset_source(dataset_id, wait)
+    if not os.path.exists(path):
+        return None
+    return load_dataset_table(dataset_id, path, os.stat(path).st_mtime_ns)
+
+def dataset_table_version(dataset_id):
+    """The version get_dataset_table would return, without loading the table:
+    cheap enough for the script thread. None when there is no table."""
     try:
-        sheet_id = st.secrets["GOOGLE_SHEET_ID"]
-        df = load_google_sheet_data(sheet_id, "Dashboards")
-        if df is not None:
-            return df[df['dataset_id'] == dataset_id].to_dict('records')
-    except:
-        pass
-    return []
+        return os.stat(sync_dataset_source(dataset_id)).st_mtime_ns
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_query_settings():
+    # Process-wide like get_retrieval_settings, so warm-up answers match interactive ones
+    engine = str(get_secret("QUERY_ENGINE", "auto")).lower()
+    return {
+        "enabled": str(get_secret("QUERY_MODE", "off")).lower() in ("1", "on", "true"),
+        "engine": engine if engine in QUERY_ENGINES else "auto"
+    }
+
+def query_mode_table(dataset_id):
+    """The table to query for this dataset, or None when query mode does not apply"""
+    if not dataset_id or not get_query_settings()["enabled"]:
+        return None
+    try:
+        return get_dataset_table(dataset_id)
+    except Exception:
+        return None
+
+def is_scalar(value):
+    return isinstance(value, (str, int, float, bool)) and not (isinstance(value, float) and math.isnan(value))
+
+def validate_query(spec, table):
+    """Check a model-written query against the spec and the table's columns.
+    Returns a normalized copy; nothing in it is ever evaluated as code."""
+    if not isinstance(spec, dict):
+        raise QueryError("Query must be a JSON object")
+    schema = table.schema
+
+    def column_name(value):
+        if not isinstance(value, str) or value not in schema:
+            raise QueryError(f"Unknown column: {value!r}")
+        return value
+
+    filters = []
+    for item in spec.get("filters") or []:
+        if not isinstance(item, dict):
+            raise QueryError("Each filter must be an object")
+        column = column_name(item.get("column"))
+        op = item.get("op", "==")
+        if op not in QUERY_OPERATORS:
+            raise QueryError(f"Unsupported operator: {op!r}")
+        value = item.get("value")
+        if op in ("in", "not in", "between"):
+            if not isinstance(value, list) or not value or not all(is_scalar(v) for v in value):
+                raise QueryError(f"'{op}' needs a list of values")
+            if op == "between" and len(value) != 2:
+                raise QueryError("'between' needs [low, high]")
+        elif not is_scalar(value):
+            raise QueryError(f"Filter on {column} needs a single value")
+        if schema[column]["type"] == "text" and op not in ("contains",):
+            value = [table.resolve_text(column, v) for v in value] if isinstance(value, list) else table.resolve_text(column, value)
+        filters.append({"column": column, "op": op, "value": value})
+    if len(filters) > QUERY_MAX_FILTERS:
+        raise QueryError(f"At most {QUERY_MAX_FILTERS} filters")
+
+    group_by = spec.get("group_by") or []
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    group_by = [column_name(c) for c in group_by]
+    if len(group_by) > QUERY_MAX_GROUP_BY:
+        raise QueryError(f"At most {QUERY_MAX_GROUP_BY} group-by columns")
+
+    metrics = []
+    for item in spec.get("metrics") or [{"agg": "count"}]:
+        if not isinstance(item, dict):
+            raise QueryError("Each metric must be an object")
+        agg = item.get("agg", "count")
+        if agg not in QUERY_AGGREGATES:
+            raise QueryError(f"Unsupported aggregate: {agg!r}")
+        if agg == "count":
+            if not any(m["name"] == "count" for m in metrics):
+                metrics.append({"agg": "count", "column": None, "name": "count"})
+            continue
+        column = column_name(item.get("column"))
+        if agg != "nunique" and schema[column]["type"] != "number":
+            raise QueryError(f"'{agg}' needs a numeric column, {column} is {schema[column]['type']}")
+        if not any(m["name"] == f"{agg}_{column}" for m in metrics):
+            metrics.append({"agg": agg, "column": column, "name": f"{agg}_{column}"})
+    if len(metrics) > QUERY_MAX_METRICS:
+        raise QueryError(f"At most {QUERY_MAX_METRICS} metrics")
+
+    over_time = len(group_by) == 1 and group_by[0] in QUERY_TIME_COLUMNS
+    sort = spec.get("sort") or ("asc_group" if over_time else "desc")
+    if sort not in ("asc", "desc", "asc_group", "desc_group"):
+        raise QueryError(f"Unsupported sort: {sort!r}")
+    try:
+        limit = max(1, min(int(spec.get("limit") or QUERY_MAX_ROWS), QUERY_MAX_ROWS))
+    except (TypeError, ValueError):
+        raise QueryError("limit must be a number")
+    chart_type = spec.get("chart_type") or ("line" if over_time else "bar")
+    if chart_type not in ("bar", "line", "pie"):
+        chart_type = "bar"
+    title = spec.get("title") if isinstance(spec.get("title"), str) else None
+    return {
+        "filters": filters, "group_by": group_by, "metrics": metrics, "sort": sort,
+        "limit": limit, "chart_type": chart_type, "title": title
+    }
+
+def filter_mask(frame, filters):
+    mask = np.ones(len(frame), dtype=bool)
+    for item in filters:
+        series = frame[item["column"]]
+        op, value = item["op"], item["value"]
+        try:
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Evaluate once per category and broadcast through the codes (-1 picks the False pad)
+                per_category = compare_series(pd.Series(series.cat.categories), op, value).to_numpy(dtype=bool, na_value=False)
+                hit = np.append(per_category, False)[series.cat.codes.to_numpy()]
+            else:
+                hit = compare_series(series, op, value).to_numpy(dtype=bool, na_value=False)
+        except TypeError:
+            raise QueryError(f"Cannot compare {item['column']} with {value!r}")
+        mask &= hit
+    return mask
+
+def compare_series(series, op, value):
+    if op == "==":
+        return series == value
+    elif op == "!=":
+        return series != value
+    elif op == ">":
+        return series > value
+    elif op == ">=":
+        return series >= value
+    elif op == "<":
+        return series < value
+    elif op == "<=":
+        return series <= value
+    elif op == "in":
+        return series.isin(value)
+    elif op == "not in":
+        return ~series.isin(value)
+    elif op == "between":
+        return series.between(value[0], value[1])
+    return series.astype(str).str.contains(str(value), case=False, regex=False)
+
+QUERY_DENSE_GROUPS = 1 << 20
+QUERY_LOOP_GROUPS = 2000
+QUERY_ORDER_STATS = {"min": 0.0, "max": 1.0, "median": 0.5, **QUERY_PERCENTILES}
+
+def group_keys(table, group_by, mask):
+    """Group id per row (-1 for rows left out), the row filter, the combined label
+    code behind each id, and the label levels and their shape. Ids are dense over
+    the label product when it is small enough, otherwise factorized down to the
+    groups actually present."""
+    levels = [table.group_codes(column)[1] for column in group_by]
+    shape = tuple(len(labels) for labels in levels)
+    dense = math.prod(shape) <= QUERY_DENSE_GROUPS
+    key = valid = None
+    for column, width in zip(group_by, shape):
+        codes = table.group_codes(column)[0]
+        if key is None:
+            key = codes.astype(np.int32 if dense else np.int64)
+            valid = codes >= 0 if mask is None else mask & (codes >= 0)
+        else:
+            key = key * width + codes
+            valid &= codes >= 0
+    if dense:
+        combined = np.arange(math.prod(shape))
+    else:
+        compact, combined = pd.factorize(key[valid])
+        key[valid] = compact
+    key[~valid] = -1
+    return key, valid, combined, levels, shape
+
+def aggregate_groups(table, metric, key, valid, groups, counts):
+    agg, column = metric["agg"], metric["column"]
+    if agg == "count":
+        return counts
+    if agg == "nunique":
+        codes, labels = table.group_codes(column)
+        keep = valid & (codes >= 0)
+        if groups * len(labels) <= QUERY_DENSE_GROUPS:
+            pairs = np.bincount(key[keep] * len(labels) + codes[keep], minlength=groups * len(labels))
+            return np.count_nonzero(pairs.reshape(groups, len(labels)), axis=1)
+        pairs = np.unique(key[keep] * len(labels) + codes[keep])
+        return np.bincount(pairs // len(labels), minlength=groups)
+    values = table.numeric_values(column)
+    keep = valid & ~np.isnan(values)
+    if agg in ("sum", "mean"):
+        sums = np.bincount(key[keep], weights=values[keep], minlength=groups)
+        if agg == "sum":
+            return sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / np.bincount(key[keep], minlength=groups)
+    # Order statistics: a stable sort by group id (radix sort for 16-bit ids)
+    # makes each group's values one contiguous run
+    group_ids = key[keep]
+    sizes = np.bincount(group_ids, minlength=groups)
+    present = sizes > 0
+    starts = (np.cumsum(sizes) - sizes)[present]
+    result = np.full(groups, np.nan)
+    if agg in ("min", "max") or np.count_nonzero(present) <= QUERY_LOOP_GROUPS:
+        small = np.uint16 if groups <= np.iinfo(np.uint16).max else np.int64
+        runs = values[keep][np.argsort(group_ids.astype(small), kind="stable")]
+        if agg == "min":
+            result[present] = np.minimum.reduceat(runs, starts)
+        elif agg == "max":
+            result[present] = np.maximum.reduceat(runs, starts)
+        else:
+            q = QUERY_ORDER_STATS[agg]
+            result[present] = [np.quantile(runs[s:s + n], q) for s, n in zip(starts, sizes[present])]
+        return result
+    # Many groups: walk the rows in value order so every run also comes out sorted
+    order = table.value_order(column)
+    ordered = values[order][keep[order]]
+    ordered = ordered[np.argsort(key[order][keep[order]], kind="stable")]
+    position = starts + QUERY_ORDER_STATS[agg] * (sizes[present] - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    result[present] = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+    return result
+
+def aggregate_all(table, metric, mask, matched):
+    agg, column = metric["agg"], metric["column"]
+    if agg == "count":
+        return matched
+    if agg == "nunique":
+        codes, labels = table.group_codes(column)
+        keep = codes >= 0 if mask is None else mask & (codes >= 0)
+        return int(np.count_nonzero(np.bincount(codes[keep], minlength=len(labels))))
+    values = table.numeric_values(column)
+    values = values if mask is None else values[mask]
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.nan
+    if agg == "sum":
+        return values.sum()
+    if agg == "mean":
+        return values.mean()
+    return np.quantile(values, QUERY_ORDER_STATS[agg])
+
+def run_query_numpy(table, query):
+    """Vectorized kernel over the cached per-column codes and values"""
+    mask = filter_mask(table.frame, query["filters"]) if query["filters"] else None
+    matched = int(mask.sum()) if mask is not None else len(table.frame)
+    if not query["group_by"]:
+        row = {m["name"]: aggregate_all(table, m, mask, matched) for m in query["metrics"]}
+        return pd.DataFrame([row]), matched
+    key, valid, combined, levels, shape = group_keys(table, query["group_by"], mask)
+    counts = np.bincount(key[valid], minlength=len(combined))
+    present = np.flatnonzero(counts)
+    positions = np.unravel_index(combined[present], shape)
+    columns = {column: labels.take(position) for column, labels, position in zip(query["group_by"], levels, positions)}
+    for metric in query["metrics"]:
+        columns[metric["name"]] = aggregate_groups(table, metric, key, valid, len(combined), counts)[present]
+    return sort_query_result(pd.DataFrame(columns), query), matched
+
+def run_query_pandas(table, query):
+    """Plain groupby implementation; the reference the other engines are checked against"""
+    frame = table.frame
+    if query["filters"]:
+        mask = filter_mask(frame, query["filters"])
+        needed = list(dict.fromkeys(query["group_by"] + [m["column"] for m in query["metrics"] if m["column"]]))
+        frame = frame.loc[mask, needed]
+    matched = len(frame)
+    if query["group_by"]:
+        grouped = frame.groupby(query["group_by"], observed=True, sort=False)
+        columns = {}
+        for metric in query["metrics"]:
+            agg, column = metric["agg"], metric["column"]
+            if agg == "count":
+                columns[metric["name"]] = grouped.size()
+            elif agg in QUERY_PERCENTILES:
+                columns[metric["name"]] = grouped[column].quantile(QUERY_PERCENTILES[agg])
+            else:
+                columns[metric["name"]] = grouped[column].agg(agg)
+        result = pd.DataFrame(columns).reset_index()
+    else:
+        row = {}
+        for metric in query["metrics"]:
+            agg, column = metric["agg"], metric["column"]
+            if agg == "count":
+                row[metric["name"]] = matched
+            elif agg in QUERY_PERCENTILES:
+                row[metric["name"]] = frame[column].quantile(QUERY_PERCENTILES[agg])
+            else:
+                row[metric["name"]] = frame[column].agg(agg)
+        result = pd.DataFrame([row])
+    return sort_query_result(result, query), matched
+
+def sort_query_result(result, query):
+    if query["group_by"] and len(result) > 1:
+        by_group = query["sort"].endswith("group")
+        result = result.sort_values(
+            query["group_by"] if by_group else query["metrics"][0]["name"],
+            ascending=query["sort"].startswith("asc"), kind="stable"
+        )
+    return result.head(query["limit"]).reset_index(drop=True)
+
+DUCKDB_AGGREGATES = {
+    "sum": "COALESCE(SUM({}), 0)", "mean": "AVG({})", "median": "MEDIAN({})", "min": "MIN({})", "max": "MAX({})",
+    "nunique": "COUNT(DISTINCT {})", "p25": "QUANTILE_CONT({}, 0.25)", "p75": "QUANTILE_CONT({}, 0.75)",
+    "p90": "QUANTILE_CONT({}, 0.9)"
+}
+DUCKDB_OPERATORS = {"==": "=", "!=": "<>", ">": ">", ">=": ">=", "<": "<", "<=": "<="}
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def build_duckdb_query(query):
+    """Parameterized SQL for a validated query; identifiers come from the table schema
+    and every value is a bound parameter"""
+    where, params = [], []
+    for item in query["filters"]:
+        column, op, value = quote_identifier(item["column"]), item["op"], item["value"]
+        if op in DUCKDB_OPERATORS:
+            where.append(f"{column} {DUCKDB_OPERATORS[op]} ?")
+            params.append(value)
+        elif op in ("in", "not in"):
+            negate = "NOT " if op == "not in" else ""
+            where.append(f"{column} {negate}IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        elif op == "between":
+            where.append(f"{column} BETWEEN ? AND ?")
+            params.extend(value)
+        else:
+            where.append(f"CAST({column} AS VARCHAR) ILIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r'([%_\\])', r'\\\1', str(value)) + "%")
+    groups = [quote_identifier(c) for c in query["group_by"]]
+    selects = list(groups)
+    for metric in query["metrics"]:
+        expression = "COUNT(*)" if metric["agg"] == "count" else DUCKDB_AGGREGATES[metric["agg"]].format(quote_identifier(metric["column"]))
+        selects.append(f"{expression} AS {quote_identifier(metric['name'])}")
+    sql = f"SELECT {', '.join(selects)}, COUNT(*) AS __matched FROM dataset"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if groups:
+        sql += " GROUP BY " + ", ".join(groups)
+    return sql, params
+
+@st.cache_resource(max_entries=8)
+def get_duckdb_connection(dataset_id, path, version):
+    import duckdb
+    import pyarrow.parquet as pq
+    connection = duckdb.connect(":memory:")
+    # Copied into a real table so the per-query cursors can see it
+    connection.register("source", pq.read_table(path))
+    connection.execute("CREATE TABLE dataset AS SELECT * FROM source")
+    connection.unregister("source")
+    # The table is in memory; queries cannot reach files, URLs or extensions
+    connection.execute("SET enable_external_access = false")
+    connection.execute("SET lock_configuration = true")
+    return connection
+
+def run_query_duckdb(table, query):
+    sql, params = build_duckdb_query(query)
+    cursor = get_duckdb_connection(table.dataset_id, table.path, table.version).cursor()
+    try:
+        result = cursor.execute(sql, params).df()
+    finally:
+        cursor.close()
+    matched = int(result.pop("__matched").sum()) if len(result) else 0
+    if query["group_by"]:
+        # Groups with a missing key are dropped, as in the other engines
+        result = result.dropna(subset=query["group_by"])
+    return sort_query_result(result, query), matched
+
+def query_engine_name():
+    engine = get_query_settings()["engine"]
+    if engine == "duckdb":
+        try:
+            import duckdb  # noqa: F401
+            return "duckdb"
+        except ImportError:
+            pass
+    return "pandas" if engine == "pandas" else "numpy"
+
+def run_query(table, spec):
+    """(result frame, matched row count, validated query) for a model-written spec"""
+    query = validate_query(spec, table)
+    engine = query_engine_name()
+    start = time.perf_counter()
+    try:
+        if engine == "duckdb":
+            result, matched = run_query_duckdb(table, query)
+        elif engine == "pandas":
+            result, matched = run_query_pandas(table, query)
+        else:
+            result, matched = run_query_numpy(table, query)
+    except QueryError:
+        get_metrics().inc("query_runs_total", engine=engine, outcome="invalid")
+        raise
+    get_metrics().observe("query_latency_ms", elapsed_ms(start), engine=engine)
+    get_metrics().inc("query_runs_total", engine=engine, outcome="ok")
+    return result, matched, query
+
+def format_number(value):
+    if pd.isna(value):
+        return "n/a"
+    if isinstance(value, (int, np.integer)) or (isinstance(value, float) and value.is_integer()):
+        return f"{int(value):,}"
+    return f"{value:,.2f}" if abs(value) < 100 else f"{value:,.0f}"
+
+def metric_label(name):
+    return name.replace("_", " ")
+
+def format_query_result(result, matched, query):
+    """The computed answer as display text plus a ```json chart block for create_chart"""
+    if not matched:
+        return "No rows match that query."
+    metric = query["metrics"][0]["name"]
+    lines = [f"Computed from {matched:,} matching rows:", ""]
+    if not query["group_by"]:
+        for name in result.columns:
+            lines.append(f"• {metric_label(name).capitalize()}: {format_number(result[name].iloc[0])}")
+        return "\n".join(lines)
+    labels = result[query["group_by"]].astype(str).agg(" / ".join, axis=1).tolist()
+    for i, label in enumerate(labels[:10]):
+        values = ", ".join(f"{metric_label(m['name'])} {format_number(result[m['name']].iloc[i])}" for m in query["metrics"])
+        lines.append(f"• {label}: {values}")
+    if len(labels) > 10:
+        lines.append(f"• ...and {len(labels) - 10} more")
+    # Groups without a value (e.g. the mean of an all-missing column) are left off
+    # the chart: NaN is not valid JSON
+    points = [(label, float(value)) for label, value in zip(labels, result[metric]) if not pd.isna(value)]
+    if not points:
+        return "\n".join(lines)
+    chart = {
+        "chart_type": query["chart_type"],
+        "title": query["title"] or f"{metric_label(metric).capitalize()} by {' / '.join(query['group_by'])}",
+        "data": {"labels": [label for label, _ in points], "values": [value for _, value in points]},
+        "x_label": " / ".join(query["group_by"]),
+        "y_label": metric_label(metric)
+    }
+    return "\n".join(lines) + "\n\n```json\n" + json.dumps(chart, allow_nan=False) + "\n```"
+
+def resolve_query_blocks(response, dataset_id):
+    """Replace each ```query block in a reply with its computed result"""
+    if "```query" not in response:
+        return response
+    table = query_mode_table(dataset_id)
+
+    def replace(match):
+        if table is None:
+            return "Row-level data is not available for this dataset."
+        try:
+            return format_query_result(*run_query(table, json.loads(match.group(1))))
+        except Exception as e:
+            # Any failure stays inside this block; the rest of the reply is still shown
+            return f"I couldn't run that query: {e}"
+    return QUERY_BLOCK_PATTERN.sub(replace, response)
+
+# =============================================================================
+# AGGREGATE CUBE
+# =============================================================================
+
+CUBE_STATS = ("count", "sum", "mean", "min", "p25", "median", "p75", "p90", "max")
+CUBE_MERGEABLE_STATS = ("count", "sum", "mean", "min", "max")
+CUBE_FORMAT = 2
+CUBE_MAX_LABELS = 200
+CUBE_MAX_MEASURES = 8
+CUBE_NO_YEAR = -1
+CUBE_METADATA_KEY = b"aggregate_cube"
+CUBE_STAT_LABELS = {
+    "count": "Number of records", "sum": "Total", "mean": "Average", "min": "Minimum", "max": "Maximum",
+    "median": "Median", "p25": "25th percentile", "p75": "75th percentile", "p90": "90th percentile"
+}
+CUBE_STAT_PATTERNS = (
+    ("count", re.compile(r"\b(?:how many|number of|count of|volume of|most transactions|fewest transactions)\b")),
+    ("median", re.compile(r"\bmedian\b")),
+    ("max", re.compile(r"\b(?:maximum|max|peak)\b")),
+    ("min", re.compile(r"\b(?:minimum|min)\b")),
+)
+CUBE_TREND_PATTERN = re.compile(r"\b(?:trend|trends|over time|by year|per year|each year|yearly|annual|annually)\b")
+CUBE_YEAR_PATTERN = re.compile(r"\b(?:19|20)\d\d\b")
+CUBE_ASCENDING_PATTERN = re.compile(r"\b(?:lowest|cheapest|least|fewest|smallest)\b")
+CUBE_DESCENDING_PATTERN = re.compile(r"\b(?:highest|most|largest|biggest|top)\b")
+# Questions that want reasoning rather than numbers go to the model
+CUBE_SKIP_PATTERN = re.compile(r"\b(?:why|predict|forecast|explain|recommend|should|correlat\w*|cause\w*)\b")
+CUBE_RECORD_WORDS = frozenset("transaction sale listing record row".split())
+CUBE_GENERIC_WORDS = frozenset("date time year month number".split())
+
+class AggregateCube:
+    """Precomputed rollups for one dataset: one row per (dimension, label, year,
+    measure) with every CUBE_STATS value, plus `non_null`, the rows where the
+    measure is present. Rows with a null year roll up all years; dimension ""
+    holds the totals. Built offline by build_cubes.py."""
+    __slots__ = ("dataset_id", "version", "frame", "meta", "dimensions", "measures", "years", "_label_pattern", "_labels")
+
+    def __init__(self, dataset_id, version, frame, meta):
+        self.dataset_id = dataset_id
+        self.version = version
+        self.frame = frame
+        self.meta = meta
+        self.dimensions = meta["dimensions"]
+        self.measures = meta["measures"]
+        years = frame["year"].dropna()
+        self.years = sorted(int(y) for y in years.unique() if y != CUBE_NO_YEAR)
+        self._labels = {}
+        for dimension, label in frame.loc[frame["dimension"] != "", ["dimension", "label"]].drop_duplicates().itertuples(index=False):
+            key = normalize_question(str(label))
+            if len(key) >= 3 and not key.isdigit():
+                self._labels.setdefault(key, (dimension, label))
+        # Longest first, so "ang mo kio" wins over "ang"
+        alternatives = sorted(self._labels, key=len, reverse=True)
+        self._label_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(a) for a in alternatives) + r")\b"
+        ) if alternatives else None
+
+    def find_label(self, text):
+        """(dimension, label) for the first label named in normalized text, or None"""
+        if self._label_pattern is None:
+            return None
+        match = self._label_pattern.search(text)
+        return self._labels[match.group(1)] if match else None
+
+    def slice(self, group, measure, stat, years=None, where=None):
+        """DataFrame of label, value and count for one group-by, or None when the
+        cube cannot answer it exactly (order statistics over a range of years)"""
+        frame = self.frame
+        rows = frame["measure"] == measure
+        if group == "year":
+            dimension, label = where or ("", "")
+            rows &= (frame["dimension"] == dimension) & (frame["label"] == label)
+            rows &= frame["year"].notna() & (frame["year"] != CUBE_NO_YEAR)
+            if years:
+                rows &= frame["year"].between(years[0], years[-1])
+            cells = frame.loc[rows].sort_values("year")
+            return pd.DataFrame({
+                "label": cells["year"].astype(int).astype(str).to_numpy(),
+                "value": cells[stat].to_numpy(),
+                "count": cells["count"].to_numpy()
+            })
+        rows &= frame["dimension"] == group
+        if not years:
+            cells = frame.loc[rows & frame["year"].isna()]
+        elif years[0] == years[-1]:
+            cells = frame.loc[rows & (frame["year"] == years[0])]
+        elif stat not in CUBE_MERGEABLE_STATS:
+            return None
+        else:
+            cells = frame.loc[rows & frame["year"].between(years[0], years[-1])]
+            cells = cells.groupby("label", observed=True, sort=False).agg(
+                count=("count", "sum"), non_null=("non_null", "sum"), sum=("sum", "sum"),
+                min=("min", "min"), max=("max", "max")
+            ).reset_index()
+            # Missing values count as rows but not towards the mean
+            with np.errstate(invalid="ignore", divide="ignore"):
+                cells["mean"] = cells["sum"] / cells["non_null"].replace(0, np.nan)
+        return pd.DataFrame({
+            "label": cells["label"].astype(str).to_numpy(),
+            "value": cells[stat].to_numpy(),
+            "count": cells["count"].to_numpy()
+        })
+
+def dataset_cube_path(dataset_id):
+    return dataset_table_path(dataset_id)[:-len(".parquet")] + ".cube.parquet"
+
+def cube_dimensions(table):
+    return [
+        column for column, info in table.schema.items()
+        if info["type"] == "text" and column not in QUERY_TIME_COLUMNS
+        and 1 < info.get("count", len(info["values"])) <= CUBE_MAX_LABELS
+    ]
+
+def cube_measures(table):
+    return [
+        column for column, info in table.schema.items()
+        if info["type"] == "number" and column not in QUERY_TIME_COLUMNS
+    ][:CUBE_MAX_MEASURES]
+
+def cube_partitions(table):
+    """Year per row (CUBE_NO_YEAR where unknown) and a fingerprint per year, so a
+    rebuild can tell which years gained, lost or changed rows"""
+    frame = table.frame
+    if "year" in frame.columns:
+        years = frame["year"].to_numpy(dtype=np.float64, na_value=np.nan)
+        part = np.where(np.isnan(years), CUBE_NO_YEAR, years).astype(np.int64)
+    else:
+        part = np.full(len(frame), CUBE_NO_YEAR, dtype=np.int64)
+    hashes = pd.Series(pd.util.hash_pandas_object(frame, index=False).to_numpy())
+    grouped = hashes.groupby(part).agg(["size", "sum"])
+    fingerprints = {str(year): f"{size}:{total}" for year, (size, total) in zip(grouped.index, grouped.to_numpy())}
+    return part, fingerprints
+
+def cube_cells(table, dimension, measures, part, years, mask):
+    """Cells for one dimension ("" for totals) split by `years`, over the masked rows.
+    years=None gives the all-years rollup."""
+    if dimension:
+        codes, labels = table.group_codes(dimension)
+    else:
+        codes, labels = np.zeros(len(table.frame), dtype=np.int32), pd.Index([""])
+    if years is None:
+        slots, year_values = np.zeros(len(part), dtype=np.int64), [None]
+    else:
+        slots, year_values = np.searchsorted(years, part), list(years)
+    valid = mask & (codes >= 0)
+    key = np.where(valid, codes.astype(np.int64) * len(year_values) + slots, -1)
+    groups = len(labels) * len(year_values)
+    counts = np.bincount(key[valid], minlength=groups)
+    present = np.flatnonzero(counts)
+    label_index, year_index = np.divmod(present, len(year_values))
+    blocks = []
+    for measure in measures:
+        block = {
+            "dimension": dimension,
+            "label": [str(label) for label in labels.take(label_index)],
+            "year": [year_values[i] for i in year_index],
+            "measure": measure,
+            "count": counts[present]
+        }
+        values = table.numeric_values(measure)
+        present_values = valid & ~np.isnan(values)
+        block["non_null"] = np.bincount(key[present_values], minlength=groups)[present]
+        for stat in CUBE_STATS[1:]:
+            values = aggregate_groups(table, {"agg": stat, "column": measure}, key, valid, groups, counts)
+            block[stat] = values[present]
+        blocks.append(pd.DataFrame(block))
+    return blocks
+
+def build_cube(table, previous=None):
+    """(cells, metadata, years rebuilt) for a dataset table. Cells for years whose
+    rows are unchanged since `previous` (a loaded AggregateCube) are reused; the
+    all-years rollup is recomputed whenever any year changed."""
+    dimensions, measures = cube_dimensions(table), cube_measures(table)
+    part, fingerprints = cube_partitions(table)
+    reusable = (
+        previous is not None and previous.meta.get("format") == CUBE_FORMAT
+        and previous.dimensions == dimensions and previous.measures == measures
+    )
+    old = previous.meta["partitions"] if reusable else {}
+    changed = sorted(int(year) for year, fp in fingerprints.items() if old.get(year) != fp)
+    removed = [year for year in old if year not in fingerprints]
+    if reusable and not changed and not removed:
+        return previous.frame, {**previous.meta, "table_version": table.version}, []
+
+    blocks = []
+    if reusable:
+        kept = previous.frame["year"].isin([int(year) for year, fp in fingerprints.items() if old.get(year) == fp])
+        blocks.append(previous.frame.loc[kept])
+    if changed:
+        mask = np.isin(part, changed)
+        for dimension in ["", *dimensions]:
+            blocks.extend(cube_cells(table, dimension, measures, part, np.array(changed), mask))
+    everything = np.ones(len(part), dtype=bool)
+    for dimension in ["", *dimensions]:
+        blocks.extend(cube_cells(table, dimension, measures, part, None, everything))
+
+    cells = pd.concat(blocks, ignore_index=True)
+    cells["year"] = cells["year"].astype("Int32")
+    for column in ("dimension", "measure"):
+        cells[column] = cells[column].astype("category")
+    meta = {
+        "format": CUBE_FORMAT,
+        "dataset_id": table.dataset_id,
+        # The table version the cells were computed from; answer_from_cube
+        # ignores the cube once the table has been re-ingested
+        "table_version": table.version,
+        "dimensions": dimensions,
+        "measures": measures,
+        "partitions": fingerprints,
+        "rows": len(part),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    }
+    return cells, meta, changed
+
+def write_cube(path, cells, meta):
+    import pyarrow.parquet as pq
+    arrow = pa.Table.from_pandas(cells, preserve_index=False)
+    arrow = arrow.replace_schema_metadata({**(arrow.schema.metadata or {}), CUBE_METADATA_KEY: json.dumps(meta)})
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(arrow, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+@st.cache_resource(max_entries=8)
+def load_dataset_cube(dataset_id, path, version):
+    import pyarrow.parquet as pq
+    arrow = pq.read_table(path)
+    meta = json.loads(arrow.schema.metadata[CUBE_METADATA_KEY])
+    return AggregateCube(dataset_id, version, arrow.to_pandas(), meta)
+
+def get_dataset_cube(dataset_id):
+    """The dataset's cube, or None when it has not been built"""
+    try:
+        path = dataset_cube_path(dataset_id)
+        if not os.path.exists(path):
+            return None
+        return load_dataset_cube(dataset_id, path, os.stat(path).st_mtime_ns)
+    except Exception:
+        return None
+
+def build_dataset_cube(dataset_id, full=False):
+    """Build or refresh the cube from the dataset's table (ingested from its data_url
+    if needed). Returns a summary of the work done, or None without row-level data."""
+    table = get_dataset_table(dataset_id, wait=True)
+    if table is None:
+        return None
+    path = dataset_cube_path(dataset_id)
+    previous = None if full else get_dataset_cube(dataset_id)
+    start = time.perf_counter()
+    cells, meta, changed = build_cube(table, previous)
+    if previous is None or meta != previous.meta:
+        write_cube(path, cells, meta)
+    return {
+        "dataset_id": dataset_id,
+        "rows": meta["rows"],
+        "cells": len(cells),
+        "years_rebuilt": len(changed),
+        "years": len(meta["partitions"]),
+        "build_ms": round(elapsed_ms(start), 1),
+        "bytes": os.path.getsize(path)
+    }
+
+@st.cache_resource
+def get_cube_settings():
+    return {"enabled": str(get_secret("AGGREGATE_CUBE", "on")).lower() not in ("0", "off", "false")}
+
+def question_words(text):
+    """Lower-case words with a plural s dropped"""
+    return [w[:-1] if w.endswith("s") and len(w) > 3 else w for w in re.findall(r"[a-z0-9]+", text.lower())]
+
+def match_cube_question(cube, question):
+    """The cube slice a question asks for, as a dict for AggregateCube.slice plus
+    a sort order, or None when the question is not a plain group-by aggregate"""
+    text = normalize_question(question)
+    if CUBE_SKIP_PATTERN.search(text):
+        return None
+    words = set(question_words(text))
+
+    group = None
+    for dimension in cube.dimensions:
+        phrase = r"\s+".join(re.escape(w) for w in dimension.split("_"))
+        if re.search(rf"\b{phrase}(?:s|es)?\b", text):
+            if group is not None:
+                return None  # two dimensions: not a single cube slice
+            group = dimension
+    trend = bool(CUBE_TREND_PATTERN.search(text))
+    years = sorted({int(y) for y in CUBE_YEAR_PATTERN.findall(text)})
+    if years and any(year not in cube.years for year in years):
+        return None
+    if group is None and (trend or len(years) > 1) and cube.years:
+        group = "year"
+    elif group is None or trend:
+        return None
+
+    where = None
+    if group == "year":
+        where = cube.find_label(text)
+    elif cube.find_label(text) and cube.find_label(text)[0] != group:
+        return None  # a filter on another dimension needs the rows
+
+    scores = {
+        measure: sum(1 for w in question_words(measure.replace("_", " ")) if w in words and len(w) > 3 and w not in CUBE_GENERIC_WORDS)
+        for measure in cube.measures
+    }
+    measure = max(cube.measures, key=lambda m: scores[m]) if cube.measures else None
+    stat = next((name for name, pattern in CUBE_STAT_PATTERNS if pattern.search(text)), None)
+    if stat is None:
+        stat = "count" if not scores.get(measure) and words & CUBE_RECORD_WORDS else "mean"
+    if measure is None or (stat != "count" and not scores[measure] and len(cube.measures) > 1):
+        return None
+    ascending = group == "year" or (
+        bool(CUBE_ASCENDING_PATTERN.search(text)) and not CUBE_DESCENDING_PATTERN.search(text)
+    )
+    return {
+        "group": group, "measure": measure, "stat": stat,
+        "years": (years[0], years[-1]) if years else None, "where": where, "ascending": ascending
+    }
+
+def cube_followups(cube, spec):
+    """Next questions the cube can also answer"""
+    measure = metric_label(spec["measure"])
+    stat = CUBE_STAT_LABELS[spec["stat"]].lower() if spec["stat"] != "count" else "average"
+    questions = []
+    if spec["group"] != "year" and cube.years:
+        questions.append(f"How has {stat} {measure} changed by year?")
+    for dimension in cube.dimensions:
+        if dimension != spec["group"]:
+            questions.append(f"How does {stat} {measure} vary by {metric_label(dimension)}?")
+    if spec["stat"] != "count" and spec["group"] != "year":
+        questions.append(f"How many records are there by {metric_label(spec['group'])}?")
+    return questions[:3]
+
+def format_cube_answer(cube, spec, result):
+    stat, measure, group = spec["stat"], spec["measure"], spec["group"]
+    value_label = CUBE_STAT_LABELS[stat] if stat == "count" else f"{CUBE_STAT_LABELS[stat]} {metric_label(measure)}"
+    title = f"{value_label} by {metric_label(group)}"
+    if spec["where"]:
+        title += f" in {spec['where'][1]}"
+    if spec["years"]:
+        low, high = spec["years"]
+        title += f", {low}" if low == high else f", {low}–{high}"
+    if group != "year":
+        result = result.sort_values("value", ascending=spec["ascending"], kind="stable")
+    result = result.dropna(subset=["value"])
+    lines = [f"{title} (precomputed from {int(result['count'].sum()):,} rows):", ""]
+    for label, value in zip(result["label"][:10], result["value"][:10]):
+        lines.append(f"• {label}: {format_number(value)}")
+    if len(result) > 10:
+        lines.append(f"• ...and {len(result) - 10} more")
+    chart = {
+        "chart_type": "line" if group == "year" else "bar",
+        "title": title,
+        "data": {"labels": result["label"].tolist(), "values": [float(v) for v in result["value"]]},
+        "x_label": metric_label(group),
+        "y_label": value_label.lower()
+    }
+    followups = "\n".join(f"{i}. {q}" for i, q in enumerate(cube_followups(cube, spec), 1))
+    return "\n".join(lines) + "\n\n```json\n" + json.dumps(chart) + "\n```\n\nFollow-up questions:\n" + followups
+
+def answer_from_cube(question, dataset_id):
+    """A chart answer computed from the dataset's cube, or None to ask the model"""
+    if not dataset_id or not get_cube_settings()["enabled"]:
+        return None
+    cube = get_dataset_cube(dataset_id)
+    if cube is None:
+        return None
+    table_version = dataset_table_version(dataset_id)
+    if table_version is not None and cube.meta.get("table_version") != table_version:
+        # Built from an older table: the model answers until the rebuild lands
+        get_dataset_ingester().rebuild_cube_in_background(dataset_id)
+        get_metrics().inc("cube_answers_total", outcome="stale")
+        return None
+    start = time.perf_counter()
+    spec = match_cube_question(cube, question)
+    result = None
+    if spec is not None:
+        result = cube.slice(spec["group"], spec["measure"], spec["stat"], spec["years"], spec["where"])
+    if result is None or not len(result):
+        get_metrics().inc("cube_answers_total", outcome="no_match")
+        return None
+    response = format_cube_answer(cube, spec, result)
+    get_metrics().observe("cube_answer_latency_ms", elapsed_ms(start))
+    get_metrics().inc("cube_answers_total", outcome="answered")
+    return response
+
+# =============================================================================
+# INTENT ROUTER
+# =============================================================================
+
+INTENT_ROUTES = ("dashboard", "aggregate", "llm")
+INTENT_MODEL_CONFIDENCE = 0.7
+INTENT_RULES = (
+    ("dashboard", r"dashboard|power\s*bi"),
+    ("llm", CUBE_SKIP_PATTERN.pattern),
+)
+# Seed phrasings for the classifier; datasets add their own with intent_examples
+INTENT_EXAMPLES = (
+    ("dashboard", "show me the report"),
+    ("dashboard", "open the interactive report"),
+    ("dashboard", "can i see the visuals"),
+    ("dashboard", "display the embedded report"),
+    ("dashboard", "open the visualization page"),
+    ("dashboard", "let me explore the report myself"),
+    ("aggregate", "average price by town"),
+    ("aggregate", "prices by flat type"),
+    ("aggregate", "show me a chart of prices by region"),
+    ("aggregate", "price trend from 1990 to 1999"),
+    ("aggregate", "how many transactions by town"),
+    ("aggregate", "which towns have the highest prices"),
+    ("aggregate", "which regions have the lowest prices"),
+    ("aggregate", "median price per year"),
+    ("aggregate", "how do prices vary by room type"),
+    ("aggregate", "plot the number of listings by region"),
+    ("aggregate", "maximum price by storey range"),
+    ("aggregate", "breakdown by category"),
+    ("aggregate", "how has the average price changed by year"),
+    ("llm", "what are the key insights"),
+    ("llm", "summarize this dataset"),
+    ("llm", "what factors affect the price"),
+    ("llm", "is this a good time to buy"),
+    ("llm", "tell me about the data"),
+    ("llm", "what does this dataset contain"),
+    ("llm", "how reliable is this data"),
+    ("llm", "what about the other one"),
+    ("llm", "compare auckland and queenstown"),
+    ("llm", "what stands out to you"),
+    ("llm", "give me some interesting facts"),
+    ("llm", "what should i look at next"),
+)
+INTENT_LIST_PATTERN = re.compile(r"\s*(?:\n|\|)\s*")
+
+class IntentModel:
+    """Multinomial naive Bayes over word unigrams and bigrams. Small enough to
+    train on startup and classify in microseconds on the script thread."""
+    __slots__ = ("routes", "vocabulary", "log_prior", "log_likelihood")
+
+    def __init__(self, examples):
+        self.routes = tuple(route for route in INTENT_ROUTES if any(r == route for r, _ in examples))
+        self.vocabulary = {}
+        rows = []
+        for route, text in examples:
+            features = [self.vocabulary.setdefault(f, len(self.vocabulary)) for f in intent_features(text)]
+            rows.append((self.routes.index(route), features))
+        counts = np.ones((len(self.routes), len(self.vocabulary)))  # add-one smoothing
+        prior = np.zeros(len(self.routes))
+        for route, features in rows:
+            np.add.at(counts[route], features, 1)
+            prior[route] += 1
+        self.log_prior = np.log(prior / prior.sum())
+        self.log_likelihood = np.log(counts / counts.sum(axis=1, keepdims=True))
+
+    def predict(self, text):
+        """(route, probability)"""
+        known = [self.vocabulary[f] for f in intent_features(text) if f in self.vocabulary]
+        scores = self.log_prior + self.log_likelihood[:, known].sum(axis=1)
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.routes[best], float(probabilities[best])
+
+def intent_features(text):
+    words = question_words(text)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+def parse_intent_list(text):
+    """[(route, value)] from "route: value | route: value" cells in the Datasets tab"""
+    items = []
+    for item in INTENT_LIST_PATTERN.split(str(text or "")):
+        route, _, value = item.partition(":")
+        if route.strip().lower() in INTENT_ROUTES and value.strip():
+            items.append((route.strip().lower(), value.strip()))
+    return items
+
+class IntentRouter:
+    """Rules first (the dataset's own, then INTENT_RULES), then the model"""
+    __slots__ = ("rules", "model")
+
+    def __init__(self, rules=(), examples=()):
+        self.rules = tuple((route, re.compile(pattern, re.IGNORECASE)) for route, pattern in (*rules, *INTENT_RULES))
+        self.model = IntentModel((*INTENT_EXAMPLES, *examples))
+
+    def classify(self, question):
+        """(route, confidence, source)"""
+        text = normalize_question(question)
+        for route, pattern in self.rules:
+            if pattern.search(text):
+                return route, 1.0, "rule"
+        route, confidence = self.model.predict(text)
+        return route, confidence, "model"
+
+@st.cache_resource(max_entries=32)
+def build_intent_router(dataset_id, rules, examples):
+    return IntentRouter(parse_intent_list(rules), parse_intent_list(examples))
+
+def get_intent_router(dataset_id):
+    """Router with the dataset's intent_rules and intent_examples columns applied"""
+    dataset = next((d for d in get_datasets() if d['dataset_id'] == dataset_id), None) or {}
+    return build_intent_router(dataset_id, str(dataset.get('intent_rules', '')), str(dataset.get('intent_examples', '')))
+
+def dashboard_response(dataset_id):
+    dashboards = get_dashboards(dataset_id)
+    if dashboards and dashboards[0].get('embed_url', '').startswith('http'):
+        url = dashboards[0]['embed_url']
+        return f"Here's the dashboard:\n\n[DASHBOARD:{url}]\n\nFollow-up questions:\n1. What trends do you notice in the visualization?\n2. Which category shows the highest values?\n3. How do the numbers compare across segments?"
+    return "Dashboard not configured yet.\n\nFollow-up questions:\n1. What specific data would you like to explore?\n2. Should I create a chart for you?\n3. Which metrics are most important?"
+
+def route_question(question, dataset_id, stats, provider, context=lambda: None):
+    """(route, response, history): the answer when it can be given without the
+    model, otherwise route "llm" with no response and the conversation history
+    to send. `context` builds the history and is only called when needed."""
+    router = get_intent_router(dataset_id)
+    start = time.perf_counter()
+    intent, confidence, source = router.classify(question)
+    get_metrics().observe("intent_classify_ms", elapsed_ms(start))
+    confident = source == "rule" or confidence >= INTENT_MODEL_CONFIDENCE
+
+    route, response, history = "llm", None, None
+    # A model-detected dashboard request with nothing to show is better answered by the model
+    if intent == "dashboard" and confident and (source == "rule" or get_dashboards(dataset_id)):
+        route, response = "dashboard", dashboard_response(dataset_id)
+    else:
+        history = context()
+        if history is None:
+            response = get_cached_response(provider, dataset_id, stats, question)
+            route = "cached" if response else route
+        if response is None and not (intent == "llm" and confident):
+            response = answer_from_cube(question, dataset_id)
+            route = "aggregate" if response else route
+    get_metrics().inc("intent_routes_total", route=route, intent=intent, source=source)
+    return route, response, history
+
+# =============================================================================
+# RATE LIMITING
+# =============================================================================
+
+RATE_LIMIT_MAX_WAIT = 20.0
+RATE_LIMIT_MAX_RETRIES = 2
+RATE_LIMIT_COMPLETION_TOKENS = 500
+RATE_LIMIT_MESSAGE_OVERHEAD = 4
+RATE_LIMIT_BACKGROUND_HEADROOM = 0.5
+RATE_LIMIT_RESET_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+class RateLimited(Exception):
+    """Raised instead of sending a request that would wait longer than allowed"""
+
+    def __init__(self, provider, retry_after):
+        self.provider = provider
+        self.retry_after = retry_after
+        super().__init__(
+            f"{provider.title()} is at its rate limit right now. Please try again in about {max(1, math.ceil(retry_after))} s."
+        )
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "level", "updated")
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount, now):
+        """Seconds until amount is available (amounts above capacity are capped)"""
+        self.refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+class RateLimiter:
+    """Requests- and tokens-per-minute buckets for one provider API key.
+
+    Callers are admitted in arrival order. A request whose estimated wait exceeds
+    max_wait is shed with RateLimited instead of queueing. Rate-limit response
+    headers lower the buckets when the provider has counted more than we did, and
+    a 429 blocks everyone until its Retry-After has passed."""
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting = deque()
+
+    def _wait_for(self, requests, tokens, now):
+        wait = self.blocked_until - now
+        if self.requests:
+            wait = max(wait, self.requests.wait(requests, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait(tokens, now))
+        return max(0.0, wait)
+
+    def _estimate(self, ticket, now):
+        # Everyone ahead of us is served first, so their cost counts against our wait
+        ahead = list(self._waiting)[:self._waiting.index(ticket) + 1]
+        return self._wait_for(len(ahead), sum(cost for _, cost in ahead), now)
+
+    def acquire(self, cost, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Block until the request fits both buckets; returns seconds waited"""
+        start = time.monotonic()
+        ticket = (object(), cost)
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._estimate(ticket, now)
+                    if wait <= 0 and self._waiting[0] is ticket:
+                        if self.requests:
+                            self.requests.take(1)
+                        if self.tokens:
+                            self.tokens.take(cost)
+                        return now - start
+                    if now - start + wait > max_wait:
+                        raise RateLimited(self.provider, wait)
+                    self._cond.wait(timeout=max(wait, 0.01))
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def update(self, status_code, headers):
+        """Adapt to the provider's own accounting (x-ratelimit-* and retry-after headers)"""
+        now = time.monotonic()
+        with self._cond:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                remaining = parse_rate_limit_number(headers.get(f"x-ratelimit-remaining-{kind}"))
+                if remaining is None:
+                    continue
+                if bucket is not None:
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, remaining)
+                if remaining <= 0:
+                    reset = parse_rate_limit_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                    self.blocked_until = max(self.blocked_until, now + (reset or 1.0))
+            if status_code == 429:
+                retry_after = parse_rate_limit_reset(headers.get("retry-after"))
+                self.blocked_until = max(self.blocked_until, now + (retry_after or 1.0))
+            self._cond.notify_all()
+
+    def headroom(self):
+        """Fraction of the tighter bucket still available (1.0 when unlimited)"""
+        now = time.monotonic()
+        with self._cond:
+            if self._waiting or self.blocked_until > now:
+                return 0.0
+            fractions = [1.0]
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+                    fractions.append(bucket.level / bucket.capacity)
+            return min(fractions)
+
+    @property
+    def depth(self):
+        return len(self._waiting)
+
+def parse_rate_limit_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_rate_limit_reset(value):
+    """Seconds from '12', '1.5', '250ms' or '2m59.56s' style header values"""
+    seconds = parse_rate_limit_number(value)
+    if seconds is not None or not value:
+        return seconds
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = RATE_LIMIT_RESET_PATTERN.findall(value)
+    return sum(float(number) * scale[unit] for number, unit in parts) if parts else None
+
+def estimate_request_tokens(messages, system_prompt):
+    """Prompt tokens by the local tokenizer plus a typical answer's length"""
+    prompt = count_tokens(system_prompt) + sum(count_tokens(str(m.get("content", ""))) for m in messages)
+    return prompt + RATE_LIMIT_MESSAGE_OVERHEAD * (len(messages) + 1) + RATE_LIMIT_COMPLETION_TOKENS
+
+@st.cache_resource
+def get_rate_limiters():
+    return {}
+
+def get_rate_limiter(provider, api_key):
+    """One limiter per provider and API key, so rotating a key starts a fresh budget"""
+    limiters = get_rate_limiters()
+    key = (provider, hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12])
+    limiter = limiters.get(key)
+    if limiter is None:
+        config = get_provider_config(provider)
+        limiter = limiters.setdefault(key, RateLimiter(
+            provider, config["requests_per_minute"], config["tokens_per_minute"]
+        ))
+    return limiter
+
+def rate_limit_headroom(provider):
+    api_key = get_secret(PROVIDERS[provider]["api_key_secret"])
+    return get_rate_limiter(provider, api_key).headroom() if api_key else 0.0
+
+def rate_limit_metrics():
+    rows = []
+    for (provider, key_id), limiter in list(get_rate_limiters().items()):
+        labels = {"provider": provider, "key": key_id}
+        rows.append(("rate_limit_queue_depth", "gauge", limiter.depth, labels))
+        for bucket, kind in ((limiter.requests, "requests"), (limiter.tokens, "tokens")):
+            if bucket is not None:
+                bucket.refill(time.monotonic())
+                rows.append(("rate_limit_available", "gauge", round(bucket.level, 1), {**labels, "bucket": kind}))
+    return rows
 
 # =============================================================================
 # AI API FUNCTIONS
 # =============================================================================
 
-def call_groq(messages, system_prompt):
+PROVIDERS = {
+    "groq": {
+        "base_url": "https://api.groq.com/openai/v1",
+        "model": "llama-3.3-70b-versatile",
+        "api_key_secret": "GROQ_API_KEY",
+        "timeout": 30,
+        # Free-tier limits for this model; set GROQ_REQUESTS_PER_MINUTE / GROQ_TOKENS_PER_MINUTE for paid tiers
+        "requests_per_minute": 30,
+        "tokens_per_minute": 12000
+    },
+    "deepseek": {
+        "base_url": "https://api.deepseek.com",
+        "model": "deepseek-chat",
+        "api_key_secret": "DEEPSEEK_API_KEY",
+        "timeout": 60,
+        # DeepSeek does not publish fixed limits; it slows responses under load instead
+        "requests_per_minute": None,
+        "tokens_per_minute": None
+    }
+}
+
+HTTP_POOL_SIZE = 10
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# 429s are left to the rate limiter, which knows when the bucket refills
+HTTP_RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+def get_secret(name, default=None):
+    """Read a secret from st.secrets, falling back to the environment (CLI/benchmarks)"""
+    try:
+        return st.secrets[name]
+    except Exception:
+        return os.environ.get(name, default)
+
+def get_provider_config(provider):
+    """Provider settings, with optional <PROVIDER>_BASE_URL / <PROVIDER>_TIMEOUT overrides"""
+    config = dict(PROVIDERS[provider])
+    prefix = provider.upper()
+    config["base_url"] = str(get_secret(f"{prefix}_BASE_URL", config["base_url"])).rstrip("/")
+    config["timeout"] = float(get_secret(f"{prefix}_TIMEOUT", config["timeout"]))
+    for limit in ("requests_per_minute", "tokens_per_minute"):
+        value = get_secret(f"{prefix}_{limit.upper()}", config[limit])
+        config[limit] = float(value) if value else None
+    return config
+
+def create_http_session(pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES):
+    """Keep-alive session with bounded connection pools and backoff on 5xx.
+
+    Provider base URLs get an adapter of their own, so sheet polls and data_url
+    checks never evict their keep-alive pools. Only GETs are retried after a
+    request was sent: a replayed chat completion is a second billed generation,
+    so POSTs are retried on connect errors alone."""
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    provider_adapter = HTTPAdapter(
+        pool_connections=len(PROVIDERS),
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=retry
+    )
+    for provider in PROVIDERS:
+        session.mount(get_provider_config(provider)["base_url"], provider_adapter)
+    return session
+
+@st.cache_resource
+def get_http_session():
+    # One pool per process, shared by every session and rerun
+    return create_http_session()
+
+class CancelToken:
+    """Set when whoever asked for an answer stops waiting for it (Stop, a job
+    timeout, a lost hedge race). Callbacks run on the cancelling thread, once."""
+    __slots__ = ("cancelled", "_callbacks", "_lock")
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Run callback on cancel (now, if already cancelled); returns a function that unregisters it"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+def abort_response(response):
+    """Unblock a read on a streaming response from another thread; the reader then
+    sees the connection end, and the pool discards it"""
     try:
-        api_key = st.secrets["GROQ_API_KEY"]
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
+        response.raw.connection.sock.shutdown(socket.SHUT_RDWR)
+    except (AttributeError, OSError):
+        pass  # already finished or closed
+
+def post_chat_completion(provider, messages, system_prompt, stream=False):
+    """POST through the provider's rate limiter; raises RateLimited rather than
+    returning a 429 the limiter could not wait out"""
+    config = get_provider_config(provider)
+    api_key = get_secret(config["api_key_secret"])
+    if not api_key:
+        raise KeyError(f"{config['api_key_secret']} not configured")
+    limiter = get_rate_limiter(provider, api_key)
+    cost = estimate_request_tokens(messages, system_prompt)
+    max_wait = float(get_secret("RATE_LIMIT_MAX_WAIT", RATE_LIMIT_MAX_WAIT))
+    metrics = get_metrics()
+    deadline = time.monotonic() + max_wait
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        try:
+            waited = limiter.acquire(cost, max(0.0, deadline - time.monotonic()))
+        except RateLimited:
+            metrics.inc("rate_limit_shed_total", provider=provider)
+            raise
+        metrics.observe("rate_limit_wait_ms", waited * 1000, provider=provider)
+        response = get_http_session().post(
+            f"{config['base_url']}/chat/completions",
             headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "llama-3.3-70b-versatile",
-                "messages": [{"role": "system", "content": system_prompt}, *messages],
-                "temperature": 0.7,
-                "max_tokens": 2000
-            },
-            timeout=30
+            json=build_chat_payload(config["model"], messages, system_prompt, stream),
+            timeout=config["timeout"],
+            stream=stream
         )
+        limiter.update(response.status_code, response.headers)
+        if response.status_code != 429:
+            return response
+        response.close()
+        metrics.inc("rate_limit_429_total", provider=provider)
+    metrics.inc("rate_limit_shed_total", provider=provider)
+    raise RateLimited(provider, max(0.0, limiter.blocked_until - time.monotonic()))
+
+def build_chat_payload(model, messages, system_prompt, stream=False):
+    # The system prompt leads so the provider's prefix cache sees identical leading tokens
+    payload = {
+        "model": model,
+        "messages": [{"role": "system", "content": system_prompt}, *messages],
+        "temperature": 0.7,
+        "max_tokens": 2000,
+        "stream": stream
+    }
+    if stream:
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+def record_usage(provider, usage):
+    if not usage:
+        return
+    metrics = get_metrics()
+    metrics.inc("llm_tokens_total", usage.get("prompt_tokens") or 0, provider=provider, type="prompt")
+    metrics.inc("llm_tokens_total", usage.get("completion_tokens") or 0, provider=provider, type="completion")
+    # DeepSeek reports prompt_cache_hit_tokens; OpenAI-compatible APIs (Groq) report
+    # prompt_tokens_details.cached_tokens
+    cached = usage.get("prompt_cache_hit_tokens")
+    if cached is None:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    metrics.inc("llm_usage_reports_total", provider=provider, cache_reported=cached is not None)
+    if cached is not None:
+        metrics.inc("llm_tokens_total", cached, provider=provider, type="cached_prompt")
+
+def record_llm_request(provider, status, start):
+    metrics = get_metrics()
+    metrics.inc("llm_requests_total", provider=provider, status=status)
+    metrics.observe("llm_request_latency_ms", elapsed_ms(start), provider=provider)
+
+def call_provider(provider, messages, system_prompt):
+    start = time.perf_counter()
+    status = "exception"
+    try:
+        response = post_chat_completion(provider, messages, system_prompt)
+        status = str(response.status_code)
         if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
+            body = response.json()
+            record_usage(provider, body.get("usage"))
+            return body["choices"][0]["message"]["content"]
         return f"Error: {response.status_code}"
+    except RateLimited as e:
+        status = "rate_limited"
+        return f"Error: {e}"
     except Exception as e:
         return f"Error: {str(e)}"
+    finally:
+        record_llm_request(provider, status, start)
 
-def call_deepseek(messages, system_prompt):
+def stream_provider(provider, messages, system_prompt, stop=None):
+    """Yield content deltas from a stream: true (SSE) completion.
+
+    Cancelling `stop` (a CancelToken) shuts the connection down, so the stream ends
+    at once rather than at the next chunk. A cancel that lands while the request is
+    still waiting on the rate limiter or for the response headers takes effect when
+    they arrive."""
+    start = time.perf_counter()
+    first_token = None
+    status = "exception"
+    unregister = None
     try:
-        api_key = st.secrets["DEEPSEEK_API_KEY"]
-        response = requests.post(
-            "https://api.deepseek.com/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "deepseek-chat",
-                "messages": [{"role": "system", "content": system_prompt}, *messages],
-                "temperature": 0.7,
-                "max_tokens": 2000
-            },
-            timeout=60
-        )
-        if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
-        return f"Error: {response.status_code}"
+        response = post_chat_completion(provider, messages, system_prompt, stream=True)
+        status = str(response.status_code)
+        with response:
+            if response.status_code != 200:
+                yield f"Error: {response.status_code}"
+                return
+            # Stays "cancelled" if the consumer closes the generator before [DONE]
+            status = "cancelled"
+            if stop is not None:
+                unregister = stop.on_cancel(lambda: abort_response(response))
+            for line in response.iter_lines():
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                # Usage arrives on the final chunk (Groq nests it under x_groq)
+                record_usage(provider, event.get("usage") or (event.get("x_groq") or {}).get("usage"))
+                choices = event.get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    if first_token is None:
+                        first_token = elapsed_ms(start)
+                        get_metrics().observe("llm_time_to_first_token_ms", first_token, provider=provider)
+                    yield delta
+            if stop is not None and stop.cancelled:
+                return
+            status = "200"
+    except RateLimited as e:
+        status = "rate_limited"
+        yield f"Error: {e}"
     except Exception as e:
-        return f"Error: {str(e)}"
+        if stop is not None and stop.cancelled:
+            return  # the aborted connection, not a provider failure
+        status = "exception"
+        yield f"Error: {str(e)}"
+    finally:
+        if unregister is not None:
+            unregister()
+        record_llm_request(provider, status, start)
+
+def call_groq(messages, system_prompt):
+    return call_provider("groq", messages, system_prompt)
 
-def call_ai(messages, system_prompt):
-    if st.session_state.ai_provider == "groq":
+def call_deepseek(messages, system_prompt):
+    return call_provider("deepseek", messages, system_prompt)
+
+def call_ai(messages, system_prompt, provider=None, hedge_setting=None):
+    # Interactive calls take the session's provider and hedging setting; jobs run
+    # off the script thread and pass both in. Warm-up passes neither and never hedges.
+    if provider is None:
+        provider = st.session_state.ai_provider
+        hedge_setting = st.session_state.hedge_delay
+    if hedge_setting is not None:
+        hedged = hedged_stream(messages, system_prompt, provider, hedge_setting)
+        if hedged is not None:
+            return "".join(hedged)
+    if provider == "groq":
         return call_groq(messages, system_prompt)
     return call_deepseek(messages, system_prompt)
 
+def stream_ai(messages, system_prompt, provider=None, hedge_setting=None, stop=None):
+    if provider is None:
+        provider = st.session_state.ai_provider
+        hedge_setting = st.session_state.hedge_delay
+    if hedge_setting is not None:
+        hedged = hedged_stream(messages, system_prompt, provider, hedge_setting, stop)
+        if hedged is not None:
+            return hedged
+    return stream_provider(provider, messages, system_prompt, stop)
+
 def format_stats_for_prompt(stats):
     if not stats:
         return "No statistics available."
@@ -318,10 +2906,28 @@ def format_stats_for_prompt(stats):
         formatted.append(f"- {stat.get('stat_name', 'N/A')}: {stat.get('stat_value', 'N/A')}")
     return "\n".join(formatted)
 
-def get_ai_response(user_question, dataset_name, stats):
-    stats_text = format_stats_for_prompt(stats)
+QUERY_PROMPT = """
+
+DATA ACCESS:
+The app can compute exact numbers from the full "{dataset_name}" table. When a question needs a count, average, ranking, trend or chart, do not write the numbers or chart data yourself. Include exactly one query block instead; the app runs it and inserts the results and a chart where the block was:
+```query
+{{"filters": [{{"column": "year", "op": "between", "value": [2015, 2020]}}], "group_by": ["town"], "metrics": [{{"column": "resale_price", "agg": "mean"}}], "sort": "desc", "limit": 10, "chart_type": "bar", "title": "Average price by town"}}
+```
+Operators: {operators}. Aggregates: {aggregates} (count needs no column). sort is asc/desc by the first metric, or asc_group/desc_group by the group columns. group_by takes at most {max_group_by} columns.
+Write one short sentence before the block and the follow-up questions after it.
+
+TABLE COLUMNS:
+{schema}"""
+
+def build_system_prompt(dataset_name, stats, table=None):
+    """Full system prompt; stats=None leaves the statistics to the per-question message,
+    a table adds the query-mode instructions for it"""
+    if stats is None:
+        stats_text = "The statistics relevant to each question are included with the question."
+    else:
+        stats_text = format_stats_for_prompt(stats)
     
-    system_prompt = f"""You are an expert data analyst helping users understand the "{dataset_name}" dataset.
+    return f"""You are an expert data analyst helping users understand the "{dataset_name}" dataset.
 
 AVAILABLE STATISTICS:
 {stats_text}
@@ -359,16 +2965,1168 @@ Follow-up questions:
 If asked to create a chart, include:
 ```json
 {{"chart_type": "bar", "title": "Title", "data": {{"labels": [...], "values": [...]}}, "x_label": "X", "y_label": "Y"}}
-```"""
+```""" + (format_query_prompt(dataset_name, table) if table is not None else "")
+
+def format_query_prompt(dataset_name, table):
+    return QUERY_PROMPT.format(
+        dataset_name=dataset_name,
+        operators=", ".join(QUERY_OPERATORS),
+        aggregates=", ".join(QUERY_AGGREGATES),
+        max_group_by=QUERY_MAX_GROUP_BY,
+        schema=format_schema_for_prompt(table.schema)
+    )
+
+@st.cache_resource(max_entries=128)
+def get_prompt_prefix(dataset_name, stats_version, _stats, table_version=None, _table=None):
+    # Rendered once per (dataset, stats version, table version); byte-identical across questions
+    return build_system_prompt(dataset_name, _stats, _table)
+
+def build_prompt(user_question, dataset_name, stats, dataset_id=None, history=None):
+    """(system prefix, messages): the cached static prefix, then recent turns from
+    history (summary, recent messages), then the per-question suffix"""
+    table = query_mode_table(dataset_id)
+    table_version = (table.dataset_id, table.version) if table is not None else None
+    summary, recent = history or (None, [])
+    question = f"CONVERSATION SO FAR:\n{summary}\n\nQUESTION: {user_question}" if summary else user_question
+    selected = select_prompt_stats(user_question, stats)
+    if selected is stats:
+        prefix = get_prompt_prefix(dataset_name, get_stats_version(stats), stats, table_version, table)
+        return prefix, [*recent, {"role": "user", "content": question}]
+    prefix = get_prompt_prefix(dataset_name, None, None, table_version, table)
+    if not summary:
+        question = f"QUESTION: {user_question}"
+    suffix = f"RELEVANT STATISTICS:\n{format_stats_for_prompt(selected)}\n\n{question}"
+    return prefix, [*recent, {"role": "user", "content": suffix}]
+
+def get_ai_response(user_question, dataset_name, stats, provider=None, dataset_id=None, hedge_setting=None, history=None):
+    system_prompt, messages = build_prompt(user_question, dataset_name, stats, dataset_id, history)
+    response = call_ai(messages, system_prompt, provider=provider, hedge_setting=hedge_setting)
+    return resolve_query_blocks(response, dataset_id)
+
+def stream_ai_response(user_question, dataset_name, stats, dataset_id=None, provider=None, hedge_setting=None, history=None,
+                       stop=None):
+    """Streams the raw reply; the caller runs resolve_query_blocks on the full text"""
+    system_prompt, messages = build_prompt(user_question, dataset_name, stats, dataset_id, history)
+    return stream_ai(messages, system_prompt, provider=provider, hedge_setting=hedge_setting, stop=stop)
+
+# =============================================================================
+# HEDGED REQUESTS
+# =============================================================================
+
+HEDGE_DELAY_OPTIONS = {
+    "Off": None,
+    "Auto (primary p95)": "p95",
+    "0.5 s": 0.5,
+    "1 s": 1.0,
+    "2 s": 2.0,
+    "5 s": 5.0
+}
+HEDGE_DEFAULT_DELAY = 2.0
+HEDGE_MIN_SAMPLES = 10
+HEDGE_MAX_WORKERS = 8
+
+class AsyncProvider:
+    """asyncio face of one chat provider.
+
+    The pooled HTTP call runs on a dedicated thread pool and streams deltas back
+    through an asyncio.Queue. Closing the async generator (e.g. when a race is lost)
+    cancels the provider stream, which shuts its connection down."""
+
+    def __init__(self, name, executor):
+        self.name = name
+        self.executor = executor
+
+    async def stream(self, messages, system_prompt):
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+        stop = CancelToken()
+
+        def publish(item):
+            try:
+                loop.call_soon_threadsafe(deltas.put_nowait, item)
+            except RuntimeError:
+                stop.cancel()  # event loop already closed
+
+        def produce():
+            chunks = stream_provider(self.name, messages, system_prompt, stop)
+            try:
+                for delta in chunks:
+                    if stop.cancelled:
+                        break
+                    publish(delta)
+            finally:
+                chunks.close()
+                publish(None)
+
+        loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                delta = await deltas.get()
+                if delta is None:
+                    return
+                yield delta
+        finally:
+            stop.cancel()
+
+    async def complete(self, messages, system_prompt):
+        return "".join([delta async for delta in self.stream(messages, system_prompt)])
+
+@st.cache_resource
+def get_async_providers():
+    executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="provider")
+    return {name: AsyncProvider(name, executor) for name in PROVIDERS}
+
+def is_error_response(text):
+    return text is None or text.startswith("Error")
+
+async def race_stream(messages, system_prompt, primary, secondary, hedge_delay):
+    """Stream from primary; if it has not produced a first token within hedge_delay
+    seconds (or fails), also ask secondary. The first provider to produce a token wins
+    and the other request is cancelled."""
+    providers = get_async_providers()
+    streams = {}
+    first_chunk = {}
+
+    def start(name):
+        streams[name] = providers[name].stream(messages, system_prompt)
+        first_chunk[asyncio.ensure_future(anext(streams[name], None))] = name
+
+    try:
+        start(primary)
+        pending = set(first_chunk)
+        winner, chunk, last_error = None, None, None
+        while pending and winner is None:
+            timeout = hedge_delay if secondary not in streams else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if not is_error_response(result):
+                    winner, chunk = first_chunk[task], result
+                    break
+                last_error = result
+            if winner is None and secondary not in streams:
+                start(secondary)
+                pending = {task for task, name in first_chunk.items() if not task.done()}
+
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for name, stream in streams.items():
+            if name != winner:
+                await stream.aclose()
+        if winner is None:
+            yield last_error or "Error: no provider answered"
+            return
+        get_metrics().inc("hedge_races_total", hedged=secondary in streams)
+        get_metrics().inc("hedge_wins_total", provider=winner)
+        yield chunk
+        async for delta in streams[winner]:
+            yield delta
+    finally:
+        # Runs when the consumer stops early too, so the winner is closed as well
+        # as the loser. First-chunk reads still in flight must end before aclose().
+        for task in first_chunk:
+            task.cancel()
+        await asyncio.gather(*first_chunk, return_exceptions=True)
+        for stream in streams.values():
+            await stream.aclose()
+
+def iterate_async(async_generator, stop=None):
+    """Drive an async generator on its own event loop thread and yield its items here.
+    Closing this generator early, or cancelling `stop`, cancels the pump on that loop,
+    which closes the async generator and with it the upstream response."""
+    items = queue.Queue()
+    done = object()
+    started = threading.Event()
+    handle = {}
+
+    async def pump():
+        handle["loop"], handle["task"] = asyncio.get_running_loop(), asyncio.current_task()
+        started.set()
+        try:
+            async for item in async_generator:
+                items.put(item)
+        finally:
+            await async_generator.aclose()
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            items.put(f"Error: {str(e)}")
+        finally:
+            started.set()
+            items.put(done)
+
+    def cancel():
+        started.wait()
+        try:
+            handle["loop"].call_soon_threadsafe(handle["task"].cancel)
+        except (KeyError, RuntimeError):
+            pass  # the loop has already finished
+
+    threading.Thread(target=run, name="hedge-loop", daemon=True).start()
+    unregister = stop.on_cancel(cancel) if stop is not None else None
+    finished = False
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                finished = True
+                return
+            yield item
+    finally:
+        if unregister is not None:
+            unregister()
+        if not finished:
+            cancel()
+
+def get_hedge_delay(provider, hedge_setting):
+    """Seconds to wait for the primary before hedging, or None when hedging is off"""
+    setting = HEDGE_DELAY_OPTIONS.get(hedge_setting)
+    if setting != "p95":
+        return setting
+    metrics = get_metrics()
+    if metrics.total("llm_requests_total", provider=provider) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    p95 = metrics.quantiles("llm_time_to_first_token_ms", (0.95,), provider=provider)[0]
+    return p95 / 1000 if p95 else HEDGE_DEFAULT_DELAY
+
+def get_hedge_partner(provider):
+    for name, config in PROVIDERS.items():
+        if name != provider and get_secret(config["api_key_secret"]):
+            return name
+    return None
+
+def hedged_stream(messages, system_prompt, provider, hedge_setting, stop=None):
+    """Racing stream for interactive calls, or None when hedging does not apply"""
+    hedge_delay = get_hedge_delay(provider, hedge_setting)
+    secondary = get_hedge_partner(provider)
+    if hedge_delay is None or secondary is None:
+        return None
+    return iterate_async(race_stream(messages, system_prompt, provider, secondary, hedge_delay), stop)
+
+# =============================================================================
+# RESPONSE CACHE
+# =============================================================================
+
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESPONSE_CACHE_PATH = os.path.join(".cache", "responses.sqlite")
+SIMILARITY_INDEX_LIMIT = 500
+CACHE_L1_MAX_BYTES = 8 * 1024 * 1024
+CACHE_L1_TTL = 60
+CACHE_LEASE_TTL = 30
+CACHE_LEASE_POLL = 0.05
+CACHE_COALESCE_TIMEOUT = 30
+
+def normalize_question(question):
+    question = re.sub(r'\s+', ' ', question.strip().lower())
+    return question.rstrip('?.! ')
+
+def get_stats_version(stats):
+    """Content hash of the stats rows, so answers are invalidated when the Stats tab changes"""
+    if getattr(stats, "version", None):
+        return stats.version
+    payload = json.dumps(stats, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+def embed_question(question, dims=512):
+    """Cheap local embedding: hashed word + character-trigram counts, L2-normalised"""
+    words = re.findall(r'[a-z0-9]+', normalize_question(question))
+    grams = words + [w[i:i + 3] for w in words if len(w) > 3 for i in range(len(w) - 2)]
+    vector = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) % dims
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {k: v / norm for k, v in vector.items()}
+
+def cosine_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry TTL and a total size bound in bytes"""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, size = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.total_bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.total_bytes -= old[2]
+            self._entries[key] = (value, time.time() + ttl, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def info(self):
+        return {"entries": len(self._entries), "bytes": self.total_bytes}
+
+class SQLiteCacheBackend:
+    """File-backed LRU (by last access) with TTL and a size bound; survives restarts"""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL lets readers in other processes proceed while one writes; the busy
+        # timeout makes concurrent writers queue instead of failing with "locked"
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT, size INTEGER, expires_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value, ttl):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl, now)
+            )
+            self._conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop least recently used rows until the running total fits
+                self._conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS running FROM entries)"
+                    " WHERE running > ?)",
+                    (self.max_bytes,)
+                )
+
+    def acquire_lease(self, key, owner, ttl):
+        """True if owner may load key; other processes wait for the value instead"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = self._conn.execute("INSERT OR IGNORE INTO leases VALUES (?, ?, ?)", (key, owner, now + ttl))
+            return cursor.rowcount == 1
+
+    def release_lease(self, key, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def info(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": total}
+
+class RedisCacheBackend:
+    """Any Redis-compatible server (Redis, Valkey, KeyDB...). TTL is per key; LRU and the
+    byte bound come from the server's maxmemory / allkeys-lru settings."""
+
+    def __init__(self, url, prefix="ai-response:"):
+        import redis
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self._client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def acquire_lease(self, key, owner, ttl):
+        return bool(self._client.set(f"{self.prefix}lease:{key}", owner, nx=True, ex=max(1, int(ttl))))
+
+    def release_lease(self, key, owner):
+        lease = f"{self.prefix}lease:{key}"
+        if self._client.get(lease) == owner:
+            self._client.delete(lease)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + "*"):
+            self._client.delete(key)
+
+    def info(self):
+        memory = self._client.info("memory")
+        return {"entries": sum(1 for _ in self._client.scan_iter(match=self.prefix + "*")), "bytes": memory.get("used_memory", 0)}
+
+class TieredCache:
+    """In-process L1 LRU in front of an optional shared L2 (SQLite on a shared volume,
+    or Redis), with the same get/set/clear/info interface as the backends.
+
+    L1 copies of L2 entries live at most l1_ttl seconds, which bounds how stale one
+    replica can be after another changes or clears L2. get_or_load coalesces misses:
+    concurrent callers in a process wait for one load, and an L2 lease makes other
+    processes wait for it as well instead of repeating the upstream fetch."""
+
+    def __init__(self, l1, l2=None, l1_ttl=CACHE_L1_TTL, lease_ttl=CACHE_LEASE_TTL):
+        self.l1 = l1
+        self.l2 = l2
+        self.l1_ttl = l1_ttl
+        self.lease_ttl = lease_ttl
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.counts = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "loads": 0, "coalesced": 0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _l1_ttl(self, ttl):
+        return min(ttl, self.l1_ttl) if self.l2 is not None else ttl
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is not None:
+            self._count("l1_hits")
+            return value
+        if self.l2 is not None:
+            value = self.l2.get(key)
+            if value is not None:
+                self._count("l2_hits")
+                self.l1.set(key, value, self.l1_ttl)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl):
+        self.l1.set(key, value, self._l1_ttl(ttl))
+        if self.l2 is not None:
+            self.l2.set(key, value, ttl)
+
+    def get_or_load(self, key, loader, ttl, timeout=CACHE_COALESCE_TIMEOUT):
+        """Cached value, or loader()'s result stored for ttl seconds. A loader that
+        returns None is not cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {"done": threading.Event(), "value": None}
+        if not leader:
+            if flight["done"].wait(timeout) and flight["value"] is not None:
+                self._count("coalesced")
+                return flight["value"]
+            return self._load(key, loader, ttl, timeout)
+        try:
+            flight["value"] = self._load(key, loader, ttl, timeout)
+            return flight["value"]
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight["done"].set()
+
+    def claim(self, key, timeout=CACHE_COALESCE_TIMEOUT):
+        """(value, leased) before loading key outside get_or_load, e.g. a streamed
+        answer. value is set when another process stored it meanwhile; otherwise
+        leased says whether this process holds the L2 lease and must release() it
+        once the value is stored. Without a shared L2 this returns (None, False)."""
+        if self.l2 is None or not hasattr(self.l2, "acquire_lease"):
+            return None, False
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.l2.acquire_lease(key, self.owner, self.lease_ttl):
+                break
+            # Another process is loading; its result lands in L2
+            time.sleep(CACHE_LEASE_POLL)
+            value = self.l2.get(key)
+            if value is not None:
+                self._count("coalesced")
+                self.l1.set(key, value, self.l1_ttl)
+                return value, False
+            if time.monotonic() > deadline:
+                return None, False
+        value = self.l2.get(key)
+        if value is not None:
+            self.l1.set(key, value, self.l1_ttl)
+            self.release(key)
+            return value, False
+        return None, True
+
+    def release(self, key):
+        self.l2.release_lease(key, self.owner)
+
+    def _load(self, key, loader, ttl, timeout):
+        value, leased = self.claim(key, timeout)
+        if value is not None:
+            return value
+        try:
+            self._count("loads")
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            if leased:
+                self.release(key)
+
+    def clear(self):
+        self.l1.clear()
+        if self.l2 is not None:
+            self.l2.clear()
+
+    def info(self):
+        info = (self.l2 or self.l1).info()
+        return {
+            **info,
+            "l1_entries": self.l1.info()["entries"],
+            "l1_hits": self.counts["l1_hits"],
+            "l2_hits": self.counts["l2_hits"]
+        }
+
+def create_cache_backend(name, sqlite_path, redis_prefix, max_bytes, l1_max_bytes=CACHE_L1_MAX_BYTES):
+    """TieredCache for a RESPONSE_CACHE_BACKEND-style setting: "memory" is L1 only,
+    "sqlite" and "redis" add the shared L2"""
+    if name == "sqlite":
+        l2 = SQLiteCacheBackend(sqlite_path, max_bytes)
+    elif name == "redis":
+        l2 = RedisCacheBackend(get_secret("REDIS_URL", "redis://localhost:6379/0"), prefix=redis_prefix)
+    else:
+        return TieredCache(MemoryCacheBackend(max_bytes))
+    return TieredCache(
+        MemoryCacheBackend(min(l1_max_bytes, max_bytes)), l2,
+        l1_ttl=float(get_secret("CACHE_L1_TTL", CACHE_L1_TTL))
+    )
+
+class ResponseCache:
+    """Answers keyed on (provider, model, dataset_id, stats version, normalized question).
+    With a similarity threshold set, near-duplicate questions in the same scope also hit."""
+
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL, similarity_threshold=0.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._similar = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(scope, question):
+        digest = hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+        return "|".join([*map(str, scope), digest])
+
+    def _find_similar(self, scope, question):
+        candidates = self._similar.get(scope)
+        if not candidates or self.similarity_threshold <= 0:
+            return None
+        vector = embed_question(question)
+        best_key, best_score = None, self.similarity_threshold
+        for candidate_vector, key in candidates:
+            score = cosine_similarity(vector, candidate_vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, scope, question):
+        value = self.backend.get(self.make_key(scope, question))
+        near = False
+        if value is None:
+            similar_key = self._find_similar(scope, question)
+            if similar_key:
+                value = self.backend.get(similar_key)
+                near = value is not None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.near_hits += near
+                self.bytes_saved += len(value.encode("utf-8"))
+        return value
+
+    def put(self, scope, question, value):
+        key = self.make_key(scope, question)
+        self.backend.set(key, value, self.ttl)
+        if self.similarity_threshold > 0:
+            with self._lock:
+                candidates = self._similar.setdefault(scope, [])
+                candidates.append((embed_question(question), key))
+                del candidates[:-SIMILARITY_INDEX_LIMIT]
+
+    def contains(self, scope, question):
+        # Exact-key probe that does not count towards hit/miss statistics
+        return self.backend.get(self.make_key(scope, question)) is not None
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._similar.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            **self.backend.info()
+        }
+
+@st.cache_resource
+def get_response_cache():
+    backend = create_cache_backend(
+        get_secret("RESPONSE_CACHE_BACKEND", "memory"),
+        get_secret("RESPONSE_CACHE_PATH", RESPONSE_CACHE_PATH),
+        "ai-response:",
+        int(get_secret("RESPONSE_CACHE_MAX_BYTES", RESPONSE_CACHE_MAX_BYTES))
+    )
+    return ResponseCache(
+        backend,
+        ttl=float(get_secret("RESPONSE_CACHE_TTL", RESPONSE_CACHE_TTL)),
+        similarity_threshold=float(get_secret("RESPONSE_CACHE_SIMILARITY", 0.0))
+    )
+
+def response_cache_metrics():
+    stats = get_response_cache().stats()
+    return [
+        ("response_cache_hits_total", "counter", stats["hits"]),
+        ("response_cache_misses_total", "counter", stats["misses"]),
+        ("response_cache_bytes_saved_total", "counter", stats["bytes_saved"]),
+        ("response_cache_entries", "gauge", stats["entries"]),
+        ("response_cache_bytes", "gauge", stats["bytes"])
+    ]
+
+def cache_tier_metrics():
+    rows = []
+    for name, cache in (("responses", get_response_cache().backend), ("sheets", get_sheet_cache())):
+        if cache is None:
+            continue
+        counts = dict(cache.counts)
+        for tier, key in (("l1", "l1_hits"), ("l2", "l2_hits"), ("miss", "misses")):
+            rows.append(("cache_lookups_total", "counter", counts[key], {"cache": name, "result": tier}))
+        rows.append(("cache_loads_total", "counter", counts["loads"], {"cache": name}))
+        rows.append(("cache_coalesced_total", "counter", counts["coalesced"], {"cache": name}))
+    return rows
+
+def response_cache_scope(provider, dataset_id, stats):
+    # Query-mode answers carry numbers computed from the table, so they key on its version
+    table_version = dataset_table_version(dataset_id) if dataset_id and get_query_settings()["enabled"] else None
+    return (provider, PROVIDERS[provider]["model"], dataset_id, get_stats_version(stats), table_version)
+
+def get_cached_response(provider, dataset_id, stats, question):
+    try:
+        return get_response_cache().get(response_cache_scope(provider, dataset_id, stats), question)
+    except Exception:
+        return None
+
+def store_cached_response(provider, dataset_id, stats, question, response):
+    if not response or response.startswith("Error"):
+        return
+    try:
+        get_response_cache().put(response_cache_scope(provider, dataset_id, stats), question, response)
+    except Exception:
+        pass
+
+# =============================================================================
+# SUGGESTION WARM-UP
+# =============================================================================
+
+WARMUP_MAX_WORKERS = 2
+WARMUP_CHECK_INTERVAL = 60
+
+class SuggestionWarmer:
+    """Answers the starter questions in a small thread pool and stores them in the
+    response cache. Each (provider, dataset, stats version) is warmed once, so a
+    Stats tab change schedules a fresh round."""
+
+    def __init__(self, cache, max_workers=WARMUP_MAX_WORKERS):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="warmup")
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self.last_check = 0.0
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    def due(self):
+        return time.time() - self.last_check >= WARMUP_CHECK_INTERVAL
+
+    def schedule(self, provider, dataset, stats):
+        self.last_check = time.time()
+        scope = response_cache_scope(provider, dataset['dataset_id'], stats)
+        with self._lock:
+            if scope in self._scheduled:
+                return
+            self._scheduled.add(scope)
+        for question in get_initial_suggestions(dataset['dataset_id']):
+            with self._lock:
+                self.pending += 1
+            self._executor.submit(self._warm, scope, provider, dataset, stats, question)
 
-    return call_ai([{"role": "user", "content": user_question}], system_prompt)
+    def _warm(self, scope, provider, dataset, stats, question):
+        try:
+            if not self.cache.contains(scope, question):
+                if rate_limit_headroom(provider) < RATE_LIMIT_BACKGROUND_HEADROOM:
+                    # Leave the provider's budget to users; the next check schedules this again
+                    with self._lock:
+                        self._scheduled.discard(scope)
+                        self.pending -= 1
+                    return
+                response = get_ai_response(
+                    question, dataset['dataset_name'], stats, provider=provider, dataset_id=dataset['dataset_id']
+                )
+                if response.startswith("Error"):
+                    raise RuntimeError(response)
+                self.cache.put(scope, question, response)
+            outcome = "completed"
+        except Exception:
+            outcome = "failed"
+        with self._lock:
+            self.pending -= 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+@st.cache_resource
+def get_suggestion_warmer():
+    return SuggestionWarmer(get_response_cache())
+
+def get_warmup_providers():
+    """WARMUP_PROVIDERS (comma-separated), else every provider with an API key"""
+    names = [name.strip() for name in str(get_secret("WARMUP_PROVIDERS", "")).split(",") if name.strip() in PROVIDERS]
+    return [name for name in names or PROVIDERS if get_secret(PROVIDERS[name]["api_key_secret"])]
+
+def warm_initial_suggestions(datasets):
+    """Queue warm-up for every dataset and warm-up provider, whichever provider the
+    session that happens to trigger the check has picked; never waits on the provider"""
+    warmer = get_suggestion_warmer()
+    if not warmer.due():
+        return
+    for provider in get_warmup_providers():
+        for ds in datasets:
+            warmer.schedule(provider, ds, get_stats(ds['dataset_id']))
+
+# =============================================================================
+# BACKGROUND JOBS
+# =============================================================================
+
+LLM_JOB_CONCURRENCY = 4
+LLM_JOB_POLL_INTERVAL = 0.25
+LLM_JOB_RETENTION = 600
+LLM_JOB_TIMEOUT = 180
+LLM_SINGLE_FLIGHT_MAX_AGE = 60
+
+class LLMJob:
+    """One question answered off the script thread. Workers append streamed
+    chunks; the session's polling fragment reads them."""
+    __slots__ = (
+        "id", "owner", "provider", "run", "finalize", "status", "chunks", "response",
+        "submitted_at", "started_at", "first_token_at", "finished_at", "stop", "key", "subscribers"
+    )
+
+    def __init__(self, owner, provider, run, finalize=None, key=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.provider = provider
+        self.run = run
+        self.finalize = finalize
+        self.status = "queued"
+        self.chunks = []
+        self.response = None
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        self.stop = CancelToken()
+        self.key = key
+        self.subscribers = 1
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def cancelled(self):
+        return self.stop.cancelled
+
+    @property
+    def partial(self):
+        return "".join(self.chunks)
+
+    def timing(self, since=None):
+        """Times as the user saw them, queue wait included. `since` is when a
+        session that joined the job later started waiting."""
+        end = self.finished_at or time.perf_counter()
+        start = max(since or self.submitted_at, self.submitted_at)
+        return {
+            "ttft_ms": round((max(self.first_token_at or end, start) - start) * 1000, 1),
+            "total_ms": round((end - start) * 1000, 1),
+            "queue_ms": round((max(self.started_at or end, start) - start) * 1000, 1)
+        }
+
+class LLMJobQueue:
+    """Runs LLM requests on worker threads instead of Streamlit script threads.
+
+    Each provider has its own fixed set of workers, so at most `concurrency`
+    requests per provider are in flight. Waiting jobs are grouped by session and
+    sessions are served round-robin, so one user's burst cannot starve the rest.
+
+    Jobs submitted with a `key` are single-flight: while one is queued or
+    running, an identical submission (same dataset, provider and question, e.g.
+    a starter button clicked by many users at once) joins it instead of making
+    its own upstream call, and every session reads the same result."""
+
+    def __init__(self, concurrency):
+        self._cond = threading.Condition()
+        self._waiting = {provider: OrderedDict() for provider in concurrency}
+        self._jobs = {}
+        self._flights = {}
+        self.running = {provider: 0 for provider in concurrency}
+        for provider, workers in concurrency.items():
+            for i in range(workers):
+                threading.Thread(target=self._work, args=(provider,), name=f"llm-{provider}-{i}", daemon=True).start()
+
+    def submit(self, owner, provider, run, finalize=None, key=None):
+        """Queue run(stop), a callable returning an iterable of text chunks, or join
+        the in-flight job with the same key. `stop` is the job's CancelToken; run
+        passes it on to the provider stream so cancel ends the upstream call."""
+        with self._cond:
+            self._prune()
+            job = self._flights.get(key) if key is not None else None
+            # A flight that has been going for too long may be stuck; start a fresh one
+            if job is not None and time.perf_counter() - job.submitted_at < LLM_SINGLE_FLIGHT_MAX_AGE:
+                job.subscribers += 1
+                joined = True
+            else:
+                job = LLMJob(owner, provider, run, finalize, key)
+                self._jobs[job.id] = job
+                if key is not None:
+                    self._flights[key] = job
+                self._waiting[provider].setdefault(owner, deque()).append(job)
+                self._cond.notify_all()
+                joined = False
+        if key is not None:
+            get_metrics().inc("llm_single_flight_total", provider=provider, result="joined" if joined else "leader")
+        if not joined:
+            get_metrics().inc("llm_jobs_total", provider=provider, outcome="submitted")
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Detach one session from the job; the upstream call stops when the last one
+        leaves. Its connection is shut down at once, which frees the worker; a request
+        still waiting on the rate limiter or for response headers stops when they arrive."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return
+            self._land(job)
+            waiting = self._waiting[job.provider].get(job.owner)
+            if job.status == "queued" and waiting and job in waiting:
+                waiting.remove(job)
+                if not waiting:
+                    del self._waiting[job.provider][job.owner]
+                self._finish(job, "cancelled")
+        # Outside the lock: the callbacks close connections and wake the worker
+        job.stop.cancel()
+
+    def position(self, job):
+        """Jobs a worker will pick before this one, given round-robin order"""
+        with self._cond:
+            owners = self._waiting[job.provider]
+            mine = owners.get(job.owner)
+            if job.status != "queued" or not mine or job not in mine:
+                return 0
+            rank = mine.index(job)
+            ahead = rank
+            before = True
+            for owner, jobs in owners.items():
+                if owner == job.owner:
+                    before = False
+                else:
+                    # Sessions ahead in the rotation get one more turn before ours
+                    ahead += min(len(jobs), rank + 1 if before else rank)
+            return ahead
+
+    def depth(self, provider=None):
+        with self._cond:
+            providers = [provider] if provider else list(self._waiting)
+            return sum(len(jobs) for p in providers for jobs in self._waiting[p].values())
+
+    def _next(self, provider):
+        with self._cond:
+            owners = self._waiting[provider]
+            while not owners:
+                self._cond.wait()
+            owner, jobs = next(iter(owners.items()))
+            job = jobs.popleft()
+            # Re-inserting moves the session to the back of the round-robin order
+            del owners[owner]
+            if jobs:
+                owners[owner] = jobs
+            job.status = "running"
+            job.started_at = time.perf_counter()
+            self.running[provider] += 1
+        get_metrics().observe("llm_job_queue_wait_ms", (job.started_at - job.submitted_at) * 1000, provider=provider)
+        return job
+
+    def _work(self, provider):
+        while True:
+            job = self._next(provider)
+            outcome = "done"
+            try:
+                chunks = job.run(job.stop)
+                for chunk in chunks:
+                    if job.cancelled:
+                        break
+                    if job.first_token_at is None:
+                        job.first_token_at = time.perf_counter()
+                    job.chunks.append(chunk)
+                if hasattr(chunks, "close"):
+                    chunks.close()
+                # A cancelled stream can also just end, without another chunk
+                if job.cancelled:
+                    outcome = "cancelled"
+                response = job.partial
+                if outcome == "done" and job.finalize:
+                    response = job.finalize(response)
+                job.response = response
+            except Exception as e:
+                job.response = f"Error: {e}"
+                outcome = "failed"
+            with self._cond:
+                self.running[provider] -= 1
+                self._finish(job, outcome)
+
+    def _land(self, job):
+        # Called with the lock held. finalize has already cached a good answer,
+        # so identical questions arriving from now on are cache hits
+        if job.key is not None and self._flights.get(job.key) is job:
+            del self._flights[job.key]
+
+    def _finish(self, job, outcome):
+        self._land(job)
+        job.finished_at = time.perf_counter()
+        job.status = outcome
+        get_metrics().inc("llm_jobs_total", provider=job.provider, outcome=outcome)
+
+    def _prune(self):
+        cutoff = time.perf_counter() - LLM_JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+@st.cache_resource
+def get_llm_jobs():
+    concurrency = {
+        name: int(get_secret(f"{name.upper()}_MAX_CONCURRENCY", get_secret("LLM_MAX_CONCURRENCY", LLM_JOB_CONCURRENCY)))
+        for name in PROVIDERS
+    }
+    return LLMJobQueue(concurrency)
+
+def llm_job_metrics():
+    jobs = get_llm_jobs()
+    return [
+        *(("llm_job_queue_depth", "gauge", jobs.depth(name), {"provider": name}) for name in PROVIDERS),
+        *(("llm_jobs_running", "gauge", jobs.running[name], {"provider": name}) for name in PROVIDERS)
+    ]
+
+def single_flight_key(provider, dataset_id, stats, question, history=None):
+    """Identity of an answer: the response-cache scope, the normalized question and
+    the conversation context it was asked in. None when single-flight is off."""
+    if str(get_secret("LLM_SINGLE_FLIGHT", "on")).lower() in ("off", "false", "0"):
+        return None
+    context = hashlib.sha1(json.dumps(history, default=str).encode("utf-8")).hexdigest()[:12] if history else None
+    return (*response_cache_scope(provider, dataset_id, stats), normalize_question(question), context)
+
+def start_answer_job(owner, provider, question, dataset, stats, history=None, hedge_setting="Off", stream=True):
+    """Submit (or join) the job answering `question`; callable from any thread"""
+    dataset_id, dataset_name = dataset['dataset_id'], dataset['dataset_name']
+    def run(stop):
+        chunks = stream_ai_response(
+            question, dataset_name, stats, dataset_id=dataset_id, provider=provider,
+            hedge_setting=hedge_setting, history=history, stop=stop
+        )
+        # Without streaming the reply still arrives as a stream, joined here, so
+        # cancelling the job ends the upstream call the same way
+        return chunks if stream else ["".join(chunks)]
+
+    def finalize(response):
+        response = resolve_query_blocks(response, dataset_id)
+        # Answers that depended on earlier turns are not reusable for other conversations
+        if history is None:
+            store_cached_response(provider, dataset_id, stats, question, response)
+        return response
+
+    if history is None:
+        run, finalize = coalesce_across_replicas(provider, dataset_id, stats, question, run, finalize)
+    key = single_flight_key(provider, dataset_id, stats, question, history)
+    return get_llm_jobs().submit(owner, provider, run, finalize, key)
+
+def coalesce_across_replicas(provider, dataset_id, stats, question, run, finalize):
+    """Wrap an answer job so that, with a shared L2 response cache, only one replica
+    calls the provider for a question: the others wait for its lease and read the
+    answer from L2. The wait happens on the job's worker, not the script thread."""
+    backend = get_response_cache().backend
+    if not hasattr(backend, "claim"):
+        return run, finalize
+    cache_key = ResponseCache.make_key(response_cache_scope(provider, dataset_id, stats), question)
+    lease = {}
+
+    def release():
+        # Called from the worker and, on cancel, from the cancelling thread: pop is atomic
+        if lease.pop("held", False):
+            backend.release(cache_key)
+
+    def guarded(chunks, stop):
+        completed = False
+        try:
+            for chunk in chunks:
+                yield chunk
+            # A cancelled stream can end normally too; its job is never finalized
+            completed = not stop.cancelled
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            # A finished answer keeps the lease until finalize has stored it
+            if not completed:
+                release()
+
+    def coalesced_run(stop):
+        value, leased = backend.claim(cache_key)
+        if value is not None:
+            get_metrics().inc("llm_single_flight_total", provider=provider, result="replica")
+            return [value]
+        if leased:
+            lease["held"] = True
+            # Cancel skips finalize, so the lease must not wait for it
+            stop.on_cancel(release)
+        try:
+            return guarded(run(stop), stop)
+        except BaseException:
+            release()
+            raise
+
+    def coalesced_finalize(response):
+        try:
+            return finalize(response)
+        finally:
+            release()
+
+    return coalesced_run, coalesced_finalize
+
+def submit_question(question, dataset, stats, history=None):
+    """Queue an LLM answer for this session; the result is picked up by render_active_job"""
+    job = start_answer_job(
+        st.session_state.session_key, st.session_state.ai_provider, question, dataset, stats, history,
+        hedge_setting=st.session_state.hedge_delay, stream=st.session_state.stream_responses
+    )
+    st.session_state.active_job = job.id
+    st.session_state.active_job_since = time.perf_counter()
+
+@st.fragment(run_every=LLM_JOB_POLL_INTERVAL)
+def render_active_job():
+    """Polls this session's job; only this fragment reruns while the answer is on its way"""
+    jobs = get_llm_jobs()
+    job = jobs.get(st.session_state.active_job)
+    if job is None:
+        st.session_state.active_job = None
+        st.rerun()
+    since = st.session_state.active_job_since
+    if not job.done and time.perf_counter() - since > LLM_JOB_TIMEOUT:
+        jobs.cancel(job.id)
+        st.session_state.active_job = None
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": "Error: The answer is taking too long. Please try asking again."
+        })
+        st.rerun()
+    if not job.done:
+        if job.status == "queued":
+            ahead = jobs.position(job)
+            content_html = f"Waiting for a free slot ({ahead} ahead)..." if ahead else "Analyzing..."
+        else:
+            content_html = format_response_html(clean_partial_response(job.partial)) or "Analyzing..."
+        st.markdown(f'<div class="assistant-message-box">{content_html}</div>', unsafe_allow_html=True)
+        if st.button("■ Stop", key="stop_job"):
+            # Other sessions may be waiting on the same job, so leave rather than wait for it to stop
+            jobs.cancel(job.id)
+            st.session_state.active_job = None
+            st.rerun()
+        return
+    st.session_state.active_job = None
+    if job.status != "cancelled":
+        record_response_timing(job.timing(since))
+        st.session_state.messages.append({"role": "assistant", "content": job.response})
+    st.rerun()
 
 # =============================================================================
 # HELPER FUNCTIONS
 # =============================================================================
 
+JSON_BLOCK_PATTERN = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+FOLLOWUP_SECTION_PATTERN = re.compile(r'Follow-up questions:.*', re.DOTALL | re.IGNORECASE)
+FOLLOWUP_PREFIX_PATTERN = re.compile(r'^[\d\.\)\-\*\•]+\s*')
+OPEN_FENCE_PATTERN = re.compile(r'```.*$', re.DOTALL)
+BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*')
+BOLD_ALT_PATTERN = re.compile(r'__(.+?)__')
+ITALIC_PATTERN = re.compile(r'\*(.+?)\*')
+ITALIC_ALT_PATTERN = re.compile(r'_(.+?)_')
+CODE_PATTERN = re.compile(r'`(.+?)`')
+STRAY_ASTERISK_PATTERN = re.compile(r'(?<!\w)\*(?!\w)')
+STRAY_UNDERSCORE_PATTERN = re.compile(r'(?<!\w)_(?!\w)')
+# Follow-ups that ask the user for preferences instead of exploring the data
+BAD_FOLLOWUP_PATTERNS = ('would you', 'do you', 'are there any', 'what would you', 'is there', 'can you tell me', 'would you like')
+
 def parse_chart_from_response(response):
-    match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
+    match = JSON_BLOCK_PATTERN.search(response)
     if match:
         try:
             return json.loads(match.group(1))
@@ -376,6 +4134,160 @@ def parse_chart_from_response(response):
             pass
     return None
 
+RESPONSE_TOKEN_PATTERN = re.compile(
+    r'```json\s*(?P<chart>.*?)\s*```'
+    r'|\[DASHBOARD:(?P<dashboard>[^\n]*?)\]'
+    r'|(?P<followups>(?i:Follow-up questions:))',
+    re.DOTALL
+)
+FOLLOWUP_TRIGGER_PATTERN = re.compile(r'follow[- ]up', re.IGNORECASE)
+
+class ParsedResponse:
+    """One LLM reply split into display body, chart spec, dashboard embeds and follow-ups"""
+    __slots__ = ("body", "blocks", "chart", "dashboards", "followups")
+
+    def __init__(self, body, chart, dashboards, followups):
+        self.body = body
+        self.blocks = tuple(block.strip() for block in body.split('\n\n') if block.strip())
+        self.chart = chart
+        self.dashboards = dashboards
+        self.followups = followups
+
+def parse_response(response):
+    """Single scan over the reply. Matches what clean_response_for_display,
+    parse_chart_from_response, extract_followup_questions and the [DASHBOARD:...]
+    handling produce separately (see tests/test_response_parser.py)."""
+    body_parts = []
+    chart = None
+    chart_seen = False
+    dashboards = []
+    position = 0
+    in_body = True
+    for match in RESPONSE_TOKEN_PATTERN.finditer(response):
+        if in_body:
+            body_parts.append(response[position:match.start()])
+        position = match.end()
+        kind = match.lastgroup
+        if kind == "chart":
+            # A stray tag swallowed by an unterminated block still counts as an embed
+            if "[DASHBOARD:" in match.group(0):
+                dashboards.extend(re.findall(r'\[DASHBOARD:(.*?)\]', match.group(0)))
+            # Like parse_chart_from_response, only the first json block counts
+            if not chart_seen:
+                chart_seen = True
+                try:
+                    chart = json.loads(match.group("chart"))
+                except ValueError:
+                    chart = None
+        elif kind == "dashboard":
+            dashboards.append(match.group("dashboard"))
+        else:
+            in_body = False
+    if in_body:
+        body_parts.append(response[position:])
+    return ParsedResponse("".join(body_parts).strip(), chart, tuple(dashboards), parse_followups(response))
+
+def parse_followups(response):
+    trigger = FOLLOWUP_TRIGGER_PATTERN.search(response)
+    if trigger is None:
+        return ()
+    line_end = response.find('\n', trigger.end())
+    if line_end == -1:
+        return ()
+    questions = []
+    for line in response[line_end + 1:].split('\n'):
+        line = line.strip()
+        if FOLLOWUP_TRIGGER_PATTERN.search(line):
+            continue
+        clean = FOLLOWUP_PREFIX_PATTERN.sub('', line).strip()
+        if len(clean) > 10 and '?' in clean:
+            lowered = clean.lower()
+            if not any(pattern in lowered for pattern in BAD_FOLLOWUP_PATTERNS):
+                questions.append(clean)
+                if len(questions) == 3:
+                    break
+    return tuple(questions)
+
+CHART_MAX_LINE_POINTS = 1000
+CHART_MAX_BAR_CATEGORIES = 25
+CHART_MAX_PIE_SLICES = 12
+CHART_WEBGL_THRESHOLD = 500
+CHART_MARKER_LIMIT = 100
+
+@st.cache_resource
+def get_chart_settings():
+    # Process-wide like the other admin knobs; 0 turns a reduction off
+    return {
+        "max_line_points": int(get_secret("CHART_MAX_LINE_POINTS", CHART_MAX_LINE_POINTS)),
+        "max_bar_categories": int(get_secret("CHART_MAX_BAR_CATEGORIES", CHART_MAX_BAR_CATEGORIES)),
+        "max_pie_slices": int(get_secret("CHART_MAX_PIE_SLICES", CHART_MAX_PIE_SLICES)),
+        "webgl_threshold": int(get_secret("CHART_WEBGL_THRESHOLD", CHART_WEBGL_THRESHOLD))
+    }
+
+def chart_axis_positions(labels):
+    """Numeric x positions for LTTB: the labels themselves when they are numbers
+    or dates, otherwise their order"""
+    series = pd.Series(labels)
+    if isinstance(labels[0], (int, float, np.number)):
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.notna().all():
+            return numeric.to_numpy(dtype=np.float64)
+    elif isinstance(labels[0], str):
+        # Format inferred from the first label and applied to all of them
+        dates = pd.to_datetime(series, errors="coerce")
+        if dates.notna().all():
+            return dates.to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(np.float64)
+    return np.arange(len(labels), dtype=np.float64)
+
+def lttb_indices(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: positions of `threshold` points that keep
+    the visual shape of the line (first and last point always kept)"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.nan_to_num(y)
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+    # Bucket means for every bucket at once; the last "bucket" is the final point
+    sizes = np.diff(np.append(edges, n))
+    avg_x = np.add.reduceat(x, edges) / sizes
+    avg_y = np.add.reduceat(y, edges) / sizes
+    chosen = np.empty(threshold, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a]))
+        a = start + int(area.argmax())
+        chosen[i + 1] = a
+    return chosen
+
+def top_n_with_other(labels, values, limit):
+    """The limit - 1 largest entries in their original order, plus one "Other" total"""
+    order = np.argsort(-np.nan_to_num(values, nan=-np.inf), kind="stable")
+    keep = np.sort(order[:limit - 1])
+    other = np.nansum(values) - np.nansum(values[keep])
+    return [labels[i] for i in keep] + [f"Other ({len(labels) - len(keep)})"], values[keep].tolist() + [float(other)]
+
+def reduce_chart_data(chart_type, labels, values):
+    """(labels, values, use WebGL) cut down to what the browser needs to draw"""
+    settings = get_chart_settings()
+    limit = {
+        "line": settings["max_line_points"],
+        "pie": settings["max_pie_slices"]
+    }.get(chart_type, settings["max_bar_categories"])
+    if limit and len(labels) > limit:
+        labels = list(labels[:len(values)])
+        numbers = pd.to_numeric(pd.Series(values[:len(labels)]), errors="coerce").to_numpy(dtype=np.float64)
+        if chart_type == "line":
+            chosen = lttb_indices(chart_axis_positions(labels), numbers, limit)
+            labels, values = [labels[i] for i in chosen], numbers[chosen].tolist()
+        else:
+            labels, values = top_n_with_other(labels, numbers, limit)
+    webgl = chart_type == "line" and 0 < settings["webgl_threshold"] < len(labels)
+    return labels, values, webgl
+
 def create_chart(chart_data):
     labels = chart_data.get("data", {}).get("labels", [])
     values = chart_data.get("data", {}).get("values", [])
@@ -384,18 +4296,27 @@ def create_chart(chart_data):
     
     chart_type = chart_data.get("chart_type", "bar")
     title = chart_data.get("title", "Chart")
+    labels, values, webgl = reduce_chart_data(chart_type, labels, values)
+    # Imported on first use: plotly.express is the slowest import in the app and
+    # most sessions never draw a chart
+    import plotly.express as px
     
     if chart_type == "bar":
         fig = px.bar(x=labels, y=values, title=title)
     elif chart_type == "line":
-        fig = px.line(x=labels, y=values, title=title, markers=True)
+        fig = px.line(
+            x=labels, y=values, title=title, markers=len(labels) <= CHART_MARKER_LIMIT,
+            render_mode="webgl" if webgl else "auto"
+        )
     elif chart_type == "pie":
         fig = px.pie(names=labels, values=values, title=title)
     else:
         fig = px.bar(x=labels, y=values, title=title)
     
     fig.update_layout(font_family="DM Sans", paper_bgcolor="white", plot_bgcolor="white")
-    fig.update_traces(marker_color="#6366f1")
+    if chart_type != "pie":
+        # Pie markers take a per-slice `colors` list and reject marker_color
+        fig.update_traces(marker_color="#6366f1")
     return fig
 
 def extract_followup_questions(response):
@@ -408,45 +4329,49 @@ def extract_followup_questions(response):
             in_followup = True
             continue
         if in_followup:
-            clean = re.sub(r'^[\d\.\)\-\*\•]+\s*', '', line).strip()
+            clean = FOLLOWUP_PREFIX_PATTERN.sub('', line).strip()
             if len(clean) > 10 and '?' in clean:
                 # Filter out questions that ask the user for preferences
-                bad_patterns = ['would you', 'do you', 'are there any', 'what would you', 'is there', 'can you tell me', 'would you like']
-                is_bad = any(pattern in clean.lower() for pattern in bad_patterns)
+                is_bad = any(pattern in clean.lower() for pattern in BAD_FOLLOWUP_PATTERNS)
                 if not is_bad:
                     questions.append(clean)
     return questions[:3]
 
 def clean_response_for_display(response):
     # Remove JSON code blocks
-    cleaned = re.sub(r'```json\s*.*?\s*```', '', response, flags=re.DOTALL)
+    cleaned = JSON_BLOCK_PATTERN.sub('', response)
     # Remove follow-up section
-    cleaned = re.sub(r'Follow-up questions:.*', '', cleaned, flags=re.DOTALL | re.IGNORECASE)
+    cleaned = FOLLOWUP_SECTION_PATTERN.sub('', cleaned)
     return cleaned.strip()
 
+def clean_partial_response(response):
+    """Like clean_response_for_display, but also hides a ```json or ```query block that is still streaming in"""
+    cleaned = clean_response_for_display(QUERY_BLOCK_PATTERN.sub('', response))
+    return OPEN_FENCE_PATTERN.sub('', cleaned).strip()
+
 def format_response_html(content):
     """Convert plain text response to HTML with proper line breaks and formatting"""
     # Escape any HTML characters first
     content = content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
     
     # Convert **text** to <strong>text</strong> (bold)
-    content = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', content)
+    content = BOLD_PATTERN.sub(r'<strong>\1</strong>', content)
     
     # Convert __text__ to <strong>text</strong> (bold alternative)
-    content = re.sub(r'__(.+?)__', r'<strong>\1</strong>', content)
+    content = BOLD_ALT_PATTERN.sub(r'<strong>\1</strong>', content)
     
     # Convert *text* to <em>text</em> (italic)
-    content = re.sub(r'\*(.+?)\*', r'<em>\1</em>', content)
+    content = ITALIC_PATTERN.sub(r'<em>\1</em>', content)
     
     # Convert _text_ to <em>text</em> (italic alternative)
-    content = re.sub(r'_(.+?)_', r'<em>\1</em>', content)
+    content = ITALIC_ALT_PATTERN.sub(r'<em>\1</em>', content)
     
     # Convert `code` to styled code
-    content = re.sub(r'`(.+?)`', r'<code style="background:#f1f5f9;padding:2px 6px;border-radius:4px;">\1</code>', content)
+    content = CODE_PATTERN.sub(r'<code style="background:#f1f5f9;padding:2px 6px;border-radius:4px;">\1</code>', content)
     
     # Remove any remaining stray asterisks or underscores used for formatting
-    content = re.sub(r'(?<!\w)\*(?!\w)', '', content)  # Remove standalone *
-    content = re.sub(r'(?<!\w)_(?!\w)', '', content)   # Remove standalone _
+    content = STRAY_ASTERISK_PATTERN.sub('', content)  # Remove standalone *
+    content = STRAY_UNDERSCORE_PATTERN.sub('', content)   # Remove standalone _
     
     # Convert newlines to <br> tags
     lines = content.split('\n')
@@ -463,15 +4388,15 @@ def format_response_html(content):
 def format_plain_text(text):
     """Clean text of any markdown formatting - for Key Facts etc."""
     # Remove **bold**
-    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
+    text = BOLD_PATTERN.sub(r'\1', text)
     # Remove __bold__
-    text = re.sub(r'__(.+?)__', r'\1', text)
+    text = BOLD_ALT_PATTERN.sub(r'\1', text)
     # Remove *italic*
-    text = re.sub(r'\*(.+?)\*', r'\1', text)
+    text = ITALIC_PATTERN.sub(r'\1', text)
     # Remove _italic_
-    text = re.sub(r'_(.+?)_', r'\1', text)
+    text = ITALIC_ALT_PATTERN.sub(r'\1', text)
     # Remove `code`
-    text = re.sub(r'`(.+?)`', r'\1', text)
+    text = CODE_PATTERN.sub(r'\1', text)
     # Remove any stray formatting characters
     text = text.replace('*', '').replace('_', '').replace('`', '')
     return text
@@ -510,6 +4435,31 @@ def parse_summary_to_facts(summary):
             facts.append(s)
     return facts[:5]
 
+def render_assistant_message(content):
+    """Everything the chat loop needs to display one reply, computed once per message"""
+    parsed = parse_response(content)
+    chart_data = parsed.chart
+    return {
+        "html": format_response_html(parsed.body),
+        "dashboard_url": parsed.dashboards[0] if parsed.dashboards else None,
+        "chart": chart_data,
+        # Kept as a Figure: st.plotly_chart serialises it without re-validating, and
+        # plotly express is the slowest step of the whole render
+        "figure": create_chart(chart_data) if chart_data else None,
+        "followups": list(parsed.followups)
+    }
+
+def get_rendered_message(msg):
+    rendered = msg.get("rendered")
+    if rendered is None:
+        rendered = msg["rendered"] = render_assistant_message(msg["content"])
+    return rendered
+
+def record_response_timing(timing, limit=50):
+    timings = st.session_state.response_timings
+    timings.append({"provider": st.session_state.ai_provider, **timing})
+    del timings[:-limit]
+
 def get_initial_suggestions(dataset_id):
     if dataset_id == "sg_flat":
         return [
@@ -531,6 +4481,61 @@ def get_initial_suggestions(dataset_id):
 # ADMIN PAGE
 # =============================================================================
 
+def format_ms(value):
+    return "–" if value is None else f"{value:,.0f}"
+
+def render_telemetry_panel():
+    st.markdown("### Telemetry")
+    metrics = get_metrics()
+    
+    rows = []
+    for name in PROVIDERS:
+        requests_total = metrics.total("llm_requests_total", provider=name)
+        if not requests_total:
+            continue
+        errors = requests_total - metrics.total("llm_requests_total", provider=name, status=200)
+        p50, p95, p99 = metrics.quantiles("llm_request_latency_ms", provider=name)
+        ttft50, ttft95, _ = metrics.quantiles("llm_time_to_first_token_ms", provider=name)
+        rows.append({
+            "provider": name,
+            "requests": requests_total,
+            "error rate": f"{errors / requests_total:.1%}",
+            "p50 ms": format_ms(p50),
+            "p95 ms": format_ms(p95),
+            "p99 ms": format_ms(p99),
+            "TTFT p50/p95 ms": f"{format_ms(ttft50)} / {format_ms(ttft95)}",
+            "tokens in/out": f"{metrics.total('llm_tokens_total', provider=name, type='prompt'):,} / "
+                             f"{metrics.total('llm_tokens_total', provider=name, type='completion'):,}"
+        })
+    if rows:
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        codes = {
+            f"{labels['provider']} {labels['status']}": value
+            for labels, value in ((dict(series), value) for series, value in metrics.counter_values("llm_requests_total").items())
+            if labels["status"] != "200"
+        }
+        if codes:
+            st.caption("Errors by code: " + " • ".join(f"{code}: {count}" for code, count in sorted(codes.items())))
+    else:
+        st.caption("No provider calls recorded yet.")
+    
+    other = []
+    for labels in metrics.histogram_labels("sheet_fetch_latency_ms"):
+        p50, p95, p99 = metrics.quantiles("sheet_fetch_latency_ms", **labels)
+        other.append({"timer": f"sheet fetch: {labels['tab']}", "p50 ms": format_ms(p50), "p95 ms": format_ms(p95), "p99 ms": format_ms(p99)})
+    for labels in metrics.histogram_labels("render_latency_ms"):
+        p50, p95, p99 = metrics.quantiles("render_latency_ms", **labels)
+        other.append({"timer": f"render: {labels['page']}", "p50 ms": format_ms(p50), "p95 ms": format_ms(p95), "p99 ms": format_ms(p99)})
+    if other:
+        st.dataframe(pd.DataFrame(other), hide_index=True, use_container_width=True)
+    
+    st.download_button(
+        "⬇️ Export metrics (Prometheus)",
+        metrics.to_prometheus(),
+        file_name="metrics.prom",
+        mime="text/plain"
+    )
+
 def render_admin_page():
     st.markdown("## ⚙️ Admin Settings")
     
@@ -573,6 +4578,219 @@ def render_admin_page():
             st.session_state.ai_provider = "deepseek"
             st.rerun()
     
+    st.markdown("---")
+    st.markdown("### Hedged Requests")
+    st.caption("If the active provider has not started answering after the delay, ask the other one too and keep whichever answers first.")
+    hedge_options = list(HEDGE_DELAY_OPTIONS)
+    st.session_state.hedge_delay = st.selectbox(
+        "Hedge delay",
+        hedge_options,
+        index=hedge_options.index(st.session_state.hedge_delay)
+    )
+    metrics = get_metrics()
+    races = metrics.total("hedge_races_total")
+    if races:
+        wins = {dict(labels)["provider"]: value for labels, value in metrics.counter_values("hedge_wins_total").items()}
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Requests", races)
+        col2.metric("Hedged", metrics.total("hedge_races_total", hedged=True))
+        col3.metric("Win rate", " • ".join(f"{name} {value / races:.0%}" for name, value in wins.items()))
+    
+    st.markdown("---")
+    st.markdown("### Response Delivery")
+    st.session_state.stream_responses = st.toggle(
+        "Stream tokens as they arrive",
+        value=st.session_state.stream_responses
+    )
+    
+    timings = st.session_state.response_timings
+    if timings:
+        ttft = sorted(t["ttft_ms"] for t in timings)
+        total = sorted(t["total_ms"] for t in timings)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Time to first token (median)", f"{ttft[len(ttft) // 2]:,.0f} ms")
+        col2.metric("Total latency (median)", f"{total[len(total) // 2]:,.0f} ms")
+        col3.metric("Answers measured", len(timings))
+    
+    st.markdown("---")
+    st.markdown("### Request Queue")
+    st.caption("Answers are generated by a shared worker pool, taking turns between sessions.")
+    jobs = get_llm_jobs()
+    cols = st.columns(len(PROVIDERS))
+    for col, name in zip(cols, PROVIDERS):
+        col.metric(f"{name.title()} running / waiting", f"{jobs.running[name]} / {jobs.depth(name)}")
+    waits = [t["queue_ms"] for t in timings if "queue_ms" in t]
+    if waits:
+        waits.sort()
+        st.caption(f"Median queue wait: {waits[len(waits) // 2]:,.0f} ms over {len(waits)} answers")
+    leaders = metrics.total("llm_single_flight_total", result="leader")
+    joined = metrics.total("llm_single_flight_total", result="joined")
+    if joined:
+        st.caption(f"Identical questions in flight: {joined:,} joined an existing call ({leaders:,} upstream calls)")
+    
+    st.markdown("---")
+    st.markdown("### Rate Limits")
+    st.caption("Requests wait for the provider's per-minute budget, and are turned away with a retry hint when the wait would be too long.")
+    for name in PROVIDERS:
+        config = get_provider_config(name)
+        limits = " • ".join(
+            f"{config[limit]:,.0f} {label}/min"
+            for limit, label in (("requests_per_minute", "requests"), ("tokens_per_minute", "tokens"))
+            if config[limit]
+        ) or "no client-side limit"
+        wait_p50, wait_p95 = metrics.quantiles("rate_limit_wait_ms", (0.5, 0.95), provider=name)
+        waits = f" • wait p50 {wait_p50:,.0f} ms / p95 {wait_p95:,.0f} ms" if wait_p50 is not None else ""
+        st.caption(
+            f"{name.title()}: {limits}{waits} • shed {metrics.total('rate_limit_shed_total', provider=name):,} "
+            f"• 429s {metrics.total('rate_limit_429_total', provider=name):,}"
+        )
+    
+    st.markdown("---")
+    st.markdown("### Stats Retrieval")
+    retrieval = get_retrieval_settings()
+    retrieval["enabled"] = st.toggle(
+        "Only send the stats relevant to each question",
+        value=retrieval["enabled"]
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        retrieval["top_k"] = st.number_input("Top-k stats", min_value=1, max_value=500, value=retrieval["top_k"])
+    with col2:
+        retrieval["token_budget"] = st.number_input(
+            "Stats token budget", min_value=100, max_value=20000, step=100, value=retrieval["token_budget"]
+        )
+    
+    st.markdown("---")
+    st.markdown("### Conversation Memory")
+    memory = get_memory_settings()
+    memory["enabled"] = st.toggle(
+        "Send earlier turns with follow-up questions",
+        value=memory["enabled"],
+        help="Recent turns verbatim, older ones as a rolling summary. Follow-up answers skip the response cache."
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        memory["turn_budget"] = st.number_input(
+            "Recent turns token budget", min_value=0, max_value=20000, step=100, value=memory["turn_budget"]
+        )
+    with col2:
+        memory["summary_budget"] = st.number_input(
+            "Summary token budget", min_value=50, max_value=5000, step=50, value=memory["summary_budget"]
+        )
+    p50, p95 = get_metrics().quantiles("conversation_context_tokens", (0.5, 0.95))
+    if p50 is not None:
+        st.caption(f"Context sent with follow-ups: p50 {p50:,.0f} tokens • p95 {p95:,.0f} tokens")
+    
+    st.markdown("---")
+    st.markdown("### Query Mode")
+    query_settings = get_query_settings()
+    query_settings["enabled"] = st.toggle(
+        "Answer with queries computed over the full dataset tables",
+        value=query_settings["enabled"],
+        help="The model writes a query block; the app runs it locally and inserts the results and chart"
+    )
+    query_settings["engine"] = st.selectbox(
+        "Query engine", QUERY_ENGINES, index=QUERY_ENGINES.index(query_settings["engine"]),
+        help="auto uses the numpy kernel; duckdb needs the duckdb package"
+    )
+    st.caption(f"Running on: {query_engine_name()} • tables in {get_secret('DATA_DIR', DATA_DIR)}/<dataset_id>.parquet")
+    runs = get_metrics().total("query_runs_total")
+    if runs:
+        p50, p95 = get_metrics().quantiles("query_latency_ms", (0.5, 0.95), engine=query_engine_name())
+        st.caption(f"Queries run: {runs} • latency p50 {format_ms(p50)} ms • p95 {format_ms(p95)} ms")
+
+    st.markdown("---")
+    st.markdown("### Aggregate Cubes")
+    cube_settings = get_cube_settings()
+    cube_settings["enabled"] = st.toggle(
+        "Answer group-by chart questions from precomputed cubes",
+        value=cube_settings["enabled"],
+        help="Build or refresh cubes with `python build_cubes.py --all`"
+    )
+    for ds in get_datasets():
+        cube = get_dataset_cube(ds['dataset_id'])
+        if cube is not None:
+            st.caption(
+                f"{ds['dataset_name']}: {cube.meta['rows']:,} rows • {len(cube.frame):,} cells • "
+                f"{len(cube.dimensions)} dimensions • built {cube.meta['built_at']}"
+            )
+    answered = get_metrics().total("cube_answers_total", outcome="answered")
+    if answered:
+        p50, p95 = get_metrics().quantiles("cube_answer_latency_ms", (0.5, 0.95))
+        st.caption(f"Answered from cubes: {answered} • latency p50 {format_ms(p50)} ms • p95 {format_ms(p95)} ms")
+
+    st.markdown("---")
+    st.markdown("### Intent Routing")
+    st.caption("Questions go to the dashboard embed, a cached answer or a cube aggregate before the model. "
+               "Datasets can add `intent_rules` and `intent_examples` columns (`route: text | route: text`).")
+    metrics = get_metrics()
+    routed = {route: metrics.total("intent_routes_total", route=route) for route in ("dashboard", "cached", "aggregate", "llm")}
+    if sum(routed.values()):
+        cols = st.columns(len(routed))
+        for col, (route, count) in zip(cols, routed.items()):
+            col.metric("LLM" if route == "llm" else route.title(), f"{count:,}")
+        avoided = sum(routed.values()) - routed["llm"]
+        reports = metrics.total("llm_usage_reports_total")
+        tokens = metrics.total("llm_tokens_total", type="prompt") + metrics.total("llm_tokens_total", type="completion")
+        tokens_per_call = tokens / reports if reports else 0
+        llm_p50 = metrics.quantiles("llm_request_latency_ms", (0.5,))[0]
+        classify_p50, classify_p99 = metrics.quantiles("intent_classify_ms", (0.5, 0.99))
+        saved = f"LLM calls avoided: {avoided:,} ({avoided / sum(routed.values()):.0%})"
+        if tokens_per_call:
+            saved += f" • ~{avoided * tokens_per_call:,.0f} tokens"
+        if llm_p50 is not None:
+            saved += f" • ~{avoided * llm_p50 / 1000:,.1f} s of model time"
+        st.caption(f"{saved} • classification p50 {classify_p50:.2f} ms / p99 {classify_p99:.2f} ms")
+
+    if metrics.total("llm_usage_reports_total"):
+        st.caption("Provider prefix cache (cached / prompt tokens, where the provider reports it):")
+        for name in PROVIDERS:
+            reports = metrics.total("llm_usage_reports_total", provider=name)
+            if not reports:
+                continue
+            prompt_tokens = metrics.total("llm_tokens_total", provider=name, type="prompt")
+            cached_tokens = metrics.total("llm_tokens_total", provider=name, type="cached_prompt")
+            share = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+            reported = metrics.total("llm_usage_reports_total", provider=name, cache_reported=True)
+            st.caption(f"{name}: {cached_tokens:,} / {prompt_tokens:,} ({share:.0%}) • {reported}/{reports} requests reported")
+    
+    st.markdown("---")
+    st.markdown("### Response Cache")
+    cache_stats = get_response_cache().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Hit ratio", f"{cache_stats['hit_ratio']:.0%}")
+    col2.metric("Hits / misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+    col3.metric("Bytes saved", f"{cache_stats['bytes_saved']:,}")
+    col4.metric("Stored", f"{cache_stats['entries']} ({cache_stats['bytes']:,} B)")
+    if cache_stats["near_hits"]:
+        st.caption(f"{cache_stats['near_hits']} hits matched a near-duplicate question")
+    tier = "L1 (this process) + L2 (shared)" if get_response_cache().backend.l2 is not None else "L1 only (this process)"
+    st.caption(
+        f"Tiers: {tier} • L1 hits {cache_stats['l1_hits']:,} • L2 hits {cache_stats['l2_hits']:,} "
+        f"• L1 entries {cache_stats['l1_entries']:,}"
+    )
+    warmer = get_suggestion_warmer()
+    st.caption(f"Starter answers warmed: {warmer.completed} • pending: {warmer.pending} • failed: {warmer.failed}")
+    if st.button("🗑️ Clear cache"):
+        get_response_cache().clear()
+        st.rerun()
+    
+    sheet_id = get_secret("GOOGLE_SHEET_ID")
+    if sheet_id:
+        st.markdown("---")
+        st.markdown("### Sheet Sync")
+        sync = get_sheet_sync(sheet_id)
+        sync_status = sync.status()
+        if sync_status:
+            st.dataframe(pd.DataFrame(sync_status), hide_index=True, use_container_width=True)
+        if st.button("🔄 Refresh sheets"):
+            for row in sync_status:
+                sync.refresh_in_background(row["tab"], force=True)
+            st.toast("Refresh started in the background")
+    
+    st.markdown("---")
+    render_telemetry_panel()
+    
     st.markdown("---")
     if st.button("🔌 Test Connection"):
         with st.spinner("Testing..."):
@@ -607,6 +4825,7 @@ def render_main_app():
                         st.session_state.selected_dataset = ds['dataset_id']
                         st.session_state.dataset_summary = ds['summary']
                         st.session_state.messages = []
+                        st.session_state.conversation_memory = None
                         st.rerun()
         
         # Admin link at bottom - ONLY place admin button exists
@@ -627,50 +4846,38 @@ def render_main_app():
             return
         
         stats = get_stats(st.session_state.selected_dataset)
-        key_stats = extract_key_stats(current_ds['summary'])
-        facts = parse_summary_to_facts(current_ds['summary'])
+        highlights = get_highlights(st.session_state.selected_dataset)
         
         col_main, col_sidebar = st.columns([2, 1])
         
         # RIGHT SIDEBAR
         with col_sidebar:
             if st.button("← Back to datasets"):
+                if st.session_state.active_job:
+                    get_llm_jobs().cancel(st.session_state.active_job)
+                    st.session_state.active_job = None
                 st.session_state.selected_dataset = None
                 st.session_state.messages = []
+                st.session_state.conversation_memory = None
                 st.rerun()
             
             st.markdown("---")
             st.markdown(f"### 📊 {current_ds['dataset_name']}")
             
-            # Stat boxes with fallback values
-            total_val = key_stats.get('total', '287,200')
-            total_label = key_stats.get('total_label', 'Transactions')
-            avg_val = key_stats.get('avg_price', '$219,542')
-            max_val = key_stats.get('max_price', '$900,000')
-            
-            st.markdown(f"""
-            <div class="stat-box">
-                <div class="stat-box-icon">📊</div>
-                <div class="stat-box-value">{total_val}</div>
-                <div class="stat-box-label">{total_label}</div>
-            </div>
-            <div class="stat-box">
-                <div class="stat-box-icon">💰</div>
-                <div class="stat-box-value">{avg_val}</div>
-                <div class="stat-box-label">Average Price</div>
-            </div>
+            # Stat boxes, precomputed with the dataset index
+            if highlights.tiles:
+                st.markdown("".join(f"""
             <div class="stat-box">
-                <div class="stat-box-icon">📈</div>
-                <div class="stat-box-value">{max_val}</div>
-                <div class="stat-box-label">Maximum Price</div>
-            </div>
-            """, unsafe_allow_html=True)
+                <div class="stat-box-icon">{icon}</div>
+                <div class="stat-box-value">{value}</div>
+                <div class="stat-box-label">{label}</div>
+            </div>""" for icon, value, label in highlights.tiles), unsafe_allow_html=True)
             
             st.markdown("---")
             st.markdown("**Key Facts:**")
             
             # Display facts as plain HTML - no markdown processing
-            for fact in facts:
+            for fact in highlights.facts:
                 st.markdown(f'<p class="key-fact-item">• {fact}.</p>', unsafe_allow_html=True)
         
         # MAIN CHAT AREA
@@ -695,48 +4902,30 @@ def render_main_app():
                 if msg["role"] == "user":
                     st.markdown(f'<div class="user-message">{msg["content"]}</div>', unsafe_allow_html=True)
                 else:
-                    content = msg["content"]
+                    rendered = get_rendered_message(msg)
+                    st.markdown(f'<div class="assistant-message-box">{rendered["html"]}</div>', unsafe_allow_html=True)
                     
-                    # Check for dashboard embed
-                    dashboard_match = re.search(r'\[DASHBOARD:(.*?)\]', content)
-                    
-                    if dashboard_match:
-                        embed_url = dashboard_match.group(1)
-                        # Remove the dashboard tag from content
-                        content_clean = re.sub(r'\[DASHBOARD:.*?\]', '', content)
-                        content_clean = clean_response_for_display(content_clean)
-                        content_html = format_response_html(content_clean)
-                        
-                        # Show text message
-                        st.markdown(f'<div class="assistant-message-box">{content_html}</div>', unsafe_allow_html=True)
-                        
-                        # Render Power BI iframe
+                    # Render Power BI iframe
+                    if rendered["dashboard_url"]:
                         st.markdown(f"""
                         <iframe 
                             title="Power BI Dashboard" 
                             width="100%" 
                             height="500" 
-                            src="{embed_url}" 
+                            src="{rendered["dashboard_url"]}" 
                             frameborder="0" 
                             allowFullScreen="true"
                             style="border: 1px solid #e2e8f0; border-radius: 12px; margin: 1rem 0;">
                         </iframe>
                         """, unsafe_allow_html=True)
-                    else:
-                        content_clean = clean_response_for_display(content)
-                        content_html = format_response_html(content_clean)
-                        st.markdown(f'<div class="assistant-message-box">{content_html}</div>', unsafe_allow_html=True)
                     
                     # Chart if present
-                    chart_data = parse_chart_from_response(msg["content"])
-                    if chart_data:
-                        fig = create_chart(chart_data)
-                        if fig:
-                            st.plotly_chart(fig, use_container_width=True)
+                    if rendered["figure"]:
+                        st.plotly_chart(rendered["figure"], use_container_width=True)
                     
                     # Follow-up questions (only for last message)
                     if idx == len(st.session_state.messages) - 1:
-                        followups = extract_followup_questions(msg["content"])
+                        followups = rendered["followups"]
                         if followups:
                             st.write("**Suggested follow-up questions:**")
                             for i, q in enumerate(followups):
@@ -744,6 +4933,9 @@ def render_main_app():
                                     st.session_state.pending_question = q
                                     st.rerun()
             
+            if st.session_state.active_job:
+                render_active_job()
+            
             # Input area
             st.markdown("---")
             st.write("**Ask your own question:**")
@@ -757,23 +4949,20 @@ def render_main_app():
                         st.session_state.pending_question = user_input.strip()
                         st.rerun()
         
-        # Process pending question
-        if st.session_state.pending_question:
+        # Process pending question (a question asked mid-answer waits for the current job)
+        if st.session_state.pending_question and not st.session_state.active_job:
             q = st.session_state.pending_question
             st.session_state.pending_question = None
             st.session_state.messages.append({"role": "user", "content": q})
             
-            # Check for dashboard request
-            if any(kw in q.lower() for kw in ["dashboard", "power bi"]):
-                dashboards = get_dashboards(st.session_state.selected_dataset)
-                if dashboards and dashboards[0].get('embed_url', '').startswith('http'):
-                    url = dashboards[0]['embed_url']
-                    response = f"Here's the dashboard:\n\n[DASHBOARD:{url}]\n\nFollow-up questions:\n1. What trends do you notice in the visualization?\n2. Which category shows the highest values?\n3. How do the numbers compare across segments?"
-                else:
-                    response = "Dashboard not configured yet.\n\nFollow-up questions:\n1. What specific data would you like to explore?\n2. Should I create a chart for you?\n3. Which metrics are most important?"
-            else:
-                with st.spinner("Analyzing..."):
-                    response = get_ai_response(q, current_ds['dataset_name'], stats)
+            # Dashboard embeds, cached answers and cube aggregates skip the model
+            route, response, history = route_question(
+                q, st.session_state.selected_dataset, stats, st.session_state.ai_provider,
+                context=get_conversation_context
+            )
+            if response is None:
+                submit_question(q, current_ds, stats, history)
+                st.rerun()
             
             st.session_state.messages.append({"role": "assistant", "content": response})
             st.rerun()
@@ -793,10 +4982,20 @@ def render_main_app():
 # =============================================================================
 
 def main():
-    if st.session_state.page == "admin":
-        render_admin_page()
-    else:
-        render_main_app()
+    st.set_page_config(**PAGE_CONFIG)
+    init_session_state()
+    inject_css()
+    start_metrics_exporters()
+    # Any page view starts the warm-up, for every configured provider
+    warm_initial_suggestions(get_datasets())
+    start = time.perf_counter()
+    try:
+        if st.session_state.page == "admin":
+            render_admin_page()
+        else:
+            render_main_app()
+    finally:
+        get_metrics().observe("render_latency_ms", elapsed_ms(start), page=st.session_state.page)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,205 @@
+"""Answer a JSONL file of questions without the Streamlit UI.
+
+Each input line is {"question": ..., "dataset_id": ...} with optional "id" and
+"dataset_name". Questions run through the same get_ai_response path as the app
+(prompt prefix, stats retrieval, query mode, rate limiting), with bounded
+concurrency. Results are appended to a JSONL journal as they finish, so an
+interrupted run picks up where it stopped; questions that failed are retried:
+
+    python batch_questions.py questions.jsonl --output results.jsonl --concurrency 4
+    python batch_questions.py questions.jsonl --output results.parquet --fill-cache
+    python batch_questions.py questions.jsonl --output results.jsonl --mock   # local mock provider
+
+Configuration (API keys, GOOGLE_SHEET_ID, RESPONSE_CACHE_BACKEND, ...) is read
+from the environment, like the benchmarks.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+# Running outside `streamlit run`: the bare-mode warnings are expected here
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import app  # noqa: E402
+
+
+def question_id(record):
+    if record.get("id") is not None:
+        return str(record["id"])
+    key = f"{record.get('dataset_id', '')}\n{app.normalize_question(record['question'])}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def read_questions(path, default_dataset=None):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not record.get("question"):
+                raise ValueError(f"{path}:{line_number}: missing \"question\"")
+            record.setdefault("dataset_id", default_dataset)
+            record["id"] = question_id(record)
+            records.append(record)
+    return records
+
+
+def journal_path(output):
+    # JSONL output is its own journal; Parquet is written from one at the end
+    return output if output.endswith(".jsonl") else f"{output}.partial.jsonl"
+
+
+def read_journal(path):
+    """{id: result} for rows already written, the last row winning"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            done[row["id"]] = row
+    return done
+
+
+def resolve_dataset(record):
+    """(dataset_name, stats) for a record, from the Datasets/Stats sheet when configured"""
+    dataset_id = record["dataset_id"]
+    dataset = next((d for d in app.get_datasets() if d["dataset_id"] == dataset_id), None)
+    name = record.get("dataset_name") or (dataset["dataset_name"] if dataset else dataset_id)
+    return name, app.get_stats(dataset_id)
+
+
+def answer(record, provider, fill_cache):
+    dataset_name, stats = resolve_dataset(record)
+    started_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+    start = time.perf_counter()
+    response = app.get_ai_response(
+        record["question"], dataset_name, stats, provider=provider, dataset_id=record["dataset_id"]
+    )
+    latency_ms = round((time.perf_counter() - start) * 1000, 1)
+    error = response if response.startswith("Error") else None
+    chart = None if error else app.parse_chart_from_response(response)
+    if fill_cache and not error:
+        app.store_cached_response(provider, record["dataset_id"], stats, record["question"], response)
+    return {
+        "id": record["id"],
+        "dataset_id": record["dataset_id"],
+        "question": record["question"],
+        "provider": provider,
+        "response": response,
+        "error": error,
+        "chart_type": chart.get("chart_type") if chart else None,
+        "chart": json.dumps(chart) if chart else None,
+        "followups": [] if error else app.extract_followup_questions(response),
+        "prompt_stats": len(app.select_prompt_stats(record["question"], stats)),
+        "started_at": started_at,
+        "latency_ms": latency_ms
+    }
+
+
+def run(records, journal, provider, concurrency, fill_cache):
+    """Answer records, appending each result to the journal as it completes"""
+    results = []
+    if os.path.exists(journal) and os.path.getsize(journal):
+        with open(journal, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+    else:
+        torn = False
+    with open(journal, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if torn:
+            out.write("\n")  # end the line an interruption cut short
+        futures = {pool.submit(answer, record, provider, fill_cache): record for record in records}
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                record = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"id": record["id"], "dataset_id": record["dataset_id"], "question": record["question"],
+                              "provider": provider, "response": None, "error": f"Error: {e}"}
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                results.append(result)
+                status = "error" if result["error"] else f"{result.get('latency_ms', 0):,.0f} ms"
+                print(f"[{i}/{len(records)}] {status:>10}  {record['question'][:70]}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("Interrupted; rerun the same command to resume", file=sys.stderr)
+            raise
+    return results
+
+
+def write_parquet(journal, output):
+    import pandas as pd
+    rows = list(read_journal(journal).values())
+    pd.DataFrame(rows).to_parquet(output, index=False)
+
+
+def summarize(rows):
+    answered = [row for row in rows if not row.get("error")]
+    latencies = sorted(row["latency_ms"] for row in answered)
+    print(f"answered {len(answered)}/{len(rows)}", end="")
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        charts = sum(1 for row in answered if row.get("chart_type"))
+        print(f" • latency p50 {statistics.median(latencies):,.0f} ms • p95 {p95:,.0f} ms • charts {charts}", end="")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="JSONL file, one {\"question\", \"dataset_id\"} object per line")
+    parser.add_argument("--output", required=True, help="results .jsonl or .parquet")
+    parser.add_argument("--dataset", help="dataset_id for lines that do not name one")
+    parser.add_argument("--provider", choices=list(app.PROVIDERS), default="groq")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--fill-cache", action="store_true",
+                        help="store answers in the response cache (use a sqlite or redis RESPONSE_CACHE_BACKEND)")
+    parser.add_argument("--max-wait", type=float, default=300.0,
+                        help="seconds a question may wait for the provider rate limit before failing")
+    parser.add_argument("--mock", action="store_true", help="answer from an in-process mock provider")
+    args = parser.parse_args()
+
+    # Unlike a user, a batch would rather wait for the rate limit than be turned away
+    os.environ.setdefault("RATE_LIMIT_MAX_WAIT", str(args.max_wait))
+
+    if args.mock:
+        from mock_provider import start_mock_provider
+        server = start_mock_provider()
+        config = app.PROVIDERS[args.provider]
+        os.environ[f"{args.provider.upper()}_BASE_URL"] = server.base_url
+        os.environ.setdefault(config["api_key_secret"], "mock")
+        # The mock has no rate limit to respect
+        os.environ[f"{args.provider.upper()}_REQUESTS_PER_MINUTE"] = ""
+        os.environ[f"{args.provider.upper()}_TOKENS_PER_MINUTE"] = ""
+
+    records = read_questions(args.questions, args.dataset)
+    journal = journal_path(args.output)
+    done = {i for i, row in read_journal(journal).items() if not row.get("error")}
+    todo = list({record["id"]: record for record in records if record["id"] not in done}.values())
+    if done:
+        print(f"Resuming: {len(records) - len(todo)} of {len(records)} already answered", file=sys.stderr)
+
+    run(todo, journal, args.provider, args.concurrency, args.fill_cache)
+    ids = {record["id"] for record in records}
+    rows = [row for i, row in read_journal(journal).items() if i in ids]
+    if not args.output.endswith(".jsonl"):
+        write_parquet(journal, args.output)
+    summarize(rows)
+
+
+if __name__ == "__main__":
+    main()
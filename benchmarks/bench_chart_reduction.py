@@ -0,0 +1,70 @@
+"""Chart payload size and build time with and without point reduction.
+
+Feeds create_chart the kind of chart data query mode produces from full
+tables (a daily price line over decades, bars and pies over every category)
+and reports the figure JSON that st.plotly_chart ships to the browser, plus
+the server-side time to build and serialise it:
+
+    python benchmarks/bench_chart_reduction.py --repeats 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def chart_cases():
+    rng = np.random.default_rng(3)
+    days = pd.date_range("1990-01-01", "2024-12-31", freq="D")
+    daily = 200000 + rng.normal(0, 1500, len(days)).cumsum()
+    minutes = 100 + rng.normal(0, 0.2, 200_000).cumsum()
+    listings = [f"Listing {i}" for i in range(5000)]
+    suburbs = [f"Suburb {i}" for i in range(3000)]
+    return {
+        "line, 35y daily": ("line", days.strftime("%Y-%m-%d").tolist(), daily.round(0).tolist()),
+        "line, 200k points": ("line", list(range(len(minutes))), minutes.round(2).tolist()),
+        "bar, 5k categories": ("bar", listings, rng.integers(50, 900, len(listings)).tolist()),
+        "pie, 3k slices": ("pie", suburbs, rng.pareto(1.5, len(suburbs)).round(2).tolist())
+    }
+
+
+def measure(chart, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = app.create_chart(chart).to_json()
+        samples.append((time.perf_counter() - start) * 1000)
+    return len(payload.encode("utf-8")), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    settings = app.get_chart_settings()
+    reduced_settings = dict(settings)
+    print(f"thresholds: {reduced_settings}\n")
+    print(f"{'chart':<22}{'points':>8}{'raw KB':>10}{'raw ms':>9}{'reduced KB':>12}{'reduced ms':>12}{'points':>8}")
+    for name, (chart_type, labels, values) in chart_cases().items():
+        chart = {"chart_type": chart_type, "title": name, "data": {"labels": labels, "values": values}}
+        settings.update({key: 0 for key in settings})
+        raw_bytes, raw_ms = measure(chart, args.repeats)
+        settings.update(reduced_settings)
+        reduced_bytes, reduced_ms = measure(chart, args.repeats)
+        kept = len(app.reduce_chart_data(chart_type, labels, values)[0])
+        print(f"{name:<22}{len(labels):>8,}{raw_bytes / 1024:>10,.0f}{raw_ms:>9,.0f}"
+              f"{reduced_bytes / 1024:>12,.0f}{reduced_ms:>12,.0f}{kept:>8,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Cold-start cost of app.py: module import time and time to first paint.
+
+Each measurement runs in a fresh interpreter, the way a new Streamlit worker
+starts. Import time comes from `python -X importtime -c "import app"` and is
+broken down by the packages app imports; time to first paint runs the home page once
+through streamlit.testing's AppTest:
+
+    python benchmarks/bench_cold_start.py --runs 5
+    python benchmarks/bench_cold_start.py --max-import-ms 2500 --max-paint-ms 5000   # fail on regressions
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_PAINT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+first = time.perf_counter() - start
+start = time.perf_counter()
+at.run()
+print(json.dumps({
+    "first_ms": first * 1000,
+    "rerun_ms": (time.perf_counter() - start) * 1000,
+    "exception": bool(at.exception),
+    "loaded": [name for name in sys.argv[2:] if name in sys.modules]
+}))
+"""
+
+# Packages that should stay off the cold path until a page actually needs them
+LAZY_MODULES = ("plotly.express",)
+
+
+def import_profile():
+    """(app ms, {package imported by app: cumulative ms}, modules imported) for `import app`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    children = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Nested imports are indented two spaces per level and listed before their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == "app":
+                return int(cumulative) / 1000, children, modules
+            children = {}
+    raise RuntimeError("app missing from -X importtime output")
+
+
+def first_paint():
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_PAINT, os.path.join(ROOT, "app.py"), *LAZY_MODULES],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    parser.add_argument("--max-import-ms", type=float, help="exit 1 if median import time exceeds this")
+    parser.add_argument("--max-paint-ms", type=float, help="exit 1 if median time to first paint exceeds this")
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        total, packages, modules = import_profile()
+        totals.append(total)
+    print(f"import app: median {statistics.median(totals):,.0f} ms over {args.runs} runs")
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28}{ms:>10,.1f} ms")
+    eager = [name for name in LAZY_MODULES if name in modules]
+
+    paints = [first_paint() for _ in range(args.runs)]
+    first = statistics.median(p["first_ms"] for p in paints)
+    rerun = statistics.median(p["rerun_ms"] for p in paints)
+    print(f"\nfirst paint (interpreter start excluded): median {first:,.0f} ms • warm rerun {rerun:,.0f} ms")
+    eager += [name for p in paints for name in p["loaded"] if name not in eager]
+
+    failures = []
+    if eager:
+        failures.append(f"imported on the cold path: {', '.join(eager)}")
+    if any(p["exception"] for p in paints):
+        failures.append("the home page raised an exception")
+    if args.max_import_ms and statistics.median(totals) > args.max_import_ms:
+        failures.append(f"import time above {args.max_import_ms:,.0f} ms")
+    if args.max_paint_ms and first > args.max_paint_ms:
+        failures.append(f"first paint above {args.max_paint_ms:,.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Context size and build time per turn as a conversation grows.
+
+Replays a synthetic conversation and, at each turn, builds the history that
+would be sent with the next question: the full transcript (naive) against the
+recent-turn window plus rolling summary the app uses:
+
+    python benchmarks/bench_conversation_memory.py --turns 150
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import DEFAULT_ANSWER  # noqa: E402
+import app  # noqa: E402
+
+QUESTIONS = [
+    "Which towns have the highest prices?",
+    "How do prices vary by flat type in {town}?",
+    "What about the trend in {town} from 1990 to 1999?",
+    "Which floor levels are most expensive in {town}?",
+    "Compare {town} with the national average",
+]
+TOWNS = ["Bedok", "Pasir Ris", "Tampines", "Yishun", "Clementi", "Queenstown"]
+CHART = '\n\n```json\n{"chart_type": "bar", "title": "Prices", "data": {"labels": ["A", "B"], "values": [1, 2]}}\n```\n\n'
+
+
+def conversation(turns):
+    for i in range(turns):
+        yield {"role": "user", "content": QUESTIONS[i % len(QUESTIONS)].format(town=TOWNS[i % len(TOWNS)])}
+        answer = DEFAULT_ANSWER.replace("Follow-up", CHART + "Follow-up")
+        yield {"role": "assistant", "content": answer}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=150)
+    args = parser.parse_args()
+
+    messages = []
+    memory = app.ConversationMemory()
+    report_at = {1, 5, 10, 25, 50, 100, args.turns}
+    print(f"{'turn':>6}{'naive tokens':>14}{'memory tokens':>15}{'build ms':>10}")
+    for turn, msg in enumerate(conversation(args.turns * 2)):
+        messages.append(msg)
+        if msg["role"] != "assistant":
+            continue
+        n = turn // 2 + 1
+        start = time.perf_counter()
+        summary, recent = memory.context(messages)
+        build_ms = (time.perf_counter() - start) * 1000
+        if n in report_at:
+            naive = sum(app.count_tokens(m["content"]) for m in messages)
+            used = sum(app.count_tokens(m["content"]) for m in recent) + (app.count_tokens(summary) if summary else 0)
+            print(f"{n:>6}{naive:>14,}{used:>15,}{build_ms:>10.3f}")
+    print("\nSummary after the last turn:\n" + (memory.summary() or ""))
+
+
+if __name__ == "__main__":
+    main()
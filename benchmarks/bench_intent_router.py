@@ -0,0 +1,90 @@
+"""Intent router accuracy, latency and LLM calls avoided.
+
+Classifies a labelled set of chat questions (none of them among the router's
+seed examples) and times each decision, then routes them end to end against a
+cube built from a synthetic resale table, counting the questions that never
+reach the model:
+
+    python benchmarks/bench_intent_router.py --rows 100000 --repeats 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_query_engine import synthetic_table  # noqa: E402
+import app  # noqa: E402
+
+LABELLED = [
+    ("dashboard", "Show me the dashboard"),
+    ("dashboard", "Open the Power BI view"),
+    ("dashboard", "Can I see the report for this?"),
+    ("dashboard", "Display the visuals please"),
+    ("aggregate", "Which towns have the highest and lowest prices?"),
+    ("aggregate", "How do prices vary by flat type?"),
+    ("aggregate", "Show me the price trend from 1990 to 1999"),
+    ("aggregate", "Average resale price by storey range"),
+    ("aggregate", "Number of transactions by town"),
+    ("aggregate", "Median price by flat type in 1995"),
+    ("aggregate", "Chart of average floor area by town"),
+    ("aggregate", "Price trend in Bedok"),
+    ("aggregate", "Which flat types are the cheapest?"),
+    ("aggregate", "How many sales per year?"),
+    ("llm", "Why are prices in Bedok so high?"),
+    ("llm", "What are the most interesting insights here?"),
+    ("llm", "Summarize the dataset for me"),
+    ("llm", "Is it a good idea to buy a flat now?"),
+    ("llm", "What could explain the dip in 1993?"),
+    ("llm", "Tell me something surprising"),
+    ("llm", "What does each column mean?"),
+    ("llm", "Predict prices for next year"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=200, help="classifications per question for timing")
+    args = parser.parse_args()
+
+    router = app.IntentRouter()
+    correct = 0
+    timings = []
+    print(f"{'expected':<11}{'got':<11}{'conf':>6}  question")
+    for expected, question in LABELLED:
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            route, confidence, source = router.classify(question)
+            timings.append((time.perf_counter() - start) * 1000)
+        correct += route == expected
+        mark = "" if route == expected else "   <-- miss"
+        print(f"{expected:<11}{route:<11}{confidence:>6.2f}  {question} ({source}){mark}")
+    timings.sort()
+    print(f"\naccuracy {correct}/{len(LABELLED)} • classify p50 {statistics.median(timings):.3f} ms"
+          f" • p99 {timings[int(0.99 * (len(timings) - 1))]:.3f} ms")
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ.update(DATA_DIR=data_dir, QUERY_MODE="off")
+        source = os.path.join(data_dir, "source.parquet")
+        synthetic_table(args.rows).to_parquet(source, index=False)
+        app.ingest_dataset("bench", source)
+        app.build_dataset_cube("bench")
+        routes = {}
+        latencies = []
+        for _, question in LABELLED:
+            start = time.perf_counter()
+            route, response, _ = app.route_question(question, "bench", app.EMPTY_STATS, "groq")
+            latencies.append((time.perf_counter() - start) * 1000)
+            routes[route] = routes.get(route, 0) + 1
+        avoided = len(LABELLED) - routes.get("llm", 0)
+        print(f"\nrouted end to end: {routes} • LLM calls avoided {avoided}/{len(LABELLED)}"
+              f" • route p50 {statistics.median(latencies):.1f} ms • max {max(latencies):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Per-call latency of the provider client with and without connection pooling.
+
+Runs against the local mock provider, so the numbers isolate connection setup
+(TCP here; TCP+TLS against the real endpoints) from model latency:
+
+    python benchmarks/bench_provider_pool.py --calls 200 --concurrency 4
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import start_mock_provider  # noqa: E402
+import app  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(post, url, calls, concurrency):
+    payload = {"model": "mock", "messages": [{"role": "user", "content": "Say OK"}]}
+
+    def one_call(_):
+        start = time.perf_counter()
+        response = post(url, json=payload, headers={"Authorization": "Bearer test"}, timeout=10)
+        response.raise_for_status()
+        response.json()
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one_call, range(calls)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="mock provider latency in seconds")
+    args = parser.parse_args()
+
+    server = start_mock_provider(latency=args.latency)
+    url = f"{server.base_url}/chat/completions"
+    session = app.create_http_session()
+
+    print(f"{'mode':<10}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'conns':>8}")
+    for mode, post in (("unpooled", requests.post), ("pooled", session.post)):
+        before = server.stats()["connections"]
+        samples = run(post, url, args.calls, args.concurrency)
+        conns = server.stats()["connections"] - before
+        print(f"{mode:<10}{len(samples):>8}{statistics.median(samples):>10.2f}{percentile(samples, 95):>10.2f}{conns:>8}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
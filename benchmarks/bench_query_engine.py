@@ -0,0 +1,133 @@
+"""Query-mode latency over a full dataset table.
+
+Builds a synthetic HDB-resale-shaped table (or ingests --source, a CSV/Parquet
+file or URL) into Parquet the same way the app does, then times typical
+model-written queries on each available engine:
+
+    python benchmarks/bench_query_engine.py --rows 2000000 --repeats 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+TOWNS = ["ANG MO KIO", "BEDOK", "BISHAN", "BUKIT BATOK", "BUKIT MERAH", "CLEMENTI", "GEYLANG", "HOUGANG",
+         "JURONG EAST", "JURONG WEST", "KALLANG/WHAMPOA", "PASIR RIS", "PUNGGOL", "QUEENSTOWN", "SEMBAWANG",
+         "SENGKANG", "SERANGOON", "TAMPINES", "TOA PAYOH", "WOODLANDS", "YISHUN"]
+FLAT_TYPES = ["1 ROOM", "2 ROOM", "3 ROOM", "4 ROOM", "5 ROOM", "EXECUTIVE", "MULTI-GENERATION"]
+STOREYS = ["01 TO 03", "04 TO 06", "07 TO 09", "10 TO 12", "13 TO 15", "16 TO 18"]
+
+QUERIES = {
+    "mean price by town": {
+        "group_by": ["town"], "metrics": [{"column": "resale_price", "agg": "mean"}], "sort": "desc"
+    },
+    "yearly median, filtered": {
+        "filters": [{"column": "flat_type", "op": "in", "value": ["4 room", "5 room"]}],
+        "group_by": ["year"], "metrics": [{"column": "resale_price", "agg": "median"}]
+    },
+    "count by town and type": {
+        "filters": [{"column": "year", "op": "between", "value": [1995, 1999]}],
+        "group_by": ["town", "flat_type"], "metrics": [{"agg": "count"}], "limit": 20
+    },
+    "p90 area, single row": {
+        "filters": [{"column": "town", "op": "==", "value": "Bedok"}],
+        "metrics": [{"column": "floor_area_sqm", "agg": "p90"}, {"column": "resale_price", "agg": "max"}]
+    }
+}
+
+
+def synthetic_table(rows, seed=7):
+    rng = np.random.default_rng(seed)
+    months = pd.date_range("1990-01-01", "1999-12-01", freq="MS").strftime("%Y-%m")
+    return pd.DataFrame({
+        "month": rng.choice(months, rows),
+        "town": rng.choice(TOWNS, rows),
+        "flat_type": rng.choice(FLAT_TYPES, rows),
+        "storey_range": rng.choice(STOREYS, rows),
+        "floor_area_sqm": rng.uniform(30, 160, rows).round(1),
+        "resale_price": rng.integers(5000, 900000, rows)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--source", help="CSV/Parquet file or URL to ingest instead of the synthetic table")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["DATA_DIR"] = data_dir
+        start = time.perf_counter()
+        if args.source:
+            path = app.ingest_dataset("bench", args.source)
+        else:
+            source = os.path.join(data_dir, "source.parquet")
+            synthetic_table(args.rows).to_parquet(source, index=False)
+            path = app.ingest_dataset("bench", source)
+        print(f"Ingested in {time.perf_counter() - start:.1f} s: {os.path.getsize(path) / 1e6:.1f} MB Parquet")
+
+        start = time.perf_counter()
+        table = app.load_dataset_table("bench", path, os.stat(path).st_mtime_ns)
+        print(f"Loaded {len(table.frame):,} rows in {(time.perf_counter() - start) * 1000:.0f} ms "
+              f"({table.frame.memory_usage(deep=True).sum() / 1e6:.0f} MB in memory)\n")
+
+        engines = ["numpy", "pandas"]
+        try:
+            import duckdb  # noqa: F401
+            engines.append("duckdb")
+        except ImportError:
+            print("duckdb not installed; skipping that engine\n")
+
+        print(f"{'query':<28}" + "".join(f"{engine + ' p50':>14}{engine + ' p95':>14}" for engine in engines))
+        settings = app.get_query_settings()
+        mismatches = 0
+        for name, spec in QUERIES.items():
+            cells = []
+            results = []
+            for engine in engines:
+                settings["engine"] = engine
+                app.run_query(table, spec)
+                samples = []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    result, matched, query = app.run_query(table, spec)
+                    samples.append((time.perf_counter() - start) * 1000)
+                samples.sort()
+                cells.append(f"{statistics.median(samples):>11.1f} ms{samples[int(len(samples) * 0.95) - 1]:>11.1f} ms")
+                results.append((matched, canonical(result, query)))
+            print(f"{name:<28}" + "".join(cells))
+            for engine, (matched, result) in zip(engines[1:], results[1:]):
+                if matched != results[0][0] or not frames_match(result, results[0][1]):
+                    mismatches += 1
+                    print(f"  {engine} disagrees with {engines[0]}")
+        sys.exit(1 if mismatches else 0)
+
+
+def canonical(result, query):
+    # Engines may order tied groups differently
+    result = result.sort_values(query["group_by"]) if query["group_by"] else result
+    return result.reset_index(drop=True).astype({g: str for g in query["group_by"]})
+
+
+def frames_match(left, right):
+    if list(left.columns) != list(right.columns) or len(left) != len(right):
+        return False
+    return all(
+        (left[c] == right[c]).all() if left[c].dtype == object or isinstance(left[c].dtype, pd.StringDtype)
+        else np.allclose(left[c].astype(float), right[c].astype(float), equal_nan=True)
+        for c in left.columns
+    )
+
+if __name__ == "__main__":
+    main()
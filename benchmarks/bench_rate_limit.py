@@ -0,0 +1,68 @@
+"""Answers delivered vs. 429s when a burst exceeds the provider's rate limit.
+
+Runs a burst of chat calls against the local mock provider with a
+requests-per-minute limit, once with the client-side token buckets configured
+to the same limit and once relying only on the provider's 429s and headers:
+
+    python benchmarks/bench_rate_limit.py --requests-per-minute 60 --calls 90 --concurrency 8
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import start_mock_provider  # noqa: E402
+import app  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(calls, concurrency):
+    messages = [{"role": "user", "content": "Which towns have the highest prices?"}]
+
+    def one_call(_):
+        start = time.perf_counter()
+        response = app.call_ai(messages, "You are a data analyst.", provider="groq")
+        return response, (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one_call, range(calls)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests-per-minute", type=int, default=60, help="mock provider limit")
+    parser.add_argument("--calls", type=int, default=90)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-wait", type=float, default=60.0, help="RATE_LIMIT_MAX_WAIT in seconds")
+    args = parser.parse_args()
+
+    os.environ["RATE_LIMIT_MAX_WAIT"] = str(args.max_wait)
+    os.environ["GROQ_TOKENS_PER_MINUTE"] = ""
+    print(f"{'mode':<14}{'answered':>10}{'shed':>8}{'429s':>8}{'p50 ms':>10}{'p95 ms':>10}{'wall s':>8}")
+    for mode, limit in (("buckets", args.requests_per_minute), ("headers only", "")):
+        # A fresh mock (empty window) and API key (fresh limiter) per mode
+        server = start_mock_provider(requests_per_minute=args.requests_per_minute)
+        os.environ.update(GROQ_BASE_URL=server.base_url, GROQ_API_KEY=f"bench-{mode}",
+                          GROQ_REQUESTS_PER_MINUTE=str(limit))
+        start = time.perf_counter()
+        results = run(args.calls, args.concurrency)
+        wall = time.perf_counter() - start
+        answered = [ms for response, ms in results if not response.startswith("Error")]
+        samples = [ms for _, ms in results]
+        print(f"{mode:<14}{len(answered):>10}{len(results) - len(answered):>8}{server.stats()['rejected']:>8}"
+              f"{statistics.median(samples):>10.0f}{percentile(samples, 95):>10.0f}{wall:>8.1f}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
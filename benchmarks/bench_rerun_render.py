@@ -0,0 +1,83 @@
+"""Chat-history processing time per Streamlit rerun vs. conversation length.
+
+Compares re-parsing every assistant message on every rerun (the old loop: clean,
+format, parse chart, build the Plotly figure, extract follow-ups) with replaying
+the structure cached on the message by get_rendered_message. Both modes also pay
+figure.to_json(), which is what st.plotly_chart does with a cached Figure:
+
+    python benchmarks/bench_rerun_render.py --turns 10 25 50 100
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+CHART_ANSWER = """Prices rise with flat size across every town.
+
+Key insights:
+
+• Executive flats average $420,000
+• 3 Room flats average $210,000
+
+```json
+{"chart_type": "bar", "title": "Average price by flat type", "data": {"labels": ["2 Room", "3 Room", "4 Room", "5 Room", "Executive"], "values": [150000, 210000, 290000, 350000, 420000]}, "x_label": "Flat type", "y_label": "Price"}
+```
+
+Follow-up questions:
+1. Which towns have the most executive flats?
+2. How have 4 room prices changed since 1990?
+3. Which flat type has the most transactions?"""
+
+
+def legacy_rerun(messages):
+    for idx, msg in enumerate(messages):
+        content = msg["content"]
+        app.format_response_html(app.clean_response_for_display(content))
+        chart_data = app.parse_chart_from_response(content)
+        if chart_data:
+            fig = app.create_chart(chart_data)
+            if fig:
+                fig.to_json()
+        if idx == len(messages) - 1:
+            app.extract_followup_questions(content)
+
+
+def cached_rerun(messages):
+    for msg in messages:
+        rendered = app.get_rendered_message(msg)
+        if rendered["figure"]:
+            rendered["figure"].to_json()
+
+
+def time_rerun(rerun, messages, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rerun(messages)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 10, 25, 50])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'turns':>6}{'legacy ms':>12}{'cached ms':>12}{'speedup':>9}")
+    for turns in args.turns:
+        messages = [{"role": "assistant", "content": CHART_ANSWER} for _ in range(turns)]
+        legacy = time_rerun(legacy_rerun, messages, args.repeats)
+        cached_rerun(messages)  # first render populates the cache
+        cached = time_rerun(cached_rerun, messages, args.repeats)
+        print(f"{turns:>6}{legacy:>12.1f}{cached:>12.1f}{legacy / cached:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Microbenchmark for the single-pass response parser.
+
+Times parse_response against the separate helpers it replaced on large replies
+built from charts, dashboard tags, markdown noise and a follow-up section. That
+both give the same results is checked by tests/test_response_parser.py:
+
+    python benchmarks/bench_response_parser.py --sizes 2 50 500
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+FRAGMENTS = [
+    "The highest price town is Pasir Ris at $373,272.",
+    "Key insights:\n\n• Pasir Ris is **highest**\n• Sembawang is *lowest*",
+    "Use `resale_price` for the _average_ figures.",
+    '```json\n{"chart_type": "bar", "title": "Towns", "data": {"labels": ["A", "B"], "values": [1, 2]}}\n```',
+    '```json\n{"chart_type": "line", "data": {"labels": [1990, 1991], "values": [3, 4]}}```',
+    "```json\n{not valid json}\n```",
+    "```json\n{\"chart_type\": \"pie\"",
+    "[DASHBOARD:https://app.powerbi.com/view?r=abc]",
+    "[DASHBOARD:https://example.com/embed?id=2]",
+    "Follow-up questions:\n1. Which flat types have seen the biggest price increases?\n2. Would you like a chart?\n3. How do prices compare across regions?",
+    "FOLLOW-UP QUESTIONS:\n- Which towns have the most transactions in 1995?\n- Do you prefer bar charts?",
+    "Some follow up ideas:\n• What drives the gap between towns?\n• Is there seasonality?",
+    "1. Which regions have the highest nightly prices?",
+    "Short?",
+    "",
+]
+
+
+def legacy_parse(response):
+    dashboard = re.search(r'\[DASHBOARD:(.*?)\]', response)
+    body = app.clean_response_for_display(re.sub(r'\[DASHBOARD:.*?\]', '', response))
+    return (
+        body,
+        app.parse_chart_from_response(response),
+        dashboard.group(1) if dashboard else None,
+        app.extract_followup_questions(response),
+    )
+
+
+def single_pass(response):
+    parsed = app.parse_response(response)
+    return (
+        parsed.body,
+        parsed.chart,
+        parsed.dashboards[0] if parsed.dashboards else None,
+        list(parsed.followups),
+    )
+
+
+def best_of(func, response, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(response)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 50, 500], help="reply sizes in KB")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    body = [f for f in FRAGMENTS if "Follow" not in f and "follow" not in f]
+    print(f"{'size KB':>8}{'helpers ms':>12}{'single ms':>11}{'speedup':>9}")
+    for size in args.sizes:
+        parts = []
+        while sum(len(p) for p in parts) < size * 1024:
+            parts.append(rng.choice(body))
+        response = "\n\n".join(parts) + "\n\n" + FRAGMENTS[9]
+        legacy = best_of(legacy_parse, response, args.repeats)
+        single = best_of(single_pass, response, args.repeats)
+        print(f"{size:>8}{legacy:>12.2f}{single:>11.2f}{legacy / single:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
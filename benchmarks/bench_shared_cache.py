@@ -0,0 +1,107 @@
+"""Upstream fetches when many processes miss the same key at once.
+
+Starts a slow local HTTP origin, then several worker processes (standing in for
+Streamlit replicas), each with several threads (sessions), all asking for the
+same key at the same moment. Compares no cache, a per-process L1 only, and L1
+plus a shared SQLite (WAL) L2 with lease-based coalescing:
+
+    python benchmarks/bench_shared_cache.py --processes 4 --threads 8 --latency 0.5
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = b"dataset_id,stat_name,stat_value\n" + b"sg_flat,Average price,$219542\n" * 2000
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def worker(mode, url, l2_path, threads, barrier, results):
+    import logging
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    import requests
+    import app
+
+    if mode == "none":
+        cache = None
+    elif mode == "l1":
+        cache = app.TieredCache(app.MemoryCacheBackend())
+    else:
+        cache = app.TieredCache(app.MemoryCacheBackend(), app.SQLiteCacheBackend(l2_path))
+
+    def load():
+        return requests.get(url, timeout=30).text
+
+    def session(latencies):
+        start = time.perf_counter()
+        value = load() if cache is None else cache.get_or_load("sheet|bench|Stats", load, ttl=300)
+        assert value.startswith("dataset_id")
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies = []
+    barrier.wait()
+    pool = [threading.Thread(target=session, args=(latencies,)) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="origin latency in seconds")
+    args = parser.parse_args()
+
+    origin = ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+    origin.daemon_threads = True
+    origin.lock = threading.Lock()
+    origin.latency = args.latency
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{origin.server_address[1]}/sheet.csv"
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{args.processes} processes x {args.threads} threads, origin latency {args.latency * 1000:.0f} ms\n")
+    print(f"{'cache':<18}{'upstream fetches':>18}{'p50 ms':>10}{'max ms':>10}")
+    for mode, label in (("none", "none"), ("l1", "L1 only"), ("l1+l2", "L1 + SQLite L2")):
+        origin.requests = 0
+        with tempfile.TemporaryDirectory() as directory:
+            barrier = context.Barrier(args.processes)
+            results = context.Queue()
+            procs = [
+                context.Process(target=worker, args=(mode, url, os.path.join(directory, "l2.sqlite"),
+                                                     args.threads, barrier, results))
+                for _ in range(args.processes)
+            ]
+            for proc in procs:
+                proc.start()
+            latencies = sorted(ms for _ in procs for ms in results.get())
+            for proc in procs:
+                proc.join()
+        print(f"{label:<18}{origin.requests:>18}{latencies[len(latencies) // 2]:>10.0f}{latencies[-1]:>10.0f}")
+    origin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
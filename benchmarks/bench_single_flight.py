@@ -0,0 +1,146 @@
+"""Upstream calls when many users click the same starter question at once.
+
+Each simulated click does what the chat handler does: check the response cache,
+then submit the question to the background job queue and wait for the answer.
+Runs against the local mock provider, with single-flight off and on, and with
+some or all of the clicking sessions pressing Stop before the answer arrives.
+Then splits the clicks across several worker processes (Streamlit replicas)
+with and without a shared SQLite response cache, whose lease lets one replica
+answer for all of them:
+
+    python benchmarks/bench_single_flight.py --clicks 100 --latency 0.5 --spread 2 --processes 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import start_mock_provider  # noqa: E402
+import app  # noqa: E402
+
+DATASET = {"dataset_id": "bench", "dataset_name": "Resale Flat Prices"}
+STATS = app.DatasetStats(
+    [app.StatRecord("bench", "Overview", "Total transactions", "287,200"),
+     app.StatRecord("bench", "Prices", "Average price", "$219,542")],
+    version="bench"
+)
+
+
+def click(i, question, stop_after, latencies, answered):
+    start = time.perf_counter()
+    if app.get_cached_response("groq", "bench", STATS, question):
+        answered.append(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+        return
+    jobs = app.get_llm_jobs()
+    job = app.start_answer_job(f"session-{i}", "groq", question, DATASET, STATS)
+    deadline = start + app.LLM_JOB_TIMEOUT
+    while not job.done and time.perf_counter() < deadline:
+        if stop_after is not None and time.perf_counter() - start > stop_after:
+            jobs.cancel(job.id)
+            return
+        time.sleep(0.01)
+    if job.done and job.status == "done":
+        answered.append(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def scenario(server, question, clicks, spread, stopping, stop_after):
+    before = server.stats()["requests"]
+    latencies, answered = [], []
+    threads = []
+    for i in range(clicks):
+        stop = stop_after if i < stopping else None
+        thread = threading.Thread(target=click, args=(i, question, stop, latencies, answered))
+        threads.append(thread)
+        thread.start()
+        if spread:
+            time.sleep(spread / clicks)
+    for thread in threads:
+        thread.join()
+    time.sleep(0.2)  # let a cancelled stream wind down before counting
+    return server.stats()["requests"] - before, len(answered), latencies
+
+
+def replica(clicks, question, barrier, results):
+    import logging
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    barrier.wait()
+    latencies, answered = [], []
+    threads = [threading.Thread(target=click, args=(i, question, None, latencies, answered)) for i in range(clicks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((len(answered), latencies))
+
+
+def replicas(server, processes, clicks, cache):
+    """Upstream calls and answers when `clicks` are split across processes"""
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(RESPONSE_CACHE_BACKEND=cache, RESPONSE_CACHE_PATH=os.path.join(directory, "responses.sqlite"),
+                          LLM_SINGLE_FLIGHT="on")
+        before = server.stats()["requests"]
+        barrier = context.Barrier(processes)
+        results = context.Queue()
+        question = f"Which towns have the highest prices? ({cache} replicas)"
+        procs = [context.Process(target=replica, args=(clicks // processes, question, barrier, results))
+                 for _ in range(processes)]
+        for proc in procs:
+            proc.start()
+        outcomes = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+    answered = sum(n for n, _ in outcomes)
+    latencies = [ms for _, samples in outcomes for ms in samples]
+    return server.stats()["requests"] - before, answered, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clicks", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.5, help="mock provider latency in seconds")
+    parser.add_argument("--spread", type=float, default=0.0, help="seconds over which the clicks arrive")
+    parser.add_argument("--workers", type=int, default=16, help="LLM_MAX_CONCURRENCY")
+    parser.add_argument("--processes", type=int, default=4, help="replicas for the shared-cache runs")
+    args = parser.parse_args()
+
+    server = start_mock_provider(latency=args.latency, token_delay=0.002)
+    os.environ.update(GROQ_BASE_URL=server.base_url, GROQ_API_KEY="bench", GROQ_REQUESTS_PER_MINUTE="",
+                      GROQ_TOKENS_PER_MINUTE="", LLM_MAX_CONCURRENCY=str(args.workers))
+
+    half = args.clicks // 2
+    runs = (
+        ("off", "single-flight off", 0),
+        ("on", "single-flight on", 0),
+        ("on", f"on, {half} press Stop", half),
+        ("on", "on, all press Stop", args.clicks),
+    )
+    print(f"{args.clicks} clicks over {args.spread:g} s, provider latency {args.latency * 1000:.0f} ms, "
+          f"{args.workers} workers\n")
+    print(f"{'mode':<24}{'upstream calls':>16}{'per 100 clicks':>16}{'answered':>10}{'p50 ms':>10}{'max ms':>10}")
+    for n, (mode, label, stopping) in enumerate(runs):
+        os.environ["LLM_SINGLE_FLIGHT"] = mode
+        # A different question per run, so no run is answered from another's cache
+        question = f"Which towns have the highest prices? ({n})"
+        calls, answered, latencies = scenario(server, question, args.clicks, args.spread, stopping, args.latency / 2)
+        p50 = f"{statistics.median(latencies):>10.0f}{max(latencies):>10.0f}" if latencies else f"{'-':>10}{'-':>10}"
+        print(f"{label:<24}{calls:>16}{calls * 100 / args.clicks:>16.1f}{answered:>10}{p50}")
+    for cache, label in (("memory", f"{args.processes} replicas, no L2"), ("sqlite", f"{args.processes} replicas, SQLite L2")):
+        calls, answered, latencies = replicas(server, args.processes, args.clicks, cache)
+        clicks = args.clicks // args.processes * args.processes
+        p50 = f"{statistics.median(latencies):>10.0f}{max(latencies):>10.0f}" if latencies else f"{'-':>10}{'-':>10}"
+        print(f"{label:<24}{calls:>16}{calls * 100 / clicks:>16.1f}{answered:>10}{p50}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
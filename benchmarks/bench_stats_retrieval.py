@@ -0,0 +1,102 @@
+"""Prompt size and answer latency with and without stats retrieval.
+
+Uses the real Stats tab when --sheet-id (or GOOGLE_SHEET_ID) or --stats-csv is
+given, otherwise a synthetic Stats table shaped like the sg_flat and nz_airbnb
+sheets. Latency is measured against the local mock provider, which charges
+--prefill-latency seconds per 1k prompt tokens:
+
+    python benchmarks/bench_stats_retrieval.py --sheet-id <id> --top-k 25 --token-budget 1200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import zlib
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import start_mock_provider  # noqa: E402
+import app  # noqa: E402
+
+SG_TOWNS = ["Ang Mo Kio", "Bedok", "Bishan", "Bukit Batok", "Bukit Merah", "Clementi", "Geylang", "Hougang",
+            "Jurong East", "Jurong West", "Kallang", "Pasir Ris", "Punggol", "Queenstown", "Sembawang",
+            "Sengkang", "Serangoon", "Tampines", "Toa Payoh", "Woodlands", "Yishun"]
+SG_FLAT_TYPES = ["1 Room", "2 Room", "3 Room", "4 Room", "5 Room", "Executive", "Multi-Generation"]
+NZ_REGIONS = ["Auckland", "Wellington", "Canterbury", "Otago", "Queenstown", "Waikato", "Bay of Plenty",
+              "Northland", "Nelson", "Hawke's Bay", "Taranaki", "Southland"]
+NZ_ROOM_TYPES = ["Entire home", "Private room", "Shared room", "Hotel room"]
+
+
+def spread(text, modulo):
+    # Deterministic pseudo-random offsets so runs are comparable
+    return zlib.crc32(text.encode("utf-8")) % modulo
+
+
+def synthetic_stats():
+    rows = []
+    for town in SG_TOWNS:
+        rows.append(("sg_flat", "town", f"Average price in {town}", f"${200000 + spread(town, 150000):,}"))
+        rows.append(("sg_flat", "town", f"Transactions in {town}", f"{5000 + spread(town, 9000):,}"))
+    for flat_type in SG_FLAT_TYPES:
+        rows.append(("sg_flat", "flat_type", f"Average price for {flat_type}", f"${100000 + spread(flat_type, 300000):,}"))
+    for year in range(1990, 2000):
+        rows.append(("sg_flat", "trend", f"Average price in {year}", f"${100000 + (year - 1990) * 25000:,}"))
+    for storey in ["01 TO 03", "04 TO 06", "07 TO 09", "10 TO 12", "13 TO 15", "16 TO 18"]:
+        rows.append(("sg_flat", "floor_level", f"Average price for storeys {storey}", f"${180000 + spread(storey, 90000):,}"))
+    for region in NZ_REGIONS:
+        rows.append(("nz_airbnb", "region", f"Average nightly price in {region}", f"${90 + spread(region, 250)}"))
+        rows.append(("nz_airbnb", "region", f"Listings in {region}", f"{500 + spread(region, 8000):,}"))
+        for room_type in NZ_ROOM_TYPES:
+            rows.append(("nz_airbnb", "room_type", f"{room_type} price in {region}", f"${60 + spread(room_type + region, 300)}"))
+    return pd.DataFrame(rows, columns=["dataset_id", "stat_category", "stat_name", "stat_value"])
+
+
+def load_stats(args):
+    if args.stats_csv:
+        return pd.read_csv(args.stats_csv)
+    sheet_id = args.sheet_id or os.environ.get("GOOGLE_SHEET_ID")
+    if sheet_id:
+        return pd.read_csv(f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet=Stats")
+    return synthetic_stats()
+
+
+def timed_call(prompt, question):
+    start = time.perf_counter()
+    app.call_provider("groq", [{"role": "user", "content": question}], prompt)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sheet-id")
+    parser.add_argument("--stats-csv")
+    parser.add_argument("--top-k", type=int, default=app.RETRIEVAL_TOP_K)
+    parser.add_argument("--token-budget", type=int, default=app.RETRIEVAL_TOKEN_BUDGET)
+    parser.add_argument("--prefill-latency", type=float, default=0.4, help="mock seconds per 1k prompt tokens")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    server = start_mock_provider(prefill_latency=args.prefill_latency)
+    os.environ.update(GROQ_BASE_URL=server.base_url, GROQ_API_KEY="benchmark")
+    index = app.build_stats_index(app.frame_records(load_stats(args)))
+
+    print(f"{'dataset':<12}{'question':<52}{'full tok':>9}{'topk tok':>9}{'full ms':>9}{'topk ms':>9}")
+    for dataset_id, stats in index.items():
+        retriever = app.StatsRetriever(stats)
+        for question in app.get_initial_suggestions(dataset_id):
+            full_prompt = app.build_system_prompt(dataset_id, stats)
+            selected = retriever.select(question, args.top_k, args.token_budget)
+            small_prompt = app.build_system_prompt(dataset_id, selected)
+            full_ms = statistics.median(timed_call(full_prompt, question) for _ in range(args.repeats))
+            small_ms = statistics.median(timed_call(small_prompt, question) for _ in range(args.repeats))
+            print(f"{dataset_id:<12}{question[:50]:<52}{app.count_tokens(full_prompt):>9}"
+                  f"{app.count_tokens(small_prompt):>9}{full_ms:>9.0f}{small_ms:>9.0f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Build or refresh the aggregate cube for each dataset.
+
+A cube holds count/sum/mean/min/max and percentiles of every numeric column, by
+each text column and by year, in a small Parquet file next to the dataset's
+table (DATA_DIR/<dataset_id>.cube.parquet). The app answers matching chart
+questions from it without calling the model. Rebuilds only recompute the years
+whose rows changed, so rerun this after new rows are ingested:
+
+    python build_cubes.py sg_flat                       # from DATA_DIR/sg_flat.parquet
+    python build_cubes.py sg_flat --source resale.csv   # ingest the file first
+    python build_cubes.py --all                         # every dataset with a data_url in the sheet
+
+Configuration (DATA_DIR, GOOGLE_SHEET_ID, ...) is read from the environment, like
+batch_questions.py.
+"""
+
+import argparse
+import logging
+import sys
+
+# Running outside `streamlit run`: the bare-mode warnings are expected here
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("datasets", nargs="*", help="dataset ids")
+    parser.add_argument("--all", action="store_true", help="every dataset in the Datasets tab")
+    parser.add_argument("--source", help="CSV/Parquet file or URL to ingest first (one dataset only)")
+    parser.add_argument("--full", action="store_true", help="rebuild every year, ignoring the existing cube")
+    args = parser.parse_args()
+
+    dataset_ids = list(args.datasets)
+    if args.all:
+        dataset_ids += [d["dataset_id"] for d in app.get_datasets() if d.get("data_url")]
+    if not dataset_ids:
+        parser.error("name at least one dataset, or pass --all")
+    if args.source:
+        if len(dataset_ids) != 1:
+            parser.error("--source needs exactly one dataset")
+        app.ingest_dataset(dataset_ids[0], args.source)
+
+    failed = False
+    for dataset_id in dict.fromkeys(dataset_ids):
+        try:
+            summary = app.build_dataset_cube(dataset_id, full=args.full)
+        except Exception as e:
+            print(f"{dataset_id}: failed: {e}", file=sys.stderr)
+            failed = True
+            continue
+        if summary is None:
+            print(f"{dataset_id}: no row-level data", file=sys.stderr)
+            continue
+        print(
+            f"{dataset_id}: {summary['rows']:,} rows -> {summary['cells']:,} cells, "
+            f"{summary['years_rebuilt']}/{summary['years']} years rebuilt in {summary['build_ms']:,.0f} ms, "
+            f"{summary['bytes'] / 1024:,.1f} KB"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Local OpenAI-compatible mock of the Groq/DeepSeek chat endpoint.
+
+Used by the benchmarks and for offline runs of the app:
+
+    python mock_provider.py --port 8765 --latency 0.05
+    python mock_provider.py --requests-per-minute 30   # answer 429 above the limit
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=test streamlit run app.py
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = """The highest price town is Pasir Ris at $373,272 while the lowest is Sembawang at $69,683.
+
+Key insights:
+
+• Pasir Ris has the highest average price of $373,272
+• Sembawang has the lowest average price of $69,683
+• The price gap between highest and lowest is over $300,000
+
+Follow-up questions:
+1. Which flat types have seen the biggest price increases?
+2. How do prices in Pasir Ris compare over time?
+3. Which towns have the most transactions?"""
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between calls
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _send_stream(self, payload, usage, headers):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for token in self.server.answer.split(" "):
+                event = {"choices": [{"index": 0, "delta": {"content": token + " "}}], "model": payload.get("model", "mock")}
+                self._send_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                time.sleep(self.server.token_delay)
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                event = {"choices": [], "usage": usage}
+                self._send_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client hung up mid-stream (e.g. a cancelled hedge request)
+            self.close_connection = True
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.server.record_request(self.client_address)
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+        messages = payload.get("messages", [])
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        allowed, headers = self.server.admit()
+        if not allowed:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+            return
+        cached_tokens = self.server.prefix_cache_hit(messages)
+        time.sleep(self.server.latency + self.server.prefill_latency * prompt_tokens / 1000)
+        if payload.get("stream"):
+            self._send_stream(payload, self._usage(prompt_tokens, cached_tokens), headers)
+            return
+        self._send_json(200, {
+            "id": "mock",
+            "object": "chat.completion",
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.server.answer}, "finish_reason": "stop"}],
+            "usage": self._usage(prompt_tokens, cached_tokens)
+        }, headers)
+
+    def _usage(self, prompt_tokens, cached_tokens):
+        completion_tokens = len(self.server.answer) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, answer=DEFAULT_ANSWER, token_delay=0.0, prefill_latency=0.0,
+                 requests_per_minute=None):
+        super().__init__(address, MockProviderHandler)
+        self.latency = latency
+        self.token_delay = token_delay
+        # Seconds per 1k prompt tokens, to model prompt processing time
+        self.prefill_latency = prefill_latency
+        self.answer = answer
+        self.requests_per_minute = requests_per_minute
+        self._lock = threading.Lock()
+        self._admitted = deque()
+        self._rejected = 0
+        self._requests = 0
+        self._clients = set()
+        self._prefixes = set()
+
+    def prefix_cache_hit(self, messages):
+        """Tokens of a leading system message already seen, like a provider prefix cache"""
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = messages[0].get("content", "")
+        with self._lock:
+            seen = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        return len(prefix) // 4 if seen else 0
+
+    def admit(self):
+        """Sliding one-minute window, reported in Groq/OpenAI x-ratelimit-* headers"""
+        if not self.requests_per_minute:
+            return True, {}
+        now = time.monotonic()
+        with self._lock:
+            while self._admitted and now - self._admitted[0] >= 60:
+                self._admitted.popleft()
+            allowed = len(self._admitted) < self.requests_per_minute
+            if allowed:
+                self._admitted.append(now)
+            else:
+                self._rejected += 1
+            reset = 60 - (now - self._admitted[0]) if self._admitted else 0
+            headers = {
+                "x-ratelimit-limit-requests": str(self.requests_per_minute),
+                "x-ratelimit-remaining-requests": str(self.requests_per_minute - len(self._admitted)),
+                "x-ratelimit-reset-requests": f"{reset:.2f}s"
+            }
+        if not allowed:
+            headers["retry-after"] = str(max(1, round(reset)))
+        return allowed, headers
+
+    def record_request(self, client_address):
+        with self._lock:
+            self._requests += 1
+            self._clients.add(client_address)
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self._requests, "connections": len(self._clients), "rejected": self._rejected}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_provider(port=0, latency=0.0, answer=DEFAULT_ANSWER, token_delay=0.0, prefill_latency=0.0,
+                        requests_per_minute=None):
+    """Start the mock in a daemon thread and return the server (see .base_url)"""
+    server = MockProviderServer(
+        ("127.0.0.1", port), latency=latency, answer=answer,
+        token_delay=token_delay, prefill_latency=prefill_latency,
+        requests_per_minute=requests_per_minute
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="seconds per 1k prompt tokens")
+    parser.add_argument("--requests-per-minute", type=int, help="answer 429 above this many requests per minute")
+    args = parser.parse_args()
+    server = MockProviderServer(
+        ("127.0.0.1", args.port), latency=args.latency,
+        token_delay=args.token_delay, prefill_latency=args.prefill_latency,
+        requests_per_minute=args.requests_per_minute
+    )
+    print(f"Mock provider listening on {server.base_url}")
+    server.serve_forever()
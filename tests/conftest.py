@@ -0,0 +1,44 @@
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Imported outside `streamlit run`: the bare-mode warnings are expected here
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import app  # noqa: E402
+
+TOWNS = ["ANG MO KIO", "BEDOK", "CLEMENTI", "PASIR RIS", "YISHUN"]
+FLAT_TYPES = ["3 ROOM", "4 ROOM", "5 ROOM", "EXECUTIVE"]
+
+
+def make_table(frame, dataset_id="test"):
+    return app.DatasetTable(dataset_id, f"{dataset_id}.parquet", 1, app.prepare_table(frame))
+
+
+@pytest.fixture
+def resale_table():
+    """A small resale table where 30% of resale_price is missing"""
+    rng = np.random.default_rng(3)
+    rows = 20_000
+    months = pd.date_range("1990-01-01", "1993-12-01", freq="MS").strftime("%Y-%m")
+    prices = rng.integers(50_000, 900_000, rows).astype(float)
+    prices[rng.random(rows) < 0.3] = np.nan
+    return make_table(pd.DataFrame({
+        "month": rng.choice(months, rows),
+        "town": rng.choice(TOWNS, rows),
+        "flat_type": rng.choice(FLAT_TYPES, rows),
+        "floor_area_sqm": rng.uniform(30, 160, rows).round(1),
+        "resale_price": prices
+    }))
+
+
+@pytest.fixture
+def resale_cube(resale_table):
+    cells, meta, _ = app.build_cube(resale_table)
+    return app.AggregateCube("test", 1, cells, meta)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def test_lttb_keeps_the_ends_and_the_point_count():
+    x = np.arange(10_000, dtype=float)
+    y = np.sin(x / 100)
+    chosen = app.lttb_indices(x, y, 500)
+    assert len(chosen) == 500
+    assert chosen[0] == 0 and chosen[-1] == len(x) - 1
+    assert (np.diff(chosen) > 0).all()
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(5_000, dtype=float)
+    y = np.zeros(5_000)
+    y[2_345] = 100.0
+    assert 2_345 in app.lttb_indices(x, y, 50)
+
+
+def test_lttb_treats_missing_values_as_zero():
+    x = np.arange(1_000, dtype=float)
+    y = np.ones(1_000)
+    y[::7] = np.nan
+    chosen = app.lttb_indices(x, y, 100)
+    assert len(chosen) == 100
+
+
+@pytest.mark.parametrize("threshold", [2, 1_000, 5_000])
+def test_lttb_leaves_short_series_alone(threshold):
+    x = np.arange(1_000, dtype=float)
+    assert app.lttb_indices(x, x, threshold).tolist() == list(range(1_000))
+
+
+def test_top_n_with_other_keeps_order_and_total():
+    labels, values = app.top_n_with_other(["a", "b", "c", "d", "e"], np.array([5.0, 1.0, 9.0, np.nan, 3.0]), 3)
+    assert labels == ["a", "c", "Other (3)"]
+    assert values == [5.0, 9.0, 4.0]
@@ -0,0 +1,130 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def query_by(table, group, agg, years=None):
+    spec = {"group_by": [group], "metrics": [{"agg": agg, "column": "resale_price"}]}
+    if years:
+        spec["filters"] = [{"column": "year", "op": "between", "value": list(years)}]
+    result, _, query = app.run_query(table, spec)
+    return dict(zip(result[group].astype(str), result[query["metrics"][0]["name"]]))
+
+
+@pytest.mark.parametrize("years", [None, (1991, 1991), (1990, 1991), (1990, 1993)])
+@pytest.mark.parametrize("stat", ["mean", "min", "max"])
+def test_slice_matches_run_query_with_missing_values(resale_table, resale_cube, years, stat):
+    expected = query_by(resale_table, "town", stat, years)
+    result = resale_cube.slice("town", "resale_price", stat, years)
+    got = dict(zip(result["label"], result["value"]))
+    assert got.keys() == expected.keys()
+    for town, value in expected.items():
+        assert got[town] == pytest.approx(value)
+
+
+@pytest.mark.parametrize("stat", ["median", "p90"])
+def test_slice_order_statistics(resale_table, resale_cube, stat):
+    expected = query_by(resale_table, "flat_type", stat, (1992, 1992))
+    result = resale_cube.slice("flat_type", "resale_price", stat, (1992, 1992))
+    assert dict(zip(result["label"], result["value"])) == pytest.approx(expected)
+
+
+def test_slice_refuses_percentiles_over_a_range(resale_cube):
+    assert resale_cube.slice("town", "resale_price", "median", (1990, 1991)) is None
+
+
+def test_slice_counts_rows_not_values(resale_table, resale_cube):
+    result = resale_cube.slice("town", "resale_price", "count")
+    assert result["value"].sum() == len(resale_table.frame)
+
+
+def test_trend_for_one_label(resale_table, resale_cube):
+    result = resale_cube.slice("year", "resale_price", "mean", where=("town", "BEDOK"))
+    frame = resale_table.frame
+    bedok = frame[frame["town"] == "BEDOK"]
+    expected = bedok.groupby("year", observed=True)["resale_price"].mean()
+    assert result["label"].tolist() == [str(y) for y in expected.index]
+    assert result["value"].tolist() == pytest.approx(expected.tolist())
+
+
+def test_incremental_rebuild_reuses_unchanged_years(resale_table, resale_cube):
+    cells, meta, changed = app.build_cube(resale_table, resale_cube)
+    assert changed == [] and cells is resale_cube.frame
+    frame = resale_table.frame.copy()
+    frame.loc[frame["year"] == 1993, "resale_price"] = np.nan
+    table = app.DatasetTable("test", "test.parquet", 2, frame)
+    cells, meta, changed = app.build_cube(table, resale_cube)
+    assert changed == [1993]
+    rebuilt = app.AggregateCube("test", 2, cells, meta)
+    assert rebuilt.slice("town", "resale_price", "mean", (1990, 1993)) is not None
+    expected = query_by(table, "town", "mean", (1990, 1993))
+    got = rebuilt.slice("town", "resale_price", "mean", (1990, 1993))
+    assert dict(zip(got["label"], got["value"])) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("Which towns have the highest prices?",
+     {"group": "town", "measure": "resale_price", "stat": "mean", "years": None, "where": None, "ascending": False}),
+    ("Which towns are the cheapest by resale price?",
+     {"group": "town", "measure": "resale_price", "stat": "mean", "years": None, "where": None, "ascending": True}),
+    ("Median floor area by town from 1990 to 1991",
+     {"group": "town", "measure": "floor_area_sqm", "stat": "median", "years": (1990, 1991), "where": None,
+      "ascending": False}),
+    ("Price trend in Bedok",
+     {"group": "year", "measure": "resale_price", "stat": "mean", "years": None, "where": ("town", "BEDOK"),
+      "ascending": True}),
+])
+def test_match_cube_question(resale_cube, question, expected):
+    assert app.match_cube_question(resale_cube, question) == expected
+
+
+def test_match_cube_question_counts_records(resale_cube):
+    spec = app.match_cube_question(resale_cube, "Number of transactions by flat type")
+    assert (spec["group"], spec["stat"]) == ("flat_type", "count")
+
+
+@pytest.mark.parametrize("question", [
+    "Why are prices in Bedok so high?",          # wants reasoning
+    "Average price by town and flat type",       # two dimensions
+    "Average price by flat type in Bedok",       # a filter on another dimension
+    "Average price by town in 2005",             # a year the cube does not have
+    "Which towns are the cheapest?",             # no measure named, and there are two
+])
+def test_match_cube_question_leaves_the_rest_to_the_model(resale_cube, question):
+    assert app.match_cube_question(resale_cube, question) is None
+
+
+@pytest.fixture
+def sourced_cube(tmp_path, monkeypatch, resale_table):
+    """A dataset ingested from a local CSV with its cube built; returns (source path, ingester)"""
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    source = tmp_path / "source.csv"
+    resale_table.frame[["month", "town", "resale_price"]].to_csv(source, index=False)
+    row = {"dataset_id": "sourced", "dataset_name": "Sourced", "data_url": str(source)}
+    monkeypatch.setattr(app, "get_datasets", lambda: [row])
+    ingester = app.DatasetIngester(interval=0)
+    monkeypatch.setattr(app, "get_dataset_ingester", lambda: ingester)
+    app.build_dataset_cube("sourced")
+    return source, ingester
+
+
+def test_cube_built_from_an_older_table_defers_to_the_model_until_rebuilt(sourced_cube):
+    source, ingester = sourced_cube
+    question = "average price by town"
+    assert "PASIR RIS" in app.answer_from_cube(question, "sourced")
+    frame = pd.read_csv(source)
+    frame.loc[frame["town"] == "PASIR RIS", "town"] = "PUNGGOL"
+    frame.to_csv(source, index=False)
+    app.get_dataset_table("sourced", wait=True)
+    assert app.answer_from_cube(question, "sourced") is None
+    deadline = time.monotonic() + 10
+    answer = None
+    while answer is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+        answer = app.answer_from_cube(question, "sourced")
+    assert "PUNGGOL" in answer and "PASIR RIS" not in answer
+    assert app.get_dataset_cube("sourced").meta["table_version"] == app.dataset_table_version("sourced")
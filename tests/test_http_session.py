@@ -0,0 +1,47 @@
+import http.server
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def failing_server():
+    """A local server answering every request with 503; yields (url, hits per method)"""
+    hits = {"GET": 0, "POST": 0}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def respond(self):
+            hits[self.command] += 1
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/chat/completions", hits
+    server.shutdown()
+
+
+def test_only_gets_are_retried_on_5xx(failing_server, monkeypatch):
+    url, hits = failing_server
+    monkeypatch.setattr(app, "HTTP_BACKOFF_FACTOR", 0)
+    session = app.create_http_session(max_retries=2)
+    assert session.get(url).status_code == 503
+    # A replayed chat completion would be billed twice
+    assert session.post(url, json={}).status_code == 503
+    assert hits == {"GET": 3, "POST": 1}
+
+
+def test_provider_hosts_have_their_own_pools():
+    session = app.create_http_session()
+    provider = session.get_adapter(app.get_provider_config("groq")["base_url"] + "/chat/completions")
+    assert session.get_adapter(app.get_provider_config("deepseek")["base_url"] + "/chat/completions") is provider
+    assert session.get_adapter("https://docs.google.com/spreadsheets/d/x/gviz/tq") is not provider
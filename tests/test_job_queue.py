@@ -0,0 +1,122 @@
+import threading
+import time
+
+import app
+
+
+def wait_done(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.done
+
+
+def blocking_run(started, release):
+    """A run that holds its worker until `release` is set or the job is cancelled"""
+    def run(stop):
+        stop.on_cancel(release.set)
+        started.set()
+        release.wait(5)
+        return ["held"]
+    return run
+
+
+def test_sessions_are_served_round_robin():
+    jobs = app.LLMJobQueue({"groq": 1})
+    started, release = threading.Event(), threading.Event()
+    first = jobs.submit("x", "groq", blocking_run(started, release))
+    assert started.wait(5)
+    order = []
+
+    def recorder(name):
+        def run(stop):
+            order.append(name)
+            return [name]
+        return run
+
+    submitted = [
+        jobs.submit(owner, "groq", recorder(name))
+        for owner, name in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1"))
+    ]
+    # One session's burst does not push the others back
+    assert [jobs.position(job) for job in submitted] == [0, 3, 4, 1, 2]
+    assert jobs.depth("groq") == 5
+    release.set()
+    for job in (first, *submitted):
+        wait_done(job)
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+    assert [job.response for job in submitted] == ["a1", "a2", "a3", "b1", "c1"]
+
+
+def test_cancelling_a_running_job_frees_its_worker():
+    jobs = app.LLMJobQueue({"groq": 1})
+    started, release = threading.Event(), threading.Event()
+    running = jobs.submit("a", "groq", blocking_run(started, release))
+    assert started.wait(5)
+    queued = jobs.submit("b", "groq", lambda stop: iter(["next"]))
+    start = time.monotonic()
+    jobs.cancel(running.id)
+    wait_done(queued)
+    assert time.monotonic() - start < 1
+    assert running.status == "cancelled" and queued.response == "next"
+    assert jobs.running["groq"] == 0
+
+
+def test_cancelling_a_queued_job_skips_it():
+    jobs = app.LLMJobQueue({"groq": 1})
+    started, release = threading.Event(), threading.Event()
+    running = jobs.submit("a", "groq", blocking_run(started, release))
+    assert started.wait(5)
+    calls = []
+    queued = jobs.submit("b", "groq", lambda stop: calls.append(1) or ["never"])
+    jobs.cancel(queued.id)
+    assert queued.status == "cancelled" and jobs.depth("groq") == 0
+    release.set()
+    wait_done(running)
+    assert calls == [] and running.status == "done"
+
+
+def test_identical_questions_join_one_flight():
+    jobs = app.LLMJobQueue({"groq": 1})
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def run(stop):
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ["shared answer"]
+
+    leader = jobs.submit("a", "groq", run, key="k")
+    assert started.wait(5)
+    joined = [jobs.submit(owner, "groq", run, key="k") for owner in ("b", "c")]
+    assert all(job is leader for job in joined) and leader.subscribers == 3
+    release.set()
+    wait_done(leader)
+    assert calls == [1] and leader.response == "shared answer"
+    # Landed: the next identical question starts a new flight
+    assert jobs.submit("d", "groq", run, key="k") is not leader
+
+
+def test_flight_keeps_running_until_its_last_subscriber_leaves():
+    jobs = app.LLMJobQueue({"groq": 1})
+    started, release = threading.Event(), threading.Event()
+    leader = jobs.submit("a", "groq", blocking_run(started, release), key="k")
+    assert started.wait(5)
+    jobs.submit("b", "groq", blocking_run(started, release), key="k")
+    jobs.cancel(leader.id)
+    assert not leader.cancelled and leader.subscribers == 1
+    jobs.cancel(leader.id)
+    wait_done(leader)
+    assert leader.status == "cancelled"
+    assert jobs.submit("c", "groq", lambda stop: ["fresh"], key="k") is not leader
+
+
+def test_an_old_flight_is_not_joined(monkeypatch):
+    monkeypatch.setattr(app, "LLM_SINGLE_FLIGHT_MAX_AGE", 0)
+    jobs = app.LLMJobQueue({"groq": 1})
+    started, release = threading.Event(), threading.Event()
+    leader = jobs.submit("a", "groq", blocking_run(started, release), key="k")
+    assert started.wait(5)
+    assert jobs.submit("b", "groq", lambda stop: ["fresh"], key="k") is not leader
+    release.set()
@@ -0,0 +1,62 @@
+import app
+
+
+def conversation(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i} about town{i} prices?"})
+        messages.append({"role": "assistant", "content": f"Answer {i} first sentence. More detail {i}.\n\n"
+                         '```json\n{"chart_type": "bar"}\n```\n\nFollow-up questions:\n1. Next?'})
+    return messages
+
+
+def tokens(messages):
+    return sum(app.count_tokens(m["content"]) for m in messages)
+
+
+def test_short_conversations_are_replayed_whole():
+    messages = conversation(2)
+    summary, recent = app.ConversationMemory().context(messages)
+    assert summary is None
+    assert [m["role"] for m in recent] == ["user", "assistant", "user", "assistant"]
+    # Answers are replayed without their chart and follow-ups
+    assert recent[1]["content"] == "Answer 0 first sentence. More detail 0."
+
+
+def test_older_turns_are_folded_into_the_summary():
+    messages = conversation(10)
+    summary, recent = app.ConversationMemory().context(messages, turn_budget=60, summary_budget=1_000)
+    assert tokens(recent) <= 60
+    assert recent[0]["role"] == "user"
+    folded = (len(messages) - len(recent)) // 2
+    assert summary.splitlines()[0] == "- Q: Question 0 about town0 prices? A: Answer 0 first sentence."
+    assert len(summary.splitlines()) == folded
+
+
+def test_each_turn_is_folded_once():
+    memory = app.ConversationMemory()
+    messages = conversation(6)
+    memory.context(messages, turn_budget=60, summary_budget=1_000)
+    folded, digests = memory.folded, len(memory.digests)
+    memory.context(messages, turn_budget=60, summary_budget=1_000)
+    assert (memory.folded, len(memory.digests)) == (folded, digests)
+    messages += conversation(8)[12:]
+    memory.context(messages, turn_budget=60, summary_budget=1_000)
+    assert memory.folded > folded
+    assert len(memory.digests) == memory.folded // 2
+
+
+def test_digests_over_budget_become_topics():
+    memory = app.ConversationMemory()
+    summary, _ = memory.context(conversation(12), turn_budget=60, summary_budget=40)
+    assert memory.tokens <= 40 or len(memory.digests) == 1
+    assert summary.startswith("Earlier topics: ")
+    assert "town0" in summary.splitlines()[0]
+
+
+def test_long_messages_are_truncated():
+    text = " ".join(["word"] * 1_000)
+    summary, recent = app.ConversationMemory().context([{"role": "user", "content": text},
+                                                        {"role": "assistant", "content": "Ok."}])
+    assert recent[0]["content"].endswith(" …")
+    assert app.count_tokens(recent[0]["content"]) <= app.MEMORY_MESSAGE_MAX_TOKENS + 1
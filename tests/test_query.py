@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+from conftest import make_table
+
+
+def chart_of(text):
+    return json.loads(app.JSON_BLOCK_PATTERN.search(text).group(1))
+
+
+def test_validate_query_normalizes_a_model_written_spec(resale_table):
+    query = app.validate_query({
+        "filters": [{"column": "town", "op": "in", "value": ["bedok", "Clementi "]}],
+        "group_by": "flat_type",
+        "metrics": [{"agg": "count"}, {"agg": "count"}, {"agg": "mean", "column": "resale_price"}],
+        "limit": 10_000
+    }, resale_table)
+    # Text values take the column's spelling; duplicate metrics collapse
+    assert query["filters"] == [{"column": "town", "op": "in", "value": ["BEDOK", "CLEMENTI"]}]
+    assert query["group_by"] == ["flat_type"]
+    assert [m["name"] for m in query["metrics"]] == ["count", "mean_resale_price"]
+    assert query["limit"] == app.QUERY_MAX_ROWS
+    assert (query["sort"], query["chart_type"]) == ("desc", "bar")
+
+
+def test_validate_query_defaults_for_a_time_series(resale_table):
+    query = app.validate_query({"group_by": ["year"]}, resale_table)
+    assert (query["sort"], query["chart_type"]) == ("asc_group", "line")
+    assert query["metrics"] == [{"agg": "count", "column": None, "name": "count"}]
+
+
+@pytest.mark.parametrize("spec, message", [
+    ([], "JSON object"),
+    ({"group_by": ["price"]}, "Unknown column"),
+    ({"filters": [{"column": "town", "op": "like", "value": "A"}]}, "Unsupported operator"),
+    ({"filters": [{"column": "year", "op": "between", "value": [1990]}]}, "between"),
+    ({"filters": [{"column": "town", "op": "in", "value": "BEDOK"}]}, "list of values"),
+    ({"filters": [{"column": "town", "op": "==", "value": float("nan")}]}, "single value"),
+    ({"metrics": [{"agg": "mean", "column": "town"}]}, "numeric column"),
+    ({"metrics": [{"agg": "mode", "column": "resale_price"}]}, "Unsupported aggregate"),
+    ({"group_by": ["town", "flat_type", "year"]}, "group-by columns"),
+    ({"sort": "random"}, "Unsupported sort"),
+    ({"limit": "ten"}, "limit"),
+    ({"filters": [{"column": "__class__", "value": 1}]}, "Unknown column"),
+])
+def test_validate_query_rejects(resale_table, spec, message):
+    with pytest.raises(app.QueryError, match=message):
+        app.validate_query(spec, resale_table)
+
+
+@pytest.mark.parametrize("engine", ["numpy", "pandas"])
+@pytest.mark.parametrize("agg", ["count", "sum", "mean", "median", "min", "max", "nunique", "p90"])
+def test_run_query_matches_pandas(resale_table, monkeypatch, engine, agg):
+    monkeypatch.setattr(app, "query_engine_name", lambda: engine)
+    column = "flat_type" if agg == "nunique" else "resale_price"
+    result, matched, query = app.run_query(resale_table, {
+        "filters": [{"column": "year", "op": ">=", "value": 1992}, {"column": "town", "op": "!=", "value": "YISHUN"}],
+        "group_by": ["town"],
+        "metrics": [{"agg": agg, "column": column}],
+        "sort": "asc_group"
+    })
+    frame = resale_table.frame
+    rows = frame[(frame["year"] >= 1992) & (frame["town"] != "YISHUN")]
+    grouped = rows.groupby("town", observed=True)[column]
+    expected = {
+        "count": grouped.size, "p90": lambda: grouped.quantile(0.9), "nunique": grouped.nunique
+    }.get(agg, lambda: grouped.agg(agg))()
+    name = query["metrics"][0]["name"]
+    assert matched == len(rows)
+    assert result["town"].astype(str).tolist() == sorted(map(str, expected.index))
+    assert dict(zip(result["town"].astype(str), result[name])) == pytest.approx(
+        {str(k): v for k, v in expected.items()}
+    )
+
+
+def test_run_query_sorts_and_limits(resale_table):
+    result, _, query = app.run_query(resale_table, {
+        "group_by": ["town"], "metrics": [{"agg": "max", "column": "floor_area_sqm"}], "sort": "asc", "limit": 3
+    })
+    values = result[query["metrics"][0]["name"]].tolist()
+    assert len(values) == 3
+    assert values == sorted(values)
+
+
+def test_run_query_without_matches(resale_table):
+    result, matched, query = app.run_query(resale_table, {
+        "filters": [{"column": "town", "op": "==", "value": "NOWHERE"}], "group_by": ["town"]
+    })
+    assert matched == 0
+    assert app.format_query_result(result, matched, query) == "No rows match that query."
+
+
+def test_format_number_missing_values():
+    assert app.format_number(float("nan")) == "n/a"
+    assert app.format_number(pd.NA) == "n/a"
+    assert app.format_number(1234.0) == "1,234"
+
+
+def test_format_query_result_leaves_missing_groups_off_the_chart():
+    table = make_table(pd.DataFrame({"town": ["A", "A", "B", "B"], "price": [1.0, 3.0, np.nan, np.nan]}))
+    text = app.format_query_result(*app.run_query(table, {"group_by": ["town"], "metrics": [{"column": "price", "agg": "mean"}]}))
+    assert "• B: mean price n/a" in text
+    assert chart_of(text)["data"] == {"labels": ["A"], "values": [2.0]}
+
+
+def test_resolve_query_blocks_inlines_unexpected_errors(monkeypatch):
+    table = make_table(pd.DataFrame({"town": ["A"], "price": [1.0]}))
+    monkeypatch.setattr(app, "query_mode_table", lambda dataset_id: table)
+
+    def broken(table, spec):
+        raise KeyError("price")
+
+    monkeypatch.setattr(app, "run_query", broken)
+    response = app.resolve_query_blocks('Here you go:\n```query\n{"metrics": []}\n```\nMore text', "test")
+    assert response == "Here you go:\nI couldn't run that query: 'price'\nMore text"
+
+
+@pytest.fixture
+def sourced_dataset(tmp_path, monkeypatch):
+    """A dataset whose data_url is a local CSV; returns (source path, Datasets row, ingester)"""
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    source = tmp_path / "source.csv"
+    pd.DataFrame({"town": ["A", "B"], "price": [1, 2]}).to_csv(source, index=False)
+    row = {"dataset_id": "sourced", "dataset_name": "Sourced", "data_url": str(source)}
+    monkeypatch.setattr(app, "get_datasets", lambda: [row])
+    ingester = app.DatasetIngester()
+    monkeypatch.setattr(app, "get_dataset_ingester", lambda: ingester)
+    return source, row, ingester
+
+
+def test_dataset_table_reingests_when_the_source_changes(sourced_dataset):
+    source, _, ingester = sourced_dataset
+    assert len(app.get_dataset_table("sourced", wait=True).frame) == 2
+    pd.DataFrame({"town": ["A", "B", "C"], "price": [1, 2, 3]}).to_csv(source, index=False)
+    os.utime(source, ns=(time.time_ns(), time.time_ns() + 10**9))
+    # Versions are only compared once the check interval has passed
+    assert len(app.get_dataset_table("sourced", wait=True).frame) == 2
+    ingester.interval = 0
+    ingester._checked.clear()
+    assert len(app.get_dataset_table("sourced", wait=True).frame) == 3
+
+
+def test_dataset_table_reingests_when_the_data_url_changes(sourced_dataset, tmp_path):
+    _, row, _ = sourced_dataset
+    assert len(app.get_dataset_table("sourced", wait=True).frame) == 2
+    other = tmp_path / "other.csv"
+    pd.DataFrame({"town": ["C"], "price": [3]}).to_csv(other, index=False)
+    row["data_url"] = str(other)
+    assert app.get_dataset_table("sourced", wait=True).frame["town"].tolist() == ["C"]
+    assert app.ingested_source(app.dataset_table_path("sourced"))["source"] == str(other)
+
+
+def test_failed_refresh_keeps_the_previous_table(sourced_dataset, tmp_path):
+    _, row, _ = sourced_dataset
+    assert len(app.get_dataset_table("sourced", wait=True).frame) == 2
+    row["data_url"] = str(tmp_path / "missing.csv")
+    assert len(app.get_dataset_table("sourced", wait=True).frame) == 2
+
+
+def test_source_checks_run_off_the_calling_thread(sourced_dataset, monkeypatch):
+    _, _, ingester = sourced_dataset
+    released = threading.Event()
+    fetch = app.fetch_source_version
+
+    def slow_fetch(source):
+        released.wait(5)
+        return fetch(source)
+
+    monkeypatch.setattr(app, "fetch_source_version", slow_fetch)
+    monkeypatch.setattr(app, "get_query_settings", lambda: {"enabled": True, "engine": "auto"})
+    start = time.monotonic()
+    assert app.get_dataset_table("sourced") is None
+    assert app.dataset_table_version("sourced") is None
+    assert time.monotonic() - start < 1
+    released.set()
+    deadline = time.monotonic() + 5
+    while app.dataset_table_version("sourced") is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    table = app.get_dataset_table("sourced")
+    assert len(table.frame) == 2
+    assert app.dataset_table_version("sourced") == table.version
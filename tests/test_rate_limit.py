@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def test_admits_within_capacity_without_waiting():
+    limiter = app.RateLimiter("groq", requests_per_minute=60, tokens_per_minute=6_000)
+    waits = [limiter.acquire(100, max_wait=1) for _ in range(5)]
+    assert max(waits) < 0.05
+    assert limiter.requests.level == pytest.approx(55, abs=0.1)
+    assert limiter.tokens.level == pytest.approx(5_500, abs=5)
+
+
+def test_waits_for_the_bucket_to_refill():
+    limiter = app.RateLimiter("groq", requests_per_minute=600)
+    limiter.requests.level = 0
+    waited = limiter.acquire(1, max_wait=1)
+    # 600 per minute refills one request every 0.1 s
+    assert 0.05 < waited < 0.5
+
+
+def test_sheds_requests_that_would_wait_too_long():
+    limiter = app.RateLimiter("groq", tokens_per_minute=600)
+    limiter.tokens.level = 0
+    with pytest.raises(app.RateLimited) as raised:
+        limiter.acquire(300, max_wait=1)
+    assert raised.value.retry_after == pytest.approx(30, abs=1)
+    assert not limiter._waiting
+
+
+def test_oversized_requests_are_capped_at_capacity():
+    limiter = app.RateLimiter("groq", tokens_per_minute=1_000)
+    assert limiter.acquire(50_000, max_wait=0) == pytest.approx(0, abs=0.05)
+
+
+def test_provider_headers_lower_the_buckets():
+    limiter = app.RateLimiter("groq", requests_per_minute=30, tokens_per_minute=6_000)
+    limiter.update(200, {"x-ratelimit-remaining-requests": "3", "x-ratelimit-remaining-tokens": "1200"})
+    assert limiter.requests.level <= 3.1
+    assert limiter.tokens.level <= 1_201
+
+
+def test_exhausted_headers_and_429_block_until_reset():
+    limiter = app.RateLimiter("groq")
+    now = time.monotonic()
+    limiter.update(200, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2m0.5s"})
+    assert limiter.blocked_until == pytest.approx(now + 120.5, abs=1)
+    limiter = app.RateLimiter("groq")
+    limiter.update(429, {"retry-after": "250ms"})
+    assert limiter.blocked_until - now < 1
+    with pytest.raises(app.RateLimited):
+        limiter.acquire(1, max_wait=0)
+    assert limiter.acquire(1, max_wait=1) > 0
+
+
+def test_callers_are_admitted_in_arrival_order():
+    limiter = app.RateLimiter("groq", requests_per_minute=1_200)
+    limiter.requests.level = 0
+    order = []
+
+    def call(i):
+        limiter.acquire(1, max_wait=5)
+        order.append(i)
+
+    threads = []
+    for i in range(4):
+        threads.append(threading.Thread(target=call, args=(i,)))
+        threads[-1].start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize("value, seconds", [("12", 12), ("1.5", 1.5), ("250ms", 0.25), ("2m59.56s", 179.56), ("", None)])
+def test_parse_rate_limit_reset(value, seconds):
+    assert app.parse_rate_limit_reset(value) == (pytest.approx(seconds) if seconds is not None else None)
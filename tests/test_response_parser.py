@@ -0,0 +1,73 @@
+import random
+import re
+
+import pytest
+
+import app
+
+FRAGMENTS = [
+    "The highest price town is Pasir Ris at $373,272.",
+    "Key insights:\n\n• Pasir Ris is **highest**\n• Sembawang is *lowest*",
+    "Use `resale_price` for the _average_ figures.",
+    '```json\n{"chart_type": "bar", "title": "Towns", "data": {"labels": ["A", "B"], "values": [1, 2]}}\n```',
+    '```json\n{"chart_type": "line", "data": {"labels": [1990, 1991], "values": [3, 4]}}```',
+    "```json\n{not valid json}\n```",
+    "```json\n{\"chart_type\": \"pie\"",
+    "[DASHBOARD:https://app.powerbi.com/view?r=abc]",
+    "[DASHBOARD:https://example.com/embed?id=2]",
+    "Follow-up questions:\n1. Which flat types have seen the biggest price increases?\n2. Would you like a chart?\n3. How do prices compare across regions?",
+    "FOLLOW-UP QUESTIONS:\n- Which towns have the most transactions in 1995?\n- Do you prefer bar charts?",
+    "Some follow up ideas:\n• What drives the gap between towns?\n• Is there seasonality?",
+    "1. Which regions have the highest nightly prices?",
+    "Short?",
+    "",
+]
+
+
+def separate_helpers(response):
+    """What the app computed before parse_response: one helper per part"""
+    dashboard = re.search(r'\[DASHBOARD:(.*?)\]', response)
+    body = app.clean_response_for_display(re.sub(r'\[DASHBOARD:.*?\]', '', response))
+    return (
+        body,
+        app.parse_chart_from_response(response),
+        dashboard.group(1) if dashboard else None,
+        app.extract_followup_questions(response),
+    )
+
+
+def single_pass(response):
+    parsed = app.parse_response(response)
+    return (
+        parsed.body,
+        parsed.chart,
+        parsed.dashboards[0] if parsed.dashboards else None,
+        list(parsed.followups),
+    )
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_parse_response_matches_the_separate_helpers(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        response = "\n\n".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 8)))
+        assert single_pass(response) == separate_helpers(response), response
+
+
+def test_parse_response_parts():
+    parsed = app.parse_response(
+        'Intro.\n\n```json\n{"chart_type": "bar", "data": {"labels": ["A"], "values": [1]}}\n```\n'
+        "[DASHBOARD:https://example.com/a]\n\nFollow-up questions:\n"
+        "1. Which towns are cheapest?\n2. Would you like a chart?\n3. How do prices vary by year?"
+    )
+    assert parsed.body == "Intro."
+    assert parsed.blocks == ("Intro.",)
+    assert parsed.chart == {"chart_type": "bar", "data": {"labels": ["A"], "values": [1]}}
+    assert parsed.dashboards == ("https://example.com/a",)
+    # Questions that ask the user for preferences are dropped
+    assert parsed.followups == ("Which towns are cheapest?", "How do prices vary by year?")
+
+
+def test_parse_response_keeps_only_the_first_chart():
+    parsed = app.parse_response('```json\n{not json}\n```\n\n```json\n{"chart_type": "pie"}\n```')
+    assert parsed.chart is None
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import app
+
+
+class FakeSheet:
+    """Stands in for the HTTP session: serves one CSV and honours If-None-Match"""
+
+    def __init__(self, csv, etag="v1"):
+        self.csv, self.etag = csv, etag
+        self.requests = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = False
+
+    def get(self, url, headers=None, timeout=None):
+        self.gate.wait(5)
+        self.requests.append(dict(headers or {}))
+        if self.fail:
+            raise ConnectionError("sheet unreachable")
+        if (headers or {}).get("If-None-Match") == self.etag:
+            return FakeResponse(304, b"", self.etag)
+        return FakeResponse(200, self.csv.encode("utf-8"), self.etag)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, etag):
+        self.status_code, self.content, self.headers = status_code, content, {"ETag": etag}
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    fake = FakeSheet("town,price\nA,1\nB,2\n")
+    monkeypatch.setattr(app, "get_http_session", lambda: fake)
+    return fake
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def make_stale(sync, tab="Data"):
+    sync._fetched_at[tab] -= sync.interval + 1
+
+
+def test_reads_within_the_interval_stay_off_the_network(sheet):
+    sync = app.SheetSync("sheet", interval=60)
+    first = sync.get("Data")
+    assert first.frame["town"].tolist() == ["A", "B"]
+    assert sync.get("Data") is first
+    assert len(sheet.requests) == 1
+
+
+def test_stale_tab_is_served_while_it_revalidates(sheet):
+    sync = app.SheetSync("sheet", interval=60)
+    old = sync.get("Data")
+    sheet.csv, sheet.etag = "town,price\nA,1\nB,2\nC,3\n", "v2"
+    sheet.gate.clear()
+    make_stale(sync)
+    start = time.monotonic()
+    assert sync.get("Data") is old
+    assert time.monotonic() - start < 1
+    sheet.gate.set()
+    wait_for(lambda: sync.get("Data") is not old)
+    assert sync.get("Data").frame["town"].tolist() == ["A", "B", "C"]
+    assert sync.get("Data").etag == "v2"
+
+
+def test_not_modified_keeps_the_snapshot(sheet):
+    sync = app.SheetSync("sheet", interval=60)
+    first = sync.get("Data")
+    make_stale(sync)
+    assert sync.refresh("Data") is first
+    assert sheet.requests[-1] == {"If-None-Match": "v1"}
+    assert sync._fetched_at["Data"] > time.time() - 5
+
+
+def test_unchanged_content_is_not_reparsed(sheet):
+    sync = app.SheetSync("sheet", interval=60)
+    first = sync.get("Data")
+    sheet.etag = "v1-regenerated"
+    assert sync.refresh("Data") is first
+
+
+def test_failed_fetch_keeps_the_snapshot(sheet):
+    sync = app.SheetSync("sheet", interval=60)
+    first = sync.get("Data")
+    sheet.fail = True
+    assert sync.refresh("Data") is first
+
+
+def test_disk_cache_round_trip(tmp_path):
+    disk = app.SheetDiskCache(str(tmp_path), "sheet/id")
+    frame = pd.DataFrame({"town": ["A", "B"], "price": [1.5, None]})
+    manifest = disk.store("Data", frame, "v1", "etag-1", 100.0)
+    assert disk.manifest("Data") == manifest
+    snapshot = disk.load("Data", manifest)
+    assert (snapshot.version, snapshot.etag, snapshot.changed_at) == ("v1", "etag-1", 100.0)
+    assert snapshot.frame["town"].tolist() == ["A", "B"]
+    assert snapshot.frame["price"].isna().tolist() == [False, True]
+    # A new version replaces the old file
+    disk.store("Data", frame.head(1), "v2", "etag-2", 200.0)
+    assert sorted(p.name for p in (tmp_path / "sheet_id").glob("*.arrow")) == ["Data.v2.arrow"]
+    disk.touch("Data", 300.0)
+    assert disk.manifest("Data")["fetched_at"] == 300.0
+
+
+def test_disk_copy_spares_other_workers_the_download(sheet, tmp_path):
+    first = app.SheetSync("sheet", interval=60, disk=app.SheetDiskCache(str(tmp_path), "sheet"))
+    assert first.get("Data").frame["town"].tolist() == ["A", "B"]
+    # A second worker (or a restart) starts from the disk copy
+    second = app.SheetSync("sheet", interval=60, disk=app.SheetDiskCache(str(tmp_path), "sheet"))
+    assert second.get("Data").frame["town"].tolist() == ["A", "B"]
+    assert len(sheet.requests) == 1
+    # Its own refresh reuses the recent fetch instead of the network
+    assert second.refresh("Data").version == first.get("Data").version
+    assert len(sheet.requests) == 1
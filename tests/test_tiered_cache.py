@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+QUESTION = "Which towns have the highest prices?"
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / "shared.sqlite")
+
+
+def replica(path, **kwargs):
+    """A TieredCache as one Streamlit replica sees it: its own L1, the shared L2"""
+    return app.TieredCache(app.MemoryCacheBackend(), app.SQLiteCacheBackend(path), **kwargs)
+
+
+def test_values_reach_other_replicas_through_l2(shared_path):
+    first, second = replica(shared_path), replica(shared_path)
+    first.set("k", "v", 60)
+    assert second.get("k") == "v"
+    assert second.get("k") == "v"
+    assert (second.counts["l2_hits"], second.counts["l1_hits"]) == (1, 1)
+
+
+def test_l1_copies_expire_after_l1_ttl(shared_path):
+    first, second = replica(shared_path, l1_ttl=0.2), replica(shared_path, l1_ttl=0.2)
+    first.set("k", "old", 60)
+    assert second.get("k") == "old"
+    first.set("k", "new", 60)
+    assert second.get("k") == "old"
+    time.sleep(0.3)
+    assert second.get("k") == "new"
+
+
+def test_get_or_load_coalesces_callers_in_every_replica(shared_path):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.3)
+        return "loaded"
+
+    caches = [replica(shared_path) for _ in range(3)]
+    results = []
+    threads = [
+        threading.Thread(target=lambda cache=cache: results.append(cache.get_or_load("k", loader, 60)))
+        for cache in caches for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ["loaded"] * 12
+
+
+def test_get_or_load_does_not_cache_none(shared_path):
+    cache = replica(shared_path)
+    assert cache.get_or_load("k", lambda: None, 60) is None
+    assert cache.get_or_load("k", lambda: "later", 60) == "later"
+
+
+def test_lease_of_a_crashed_loader_expires(shared_path):
+    crashed, waiting = replica(shared_path, lease_ttl=0.3), replica(shared_path)
+    assert crashed.claim("k") == (None, True)  # never released
+    start = time.monotonic()
+    assert waiting.claim("k", timeout=5) == (None, True)
+    assert 0.2 < time.monotonic() - start < 2
+
+
+def test_claim_gives_up_after_timeout(shared_path):
+    holder, waiting = replica(shared_path), replica(shared_path)
+    holder.claim("k")
+    assert waiting.claim("k", timeout=0.2) == (None, False)
+    holder.release("k")
+    assert waiting.claim("k", timeout=0.2) == (None, True)
+
+
+@pytest.fixture
+def coalesced_jobs(shared_path, monkeypatch):
+    """A job queue whose answers coalesce through a SQLite L2, and a second replica's cache"""
+    cache = app.ResponseCache(replica(shared_path))
+    monkeypatch.setattr(app, "get_response_cache", lambda: cache)
+    key = app.ResponseCache.make_key(app.response_cache_scope("groq", "test", app.EMPTY_STATS), QUESTION)
+    return app.LLMJobQueue({"groq": 1}), key, replica(shared_path)
+
+
+def coalesced(run, finalized):
+    return app.coalesce_across_replicas("groq", "test", app.EMPTY_STATS, QUESTION, run, finalized.append)
+
+
+def wait_done(job):
+    deadline = time.monotonic() + 5
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.done
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_cancelled_job_frees_the_lease(coalesced_jobs, stream):
+    jobs, key, other = coalesced_jobs
+    started = threading.Event()
+
+    def run(stop):
+        # Like an aborted provider stream: cancel makes the stream end normally
+        ended = threading.Event()
+        stop.on_cancel(ended.set)
+
+        def chunks():
+            yield "partial"
+            started.set()
+            ended.wait(5)
+
+        if stream:
+            return chunks()
+        started.set()
+        ended.wait(5)
+        return ["partial"]
+
+    finalized = []
+    job = jobs.submit("session", "groq", *coalesced(run, finalized))
+    assert started.wait(5)
+    jobs.cancel(job.id)
+    wait_done(job)
+    assert job.status == "cancelled" and finalized == []
+    assert other.claim(key, timeout=0.2) == (None, True)
+
+
+def test_failed_run_frees_the_lease(coalesced_jobs):
+    jobs, key, other = coalesced_jobs
+
+    def run(stop):
+        raise RuntimeError("provider down")
+
+    job = jobs.submit("session", "groq", *coalesced(run, []))
+    wait_done(job)
+    assert job.status == "failed"
+    assert other.claim(key, timeout=0.2) == (None, True)
+
+
+def test_finished_job_stores_the_answer_for_other_replicas(coalesced_jobs):
+    jobs, key, other = coalesced_jobs
+    cache = app.get_response_cache()
+
+    def finalize(response):
+        cache.backend.set(key, response, 60)
+
+    run, finalize = app.coalesce_across_replicas(
+        "groq", "test", app.EMPTY_STATS, QUESTION, lambda stop: iter(["an ", "answer"]), finalize
+    )
+    job = jobs.submit("session", "groq", run, finalize)
+    wait_done(job)
+    assert job.status == "done"
+    assert other.claim(key, timeout=0.2) == ("an answer", False)